@@ -0,0 +1,76 @@
+"""CPU benchmark of the degree-bucketed aggregation against the sparse kernels, on the batches of a graph.
+
+    python -m benchmarks.aggregation --graphs power-law uniform --num-nodes 1000000 --output aggregation.json
+"""
+import argparse
+import json
+import time
+
+import torch
+import dgl
+import dgl.function as fn
+
+from inference_helper.bucketed_block import BucketedBlock, DEGREE_BUCKETS
+from .synthetic import make_graph, make_features
+
+
+def time_update_all(blocks, feats, reducer, bucketed):
+    # the bucket plan of a block is made in its first update_all, and is part of the time
+    st = time.perf_counter()
+    for block, feat in zip(blocks, feats):
+        if bucketed:
+            block = BucketedBlock.wrap(block)
+        with block.local_scope():
+            block.srcdata['h'] = feat
+            block.update_all(fn.copy_u('h', 'm'), getattr(fn, reducer)('m', 'out'))
+    return time.perf_counter() - st
+
+
+def main(args):
+    torch.set_num_threads(args.num_threads)
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    results = []
+    for kind in args.graphs:
+        for num_nodes in args.num_nodes:
+            graph = make_graph(kind, num_nodes, args.avg_degree, args.seed)
+            feat = make_features(num_nodes, args.in_feats, args.seed)
+            blocks, feats = [], []
+            for start in range(0, num_nodes, args.batch_size):
+                input_nodes, _, sampled = sampler.sample_blocks(
+                    graph, torch.arange(start, min(start + args.batch_size, num_nodes)))
+                blocks.append(sampled[0])
+                feats.append(feat[input_nodes])
+            degrees = graph.in_degrees()
+            for reducer in args.reducers:
+                record = {"graph": kind, "num_nodes": num_nodes, "num_edges": graph.num_edges(), "reducer": reducer,
+                          "bucketed_edges": int(degrees[degrees <= DEGREE_BUCKETS[-1]].sum()) / graph.num_edges()}
+                for bucketed in (False, True):
+                    # the first run warms up the allocator
+                    time_update_all(blocks[:1], feats[:1], reducer, bucketed)
+                    key = "bucketed_time" if bucketed else "sparse_time"
+                    record[key] = min(time_update_all(blocks, feats, reducer, bucketed) for _ in range(args.repeat))
+                record["speedup"] = record["sparse_time"] / record["bucketed_time"]
+                print(json.dumps(record))
+                results.append(record)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--graphs', nargs='+', default=["power-law", "uniform"])
+    argparser.add_argument('--num-nodes', nargs='+', type=int, default=[100000])
+    argparser.add_argument('--avg-degree', type=int, default=10)
+    argparser.add_argument('--in-feats', type=int, default=128)
+    argparser.add_argument('--batch-size', type=int, default=10000)
+    argparser.add_argument('--reducers', nargs='+', default=["sum", "mean", "max"])
+    argparser.add_argument('--repeat', type=int, default=3)
+    argparser.add_argument('--num-threads', type=int, default=torch.get_num_threads())
+    argparser.add_argument('--seed', type=int, default=20)
+    argparser.add_argument('--output', type=str, default=None)
+    args = argparser.parse_args()
+
+    main(args)
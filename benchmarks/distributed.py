@@ -0,0 +1,78 @@
+"""Distributed layer-wise inference over local gloo processes, with the timing and the halo volume of every rank.
+
+    python -m benchmarks.distributed --graph power-law --num-nodes 1000000 --world-size 4 --output dist.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from inference_helper import DistributedInferenceHelper
+from .models import build_model
+from .synthetic import make_graph, make_features
+
+
+def run_rank(rank, args, init_method, results):
+    torch.set_num_threads(max(args.num_threads // args.world_size, 1))
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=args.world_size)
+    graph = make_graph(args.graph, args.num_nodes, args.avg_degree, args.seed)
+    torch.manual_seed(args.seed)
+    model = build_model(args.model, args.in_feats, args.num_hidden, args.num_classes, args.num_layers,
+                        args.num_heads).eval()
+    with torch.no_grad():
+        helper = DistributedInferenceHelper(model, args.batch_size, torch.device('cpu'),
+                                            balance_edges=not args.balance_nodes,
+                                            halo_chunk_rows=args.halo_chunk_rows)
+        start, end = helper.partition(graph)
+        feat = make_features(args.num_nodes, args.in_feats, args.seed)[start:end]
+        dist.barrier()
+        st = time.perf_counter()
+        helper.inference(graph, feat)
+        record = dict(helper.dist_stats)
+    record["time"] = time.perf_counter() - st
+    record["range"] = (start, end)
+    results[rank] = record
+    dist.destroy_process_group()
+
+
+def main(args):
+    results = mp.Manager().dict()
+    with tempfile.TemporaryDirectory() as store_dir:
+        init_method = "file://{}".format(os.path.join(store_dir, "store"))
+        mp.spawn(run_rank, args=(args, init_method, results), nprocs=args.world_size)
+    records = [results[rank] for rank in range(args.world_size)]
+    for record in records:
+        print(json.dumps(record))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(records, f, indent=2)
+    return records
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--graph', type=str, default="power-law")
+    argparser.add_argument('--num-nodes', type=int, default=100000)
+    argparser.add_argument('--avg-degree', type=int, default=10)
+    argparser.add_argument('--model', type=str, default="SAGE")
+    argparser.add_argument('--num-layers', type=int, default=3)
+    argparser.add_argument('--num-hidden', type=int, default=128)
+    argparser.add_argument('--num-classes', type=int, default=32)
+    argparser.add_argument('--num-heads', type=int, default=2)
+    argparser.add_argument('--in-feats', type=int, default=128)
+    argparser.add_argument('--batch-size', type=int, default=10000)
+    argparser.add_argument('--world-size', type=int, default=2)
+    argparser.add_argument('--balance-nodes', help="own the same number of nodes instead of in-edges per rank",
+                           action="store_true")
+    argparser.add_argument('--halo-chunk-rows', type=int, default=1 << 20)
+    argparser.add_argument('--num-threads', type=int, default=torch.get_num_threads())
+    argparser.add_argument('--seed', type=int, default=20)
+    argparser.add_argument('--output', type=str, default=None)
+    args = argparser.parse_args()
+
+    main(args)
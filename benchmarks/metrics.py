@@ -0,0 +1,28 @@
+import resource
+
+from inference_helper.utils import get_peak_rss, reset_peak_rss
+
+
+def peak_rss():
+    try:
+        return get_peak_rss()
+    except (OSError, RuntimeError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def layer_records(summary):
+    records = []
+    for layer_id, stat in summary["layers"].items():
+        records.append({
+            "layer": layer_id,
+            "time": stat["time"],
+            "phases": {name: phase["time"] for name, phase in stat["phases"].items()},
+            "bytes_gathered": stat["counters"].get("bytes gathered", 0),
+        })
+    return records
+
+
+def throughput(record, num_nodes, num_edges, num_layers):
+    record["nodes_per_sec"] = num_nodes * num_layers / record["time"] if record["time"] > 0 else None
+    record["edges_per_sec"] = num_edges * num_layers / record["time"] if record["time"] > 0 else None
+    return record
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "exp", "baseline")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from model.gcn import StochasticTwoLayerGCN
+from model.sage import SAGE
+from model.gat import GAT
+from exp_model.gcn import StochasticTwoLayerGCN as ExpGCN
+from exp_model.sage import SAGE as ExpSAGE
+from exp_model.gat import GAT as ExpGAT
+from exp_model.jknet import JKNet
+
+
+# name -> (builder, hand-written inference)
+# builder: (in_feats, hidden, classes, num_layers, num_heads) -> nn.Module
+# inference: (model, graph, feat, batch_size, device) -> Tensor
+MODELS = {
+    "GCN": (
+        lambda i, h, c, l, n: StochasticTwoLayerGCN(i, h, c),
+        lambda m, g, x, bs, device: m.inference(g, bs, device, x)),
+    "SAGE": (
+        lambda i, h, c, l, n: SAGE(i, h, c, l, F.relu, 0.5),
+        lambda m, g, x, bs, device: m.inference(g, bs, device, x)),
+    "GAT": (
+        lambda i, h, c, l, n: GAT(l, i, h, c, [n for _ in range(l)], F.relu, 0.5, 0.5, 0.2, False),
+        lambda m, g, x, bs, device: m.inference(g, bs, device, x)),
+    "exp.GCN": (
+        lambda i, h, c, l, n: ExpGCN(l, i, h, c),
+        lambda m, g, x, bs, device: m.inference(g, bs, device, x, _nids(g))),
+    "exp.SAGE": (
+        lambda i, h, c, l, n: ExpSAGE(i, h, c, l, F.relu, 0.5),
+        lambda m, g, x, bs, device: m.inference(g, bs, device, x)),
+    "exp.GAT": (
+        lambda i, h, c, l, n: ExpGAT(l, i, h, c, [n for _ in range(l)], F.relu, 0.5, 0.5, 0.2, False),
+        lambda m, g, x, bs, device: m.inference(g, bs, device, x, _nids(g))),
+    "exp.JKNET": (
+        lambda i, h, c, l, n: JKNet(i, h, c, l),
+        lambda m, g, x, bs, device: m.inference(g, bs, device, x, _nids(g), False)),
+}
+
+
+def _nids(g):
+    return torch.arange(g.number_of_nodes()).to(g.device)
+
+
+def build_model(name, in_feats, hidden, classes, num_layers, num_heads):
+    if name not in MODELS:
+        raise NotImplementedError("Unknown model: {}.".format(name))
+    return MODELS[name][0](in_feats, hidden, classes, num_layers, num_heads)
+
+
+def handwritten_inference(name, model, graph, feat, batch_size, device):
+    return MODELS[name][1](model, graph, feat, batch_size, device)
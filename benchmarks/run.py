@@ -0,0 +1,179 @@
+"""Reproducible CPU benchmark of the inference engines on seeded synthetic graphs.
+
+    python -m benchmarks.run --graphs uniform power-law --num-nodes 100000 1000000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import time
+import traceback
+
+import numpy as np
+import torch
+import dgl
+
+from inference_helper import InferenceHelper, EdgeControlInferenceHelper, AutoInferenceHelper, \
+    ThroughputInferenceHelper
+from .synthetic import make_graph, make_features
+from .models import MODELS, build_model, handwritten_inference
+from .metrics import layer_records, reset_peak_rss, peak_rss, throughput
+
+ENGINES = ("InferenceHelper", "EdgeControlInferenceHelper", "AutoInferenceHelper", "ThroughputInferenceHelper",
+           "handwritten")
+
+
+def setup_seed(seed):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def build_helper(engine, model, args):
+    device = torch.device(args.device)
+    if engine == "InferenceHelper":
+        return InferenceHelper(model, args.batch_size, device, num_workers=0, profile=True)
+    if engine == "EdgeControlInferenceHelper":
+        return EdgeControlInferenceHelper(model, args.max_edge_in_batch, device, num_workers=0, profile=True)
+    if engine == "AutoInferenceHelper":
+        return AutoInferenceHelper(model, device, use_uva=False, free_rate=args.free_rate, use_random=False,
+                                   profile=True)
+    if engine == "ThroughputInferenceHelper":
+        return ThroughputInferenceHelper(model, device, start_max_edge=args.max_edge_in_batch,
+                                         memory_rate=args.free_rate, profile=True)
+    raise NotImplementedError("Unknown engine: {}.".format(engine))
+
+
+def run_engine(engine, model_name, graph_name, graph, feat, args, batch_order=None):
+    setup_seed(args.seed)
+    model = build_model(model_name, feat.shape[1], args.num_hidden, args.num_classes,
+                        args.num_layers, args.num_heads)
+    model = model.to(torch.device(args.device)).eval()
+
+    record = {"engine": engine, "model": model_name, "batch_order": batch_order}
+    rss_reset = reset_peak_rss()
+    with torch.no_grad():
+        if engine == "handwritten":
+            st = time.perf_counter()
+            handwritten_inference(model_name, model, graph, feat, args.batch_size, torch.device(args.device))
+            record["time"] = time.perf_counter() - st
+            record["layers"] = None
+            record["bytes_gathered"] = None
+            record["oom_retries"] = None
+            record["cache_flushes"] = None
+            record["staging_allocations"] = None
+            record["plan"] = None
+            record["compile"] = None
+            record["fusion"] = None
+            record["tuner"] = None
+            record["throughput_tuner"] = None
+        else:
+            helper = build_helper(engine, model, args)
+            helper.compile_layers = args.compile
+            helper.attention_chunk_edges = args.attention_chunk_edges
+            helper.fuse_layers = args.fuse_layers
+            helper.batch_order = batch_order
+            helper.expansion_threshold = args.expansion_threshold
+            helper.ret_shapes = helper._trace_output_shape((feat,))
+            record["plan"] = helper.plan(graph, feat, free_rate=args.free_rate)
+            st = time.perf_counter()
+            helper.inference(graph, feat)
+            record["time"] = time.perf_counter() - st
+            summary = helper.profiler.summary()
+            record["layers"] = [throughput(layer, graph.num_nodes(), graph.num_edges(), 1)
+                                for layer in layer_records(summary)]
+            record["bytes_gathered"] = summary["counters"].get("bytes gathered", 0)
+            record["oom_retries"] = summary["counters"].get("oom retries", 0)
+            record["cache_flushes"] = summary["counters"].get("cache flushes", 0)
+            record["staging_allocations"] = summary["counters"].get("staging allocations", 0)
+            record["compile"] = list(helper.compile_stats.values()) if args.compile else None
+            record["fusion"] = list(helper.fusion_stats.values()) if args.fuse_layers > 1 else None
+            # the stability of the edge budget, and how even the batches are
+            record["tuner"] = list(helper.tuner_stats.values()) if engine == "AutoInferenceHelper" else None
+            record["throughput_tuner"] = list(helper.throughput_stats.values()) \
+                if engine == "ThroughputInferenceHelper" else None
+            if args.trace_dir is not None:
+                helper.profiler.export_chrome_trace(os.path.join(args.trace_dir, "{}-{}-{}-{}.json".format(
+                    graph_name, graph.num_nodes(), model_name, engine)))
+    record["peak_rss"] = peak_rss()
+    record["peak_rss_reset"] = rss_reset
+    num_layers = len(record["layers"]) if record["layers"] else args.num_layers
+    return throughput(record, graph.num_nodes(), graph.num_edges(), num_layers)
+
+
+def main(args):
+    torch.set_num_threads(args.num_threads)
+    report = {
+        "meta": {
+            "torch": torch.__version__,
+            "dgl": dgl.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "num_threads": torch.get_num_threads(),
+            "device": args.device,
+            "args": vars(args),
+        },
+        "results": [],
+    }
+    for kind in args.graphs:
+        for num_nodes in args.num_nodes:
+            graph = make_graph(kind, num_nodes, args.avg_degree, args.seed)
+            feat = make_features(num_nodes, args.in_feats, args.seed)
+            for model_name in args.models:
+                for engine in args.engines:
+                    for batch_order in args.batch_orders:
+                        if engine == "handwritten" and batch_order is not None:
+                            continue
+                        case = {"graph": kind, "num_nodes": graph.num_nodes(), "num_edges": graph.num_edges()}
+                        try:
+                            case.update(run_engine(engine, model_name, kind, graph, feat, args, batch_order))
+                        except Exception as e:
+                            case.update({"engine": engine, "model": model_name, "batch_order": batch_order,
+                                         "error": repr(e)})
+                            if args.debug:
+                                traceback.print_exc()
+                        print(json.dumps(case))
+                        report["results"].append(case)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--graphs', nargs='+', default=["uniform", "power-law"])
+    argparser.add_argument('--num-nodes', nargs='+', type=int, default=[100000])
+    argparser.add_argument('--avg-degree', type=int, default=10)
+    argparser.add_argument('--models', nargs='+', default=list(MODELS.keys()))
+    argparser.add_argument('--engines', nargs='+', default=list(ENGINES))
+    argparser.add_argument('--in-feats', type=int, default=128)
+    argparser.add_argument('--num-hidden', type=int, default=128)
+    argparser.add_argument('--num-classes', type=int, default=16)
+    argparser.add_argument('--num-layers', type=int, default=3)
+    argparser.add_argument('--num-heads', type=int, default=2)
+    argparser.add_argument('--batch-size', type=int, default=2000)
+    argparser.add_argument('--max-edge-in-batch', type=int, default=500000)
+    argparser.add_argument('--free-rate', help="free memory rate", type=float, default=0.9)
+    argparser.add_argument('--num-threads', type=int, default=torch.get_num_threads())
+    argparser.add_argument('--device', type=str, default='cpu')
+    argparser.add_argument('--seed', type=int, default=20)
+    argparser.add_argument('--output', type=str, default=None)
+    argparser.add_argument('--trace-dir', help="export a chrome trace of every helper run", type=str, default=None)
+    argparser.add_argument('--compile', help="run the helpers' conv_block functions by torch.compile",
+                           action="store_true")
+    argparser.add_argument('--attention-chunk-edges', help="run the GAT attention over slices of this many edges",
+                           type=int, default=None)
+    argparser.add_argument('--fuse-layers', help="run up to this many layers in one pass for the batches whose "
+                           "k-hop blocks are small enough", type=int, default=1)
+    argparser.add_argument('--expansion-threshold', help="fuse a batch when its k-hop blocks have at most this "
+                           "many times the edges of running the layers one by one", type=float, default=1.5)
+    argparser.add_argument('--batch-orders', help="orders of the dst nodes in the batches to compare: natural, "
+                           "degree or degree-buckets", nargs='+', default=["natural"])
+    argparser.add_argument('--debug', action="store_true")
+    args = argparser.parse_args()
+    args.batch_orders = [None if order == "natural" else order for order in args.batch_orders]
+
+    main(args)
@@ -0,0 +1,51 @@
+import numpy as np
+import torch
+import dgl
+
+
+def _to_graph(src, dst, num_nodes):
+    g = dgl.graph((torch.from_numpy(src), torch.from_numpy(dst)), num_nodes=num_nodes)
+    # every node needs at least one in-edge for GraphConv / GATConv.
+    g = dgl.remove_self_loop(g)
+    g = dgl.add_self_loop(g)
+    return g
+
+
+def uniform_graph(num_nodes, avg_degree, seed):
+    rng = np.random.default_rng(seed)
+    num_edges = num_nodes * avg_degree
+    src = rng.integers(0, num_nodes, num_edges, dtype=np.int64)
+    dst = rng.integers(0, num_nodes, num_edges, dtype=np.int64)
+    return _to_graph(src, dst, num_nodes)
+
+
+def power_law_graph(num_nodes, avg_degree, seed, exponent=2.1):
+    # Chung-Lu style: both endpoints are drawn proportionally to a power-law weight,
+    # so the expected degree distribution follows P(k) ~ k^-exponent.
+    rng = np.random.default_rng(seed)
+    num_edges = num_nodes * avg_degree
+    weights = np.arange(1, num_nodes + 1, dtype=np.float64) ** (-1.0 / (exponent - 1.0))
+    # hubs should not all sit at the beginning of the id space.
+    rng.shuffle(weights)
+    cdf = np.cumsum(weights)
+    cdf /= cdf[-1]
+    src = np.searchsorted(cdf, rng.random(num_edges)).astype(np.int64)
+    dst = np.searchsorted(cdf, rng.random(num_edges)).astype(np.int64)
+    return _to_graph(src, dst, num_nodes)
+
+
+GRAPH_GENERATORS = {
+    "uniform": uniform_graph,
+    "power-law": power_law_graph,
+}
+
+
+def make_graph(kind, num_nodes, avg_degree, seed):
+    if kind not in GRAPH_GENERATORS:
+        raise NotImplementedError("Unknown synthetic graph: {}.".format(kind))
+    return GRAPH_GENERATORS[kind](num_nodes, avg_degree, seed)
+
+
+def make_features(num_nodes, dim, seed):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand((num_nodes, dim), generator=generator)
@@ -74,7 +74,10 @@ class GAT(nn.Module):
         for k in list(g.edata.keys()):
             g.edata.pop(k)
 
-        torch.cuda.reset_peak_memory_stats()
+        on_cuda = torch.device(device).type == 'cuda'
+        if on_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        profiler = Profiler(device)
         for l, layer in enumerate(self.gat_layers):
             gc.collect()
             th.cuda.empty_cache()
@@ -95,43 +98,31 @@ class GAT(nn.Module):
                 use_uva=use_uva,
                 device=device,
                 num_workers=0)
-            memorys = []
-            
-            profiler = Profiler()
-            profiler.record_and_reset()
-            # for input_nodes, output_nodes, blocks in tqdm.tqdm(dataloader):
-            for input_nodes, output_nodes, blocks in dataloader:
-                torch.cuda.empty_cache()
-                profiler.tag()
-                profiler.record_name("total input nodes", input_nodes.shape[0])
-                # print(blocks)
-                block = blocks[0].to(device)
-                if use_uva:
-                    h = gather_pinned_tensor_rows(x, input_nodes)
-                else:
-                    h = x[input_nodes].to(device)
-                profiler.tag()
-                # print(h.shape, "%.2f"%(profiler.last()), "s;", "%.2f"%(h.shape[0]*h.shape[1]*4/1000**3), "GB;", "%.2f"%(h.shape[0]*h.shape[1]*4 / profiler.last() / 1000**3), "GB/s")
-
-                h = layer(block, h)
-                if l == self.num_layers - 1:
-                    logits = h.mean(1)
-                    profiler.tag()
-                    y[output_nodes] = logits.cpu()
-                else:
-                    h = h.flatten(1)
-                    profiler.tag()
-                    update_out_in_chunks(y, output_nodes, h)
-                profiler.tag()
-
-                th.cuda.empty_cache()
-                profiler.record_and_reset()
-                memorys.append(torch.cuda.max_memory_allocated() // 1024 ** 2)
+            with profiler.layer(l):
+                for input_nodes, output_nodes, blocks in profiler.batches(dataloader):
+                    torch.cuda.empty_cache()
+                    profiler.count("input nodes", input_nodes.shape[0])
+                    with profiler.span("gather"):
+                        block = blocks[0].to(device)
+                        if use_uva:
+                            h = gather_pinned_tensor_rows(x, input_nodes)
+                        else:
+                            h = x[input_nodes].to(device)
+
+                    with profiler.span("compute"):
+                        h = layer(block, h)
+                        if l == self.num_layers - 1:
+                            h = h.mean(1)
+                        else:
+                            h = h.flatten(1)
+                    with profiler.span("write-back"):
+                        update_out_in_chunks(y, output_nodes, h)
+
+                    th.cuda.empty_cache()
             if use_uva:
                 unpin_memory_inplace(x)
             x = y
-            # print(memorys)
-            profiler.show()
+        profiler.show()
         # print("memory: ", torch.cuda.max_memory_allocated() // 1024 ** 2)
         return y
 
@@ -146,8 +137,11 @@ class GAT(nn.Module):
         prefix_sum_in_degrees = [0]
         prefix_sum_in_degrees.extend(np.cumsum(in_degrees).tolist())
         prefix_sum_in_degrees.append(2e18)
-        torch.cuda.reset_peak_memory_stats()
-        
+        on_cuda = torch.device(device).type == 'cuda'
+        if on_cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+        profiler = Profiler(device)
         for l, layer in enumerate(self.gat_layers):
             gc.collect()
             th.cuda.empty_cache()
@@ -177,54 +171,51 @@ class GAT(nn.Module):
                 use_uva=use_uva,
                 shuffle=False)
             
-            profiler = Profiler()
-            profiler.record_and_reset()
-            for input_nodes, output_nodes, blocks in dataloader:
-                try:
-                    auto_tuner.reset_state()
-                    torch.cuda.empty_cache()
-                    auto_tuner.set_free(free_rate)
-
-                    profiler.tag()
-                    profiler.record_name("total input nodes", input_nodes.shape[0])
-                    block = blocks[0].to(device)
-                    if use_uva:
-                        h = gather_pinned_tensor_rows(x, input_nodes)
-                    else:
-                        h = x[input_nodes].to(device)
-                    profiler.tag()
-
-                    h = layer(block, h)
-                    if l == self.num_layers - 1:
-                        logits = h.mean(1)
-                        profiler.tag()
-                        y[output_nodes] = logits.cpu()
-                    else:
-                        h = h.flatten(1)
-                        profiler.tag()
-                        update_out_in_chunks(y, output_nodes, h)
-                    profiler.tag()
-
-                    auto_tuner.set_max()
-                    print(block, torch.cuda.max_memory_allocated() // 1024 ** 2)
-                    nxt_max_node, nxt_max_edge = auto_tuner.search(blocks[0])
-                
-                except Exception as e:
-                    print(e)
-                    profiler.tag()
-                    nxt_max_node, nxt_max_edge = auto_tuner.break_peak(blocks[0])
-                    dataloader.reset_batch_node(output_nodes.shape[0])
-                    gc.collect()
-
-                finally:
-                    dataloader.modify_max_node(nxt_max_node)
-                    dataloader.modify_max_edge(nxt_max_edge)
-                    torch.cuda.empty_cache()
-                    torch.cuda.reset_peak_memory_stats()
-                    profiler.record_and_reset()
+            with profiler.layer(l):
+                for input_nodes, output_nodes, blocks in profiler.batches(dataloader):
+                    try:
+                        auto_tuner.reset_state()
+                        torch.cuda.empty_cache()
+                        auto_tuner.set_free(free_rate)
+
+                        profiler.count("input nodes", input_nodes.shape[0])
+                        with profiler.span("gather"):
+                            block = blocks[0].to(device)
+                            if use_uva:
+                                h = gather_pinned_tensor_rows(x, input_nodes)
+                            else:
+                                h = x[input_nodes].to(device)
+
+                        with profiler.span("compute"):
+                            h = layer(block, h)
+                            if l == self.num_layers - 1:
+                                h = h.mean(1)
+                            else:
+                                h = h.flatten(1)
+                        with profiler.span("write-back"):
+                            update_out_in_chunks(y, output_nodes, h)
+
+                        with profiler.span("tune"):
+                            auto_tuner.set_max()
+                            nxt_max_node, nxt_max_edge = auto_tuner.search(blocks[0])
+
+                    except Exception as e:
+                        print(e)
+                        with profiler.span("tune"):
+                            nxt_max_node, nxt_max_edge = auto_tuner.break_peak(blocks[0])
+                        dataloader.reset_batch_node(output_nodes.shape[0])
+                        with profiler.span("gc"):
+                            gc.collect()
+
+                    finally:
+                        dataloader.modify_max_node(nxt_max_node)
+                        dataloader.modify_max_edge(nxt_max_edge)
+                        torch.cuda.empty_cache()
+                        if on_cuda:
+                            torch.cuda.reset_peak_memory_stats()
 
             if use_uva:
                 unpin_memory_inplace(x)
             x = y
-            profiler.show()
+        profiler.show()
         return y
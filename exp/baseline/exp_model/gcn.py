@@ -45,6 +45,8 @@ class StochasticTwoLayerGCN(nn.Module):
         Offline inference with this module
         """
         # Compute representations layer by layer
+        profiler = Profiler(device)
+        on_cuda = torch.device(device).type == 'cuda'
         for l, layer in enumerate(self.convs):
             y = torch.zeros(g.number_of_nodes(),
                             self.hidden_features
@@ -52,7 +54,6 @@ class StochasticTwoLayerGCN(nn.Module):
                             else self.out_features)
 
             memorys = []
-            nodes = []
             if use_uva:
                 pin_memory_inplace(x)
                 nids = nids.to(device)
@@ -63,48 +64,42 @@ class StochasticTwoLayerGCN(nn.Module):
                 shuffle=False,
                 use_uva=use_uva,
                 drop_last=False,
-                device=torch.device('cuda'),
+                device=device,
                 num_workers=0)
 
-            profiler = Profiler()
-            profiler.record_and_reset()
             # Within a layer, iterate over nodes in batches
-            for input_nodes, output_nodes, blocks in dataloader:
-                # print(blocks, torch.cuda.max_memory_allocated() // 1024 ** 2)
-                torch.cuda.empty_cache()
-                profiler.tag()
-                profiler.record_name("total input nodes", input_nodes.shape[0])
-                block = blocks[0].to(device)
+            with profiler.layer(l):
+                for input_nodes, output_nodes, blocks in profiler.batches(dataloader):
+                    torch.cuda.empty_cache()
+                    profiler.count("input nodes", input_nodes.shape[0])
+                    with profiler.span("gather"):
+                        block = blocks[0].to(device)
 
-                # Copy the features of necessary input nodes to GPU
-                if use_uva:
-                    h = gather_pinned_tensor_rows(x, input_nodes)
-                else:
-                    h = x[input_nodes].to(device)
-                profiler.tag()
-                # Compute output.  Note that this computation is the same
-                # but only for a single layer.
-                h_dst = h[:block.number_of_dst_nodes()]
-                h = F.relu(layer(block, (h, h_dst)))
-                profiler.tag()
-                # Copy to output back to CPU.
-                update_out_in_chunks(y, output_nodes, h)
-                profiler.tag()
+                        # Copy the features of necessary input nodes to GPU
+                        if use_uva:
+                            h = gather_pinned_tensor_rows(x, input_nodes)
+                        else:
+                            h = x[input_nodes].to(device)
+                    # Compute output.  Note that this computation is the same
+                    # but only for a single layer.
+                    with profiler.span("compute"):
+                        h_dst = h[:block.number_of_dst_nodes()]
+                        h = F.relu(layer(block, (h, h_dst)))
+                    # Copy to output back to CPU.
+                    with profiler.span("write-back"):
+                        update_out_in_chunks(y, output_nodes, h)
 
-                memorys.append(torch.cuda.max_memory_allocated() // 1024 ** 2)
-                # print(torch.cuda.max_memory_allocated() // 1024 ** 2)
-                nodes.append(output_nodes.shape[0])
-                torch.cuda.empty_cache()
-                torch.cuda.reset_peak_memory_stats()
-                profiler.record_and_reset()
+                    if on_cuda:
+                        memorys.append(torch.cuda.max_memory_allocated() // 1024 ** 2)
+                        torch.cuda.empty_cache()
+                        torch.cuda.reset_peak_memory_stats()
 
             if use_uva:
                 unpin_memory_inplace(x)
             x = y
-            profiler.show()
-            print(max(memorys))
-            # print(memorys)
-            # print(nodes)
+            if on_cuda:
+                print(max(memorys))
 
+        profiler.show()
         return y
 
@@ -80,6 +80,7 @@ class JKNet(nn.Module):
         for k in list(g.edata.keys()):
             g.edata.pop(k)
 
+        profiler = Profiler(device)
         feat_lst = []
         for l, layer in enumerate(self.layers):
             feat_lst.append(torch.zeros(g.num_nodes(), self.n_hidden))
@@ -98,32 +99,28 @@ class JKNet(nn.Module):
                 drop_last=False,
                 num_workers=0)
 
-            profiler = Profiler()
-            profiler.record_and_reset()
-            for input_nodes, output_nodes, blocks in dataloader:
-                torch.cuda.empty_cache()
-                profiler.record_name("total input nodes", input_nodes.shape[0])
-                profiler.tag()
-                block = blocks[0]
-
-                block = block.int().to(device)
-                if use_uva:
-                    h = gather_pinned_tensor_rows(x, input_nodes)
-                else:
-                    h = x[input_nodes].to(device)
-                profiler.tag()
-                
-                h = layer(block, h)
-                h = self.dropout(h)
-                profiler.tag()
-
-                update_out_in_chunks(feat_lst[-1], output_nodes, h)
-                profiler.tag()
+            with profiler.layer(l):
+                for input_nodes, output_nodes, blocks in profiler.batches(dataloader):
+                    torch.cuda.empty_cache()
+                    profiler.count("input nodes", input_nodes.shape[0])
+                    with profiler.span("gather"):
+                        block = blocks[0]
 
-                torch.cuda.empty_cache()
-                profiler.record_and_reset()
+                        block = block.int().to(device)
+                        if use_uva:
+                            h = gather_pinned_tensor_rows(x, input_nodes)
+                        else:
+                            h = x[input_nodes].to(device)
+
+                    with profiler.span("compute"):
+                        h = layer(block, h)
+                        h = self.dropout(h)
+
+                    with profiler.span("write-back"):
+                        update_out_in_chunks(feat_lst[-1], output_nodes, h)
+
+                    torch.cuda.empty_cache()
 
-            profiler.show()
             if use_uva:
                 unpin_memory_inplace(x)
             x = feat_lst[-1]
@@ -145,33 +142,30 @@ class JKNet(nn.Module):
             drop_last=False,
             num_workers=0)
 
-        profiler = Profiler()
-        profiler.record_and_reset()
-        for input_nodes, output_nodes, blocks in dataloader:
-            torch.cuda.empty_cache()
-            profiler.record_name("total input nodes", input_nodes.shape[0])
-            profiler.tag()
-            block = blocks[0]
+        with profiler.layer(len(self.layers)):
+            for input_nodes, output_nodes, blocks in profiler.batches(dataloader):
+                torch.cuda.empty_cache()
+                profiler.count("input nodes", input_nodes.shape[0])
+                with profiler.span("gather"):
+                    block = blocks[0]
+
+                    block = block.int().to(device)
+                    h_lst = []
+                    for feat in feat_lst:
+                        if use_uva:
+                            h_lst.append(gather_pinned_tensor_rows(feat, input_nodes))
+                        else:
+                            h_lst.append(feat[input_nodes].to(device))
+
+                with profiler.span("compute"):
+                    jumped = self.jump(h_lst)
+                    agged = self.agge(block, jumped)
+                    output = self.output(agged)
+
+                with profiler.span("write-back"):
+                    update_out_in_chunks(y, output_nodes, output)
 
-            block = block.int().to(device)
-            h_lst = []
-            for feat in feat_lst:
-                if use_uva:
-                    h_lst.append(gather_pinned_tensor_rows(feat, input_nodes))
-                else:
-                    h_lst.append(feat[input_nodes].to(device))
-            profiler.tag()
-
-            jumped = self.jump(h_lst)
-            agged = self.agge(block, jumped)
-            output = self.output(agged)
-            profiler.tag()
-            
-            update_out_in_chunks(y, output_nodes, output)
-            profiler.tag()
-
-            torch.cuda.empty_cache()
-            profiler.record_and_reset()
+                torch.cuda.empty_cache()
 
         profiler.show()
         if use_uva:
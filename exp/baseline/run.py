@@ -11,7 +11,7 @@ from exp_model.gcn import StochasticTwoLayerGCN
 from exp_model.sage import SAGE
 from exp_model.gat import  GAT
 from exp_model.jknet import JKNet
-from inference_helper import InferenceHelper, EdgeControlInferenceHelper, AutoInferenceHelper
+from inference_helper import InferenceHelper, EdgeControlInferenceHelper, AutoInferenceHelper, ThroughputInferenceHelper
 from dgl.utils import pin_memory_inplace, unpin_memory_inplace, gather_pinned_tensor_rows
 
 import os
@@ -315,6 +315,20 @@ def train(args):
             helper_score = (torch.argmax(helper_pred, dim=1) == labels).float().sum() / len(helper_pred)
             print("Helper Inference: {}, inference time: {}".format(helper_score, cost_time))
 
+        elif args.tune_throughput:
+            print(args.num_layers, args.model, "throughput", args.dataset, args.num_heads, args.num_hidden)
+            # the budget tuned by the first run of a (model, dataset, machine) is reused by the later ones
+            helper = ThroughputInferenceHelper(model, torch.device(device), use_uva=args.use_uva,
+                                               memory_rate=args.free_rate,
+                                               tuning_cache=args.tuning_cache or True, debug=args.debug)
+            helper.ret_shapes = helper._trace_output_shape((feat,))
+            st = time.time()
+            helper_pred = helper.inference(g, feat)
+            cost_time = time.time() - st
+            helper_score = (torch.argmax(helper_pred, dim=1) == labels).float().sum() / len(helper_pred)
+            print("Helper Inference: {}, inference time: {}".format(helper_score, cost_time))
+            print("edge budgets:", [stats["best_edge"] for stats in helper.throughput_stats.values()])
+
         else:
             if args.gpu == -1:
                 print(args.num_layers, args.model, "CPU", args.batch_size, args.dataset, args.num_heads, args.num_hidden)
@@ -346,6 +360,9 @@ if __name__ == '__main__':
     argparser.add_argument('--gpufull', action="store_true")
     argparser.add_argument('--gpu', help="GPU device ID. Use -1 for CPU training", type=int, default=0)
     argparser.add_argument('--auto', action="store_true")
+    argparser.add_argument('--tune-throughput', help="tune the edge budget of the batches on the edges per second",
+                           action="store_true")
+    argparser.add_argument('--tuning-cache', help="the cache file of the tuned budgets", type=str, default=None)
 
     argparser.add_argument('--model', help="can be GCN, GAT, SAGE and JKNET", type=str, default='GCN')
     argparser.add_argument('--debug', action="store_true")
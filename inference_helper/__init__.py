@@ -1,2 +1,6 @@
-from .inference_helper import InferenceHelper, EdgeControlInferenceHelper, AutoInferenceHelper
-from .dglfx import dgl_symbolic_trace
+from .inference_helper import InferenceHelper, EdgeControlInferenceHelper, AutoInferenceHelper, \
+    WavefrontInferenceHelper, DistributedInferenceHelper, ThroughputInferenceHelper
+from .distributed import partition_ranges
+from .wavefront import reorder_banded
+from .dglfx import dgl_symbolic_trace, get_graph_meta
+from .data_manager import mmap_tensor, save_mmap_tensor
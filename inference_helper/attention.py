@@ -0,0 +1,84 @@
+import torch
+import torch.nn as nn
+from dgl.nn import GATConv
+
+
+def online_softmax_aggregate(u, v, num_dst, score_func, feat_src, chunk_edges):
+    """``sum(softmax(score) * feat_src[u])`` over the in-edges of every dst node, ``chunk_edges`` edges at a time.
+
+    ``score_func(u, v)`` gives the ``[E, H]`` attention logits of a slice of the edges. Each dst node keeps a
+    running max and sum of the exponentials, and its accumulated output is rescaled when the max grows, so
+    no tensor has a row per edge of the whole block. A dst node without in-edges gets zeros, as DGL.
+    """
+    heads, dim = feat_src.shape[1], feat_src.shape[2]
+    running_max = feat_src.new_full((num_dst, heads), float("-inf"))
+    running_sum = feat_src.new_zeros((num_dst, heads))
+    acc = feat_src.new_zeros((num_dst, heads, dim))
+    for start in range(0, u.shape[0], chunk_edges):
+        u_c, v_c = u[start:start + chunk_edges].long(), v[start:start + chunk_edges].long()
+        score = score_func(u_c, v_c).view(-1, heads)
+        chunk_max = running_max.scatter_reduce(0, v_c.view(-1, 1).expand(-1, heads), score, "amax",
+                                               include_self=True)
+        # exp(-inf - -inf) of a dst node not reached yet
+        scale = torch.where(torch.isinf(running_max), torch.zeros_like(running_max),
+                            torch.exp(running_max - chunk_max))
+        exp_score = torch.exp(score - chunk_max[v_c])
+        running_sum = running_sum * scale
+        running_sum.index_add_(0, v_c, exp_score)
+        acc = acc * scale.unsqueeze(-1)
+        acc.index_add_(0, v_c, exp_score.unsqueeze(-1) * feat_src[u_c])
+        running_max = chunk_max
+        del score, exp_score
+    return torch.where(running_sum.unsqueeze(-1) > 0, acc / running_sum.clamp(min=1e-38).unsqueeze(-1),
+                       torch.zeros_like(acc))
+
+
+def streaming_gat_conv(conv: GATConv, graph, feat, chunk_edges):
+    # the eval forward of GATConv, with the edge softmax and the aggregation fused over slices of the edges
+    heads, out_feats = conv._num_heads, conv._out_feats
+    num_dst = graph.number_of_dst_nodes()
+    if isinstance(feat, tuple):
+        h_src, h_dst = conv.feat_drop(feat[0]), conv.feat_drop(feat[1])
+        fc_src = conv.fc_src if hasattr(conv, "fc_src") else conv.fc
+        fc_dst = conv.fc_dst if hasattr(conv, "fc_dst") else conv.fc
+        feat_src = fc_src(h_src).view(-1, heads, out_feats)
+        feat_dst = fc_dst(h_dst).view(-1, heads, out_feats)
+    else:
+        h_src = h_dst = conv.feat_drop(feat)
+        feat_src = feat_dst = conv.fc(h_src).view(-1, heads, out_feats)
+        if graph.is_block:
+            feat_dst = feat_src[:num_dst]
+            h_dst = h_dst[:num_dst]
+    el = (feat_src * conv.attn_l).sum(dim=-1)
+    er = (feat_dst * conv.attn_r).sum(dim=-1)
+    u, v = graph.edges()
+    rst = online_softmax_aggregate(u, v, num_dst, lambda u_c, v_c: conv.leaky_relu(el[u_c] + er[v_c]),
+                                   feat_src, chunk_edges)
+    if getattr(conv, "res_fc", None) is not None:
+        rst = rst + conv.res_fc(h_dst).view(h_dst.shape[0], -1, out_feats)
+    bias = getattr(conv, "bias", None)
+    if isinstance(bias, torch.Tensor):
+        rst = rst + bias.view(1, -1, out_feats)
+    if conv.activation is not None:
+        rst = conv.activation(rst)
+    return rst
+
+
+class StreamingGATConv(nn.Module):
+    """A GATConv whose edge softmax and aggregation run over slices of at most ``chunk_edges`` edges.
+
+    It streams when the block has more edges than ``chunk_edges``, or than the ``chunk_edges`` of a
+    ``HubBlock``; otherwise, and in training mode, it is the wrapped module.
+    """
+    def __init__(self, conv: GATConv, chunk_edges=None):
+        super().__init__()
+        self.conv = conv
+        self.chunk_edges = chunk_edges
+
+    def forward(self, graph, feat, *args, **kwargs):
+        chunk_edges = self.chunk_edges if self.chunk_edges is not None else getattr(graph, "chunk_edges", None)
+        if chunk_edges is None or graph.num_edges() <= chunk_edges or len(args) > 0 or len(kwargs) > 0 \
+            or self.conv.training or not graph.is_homogeneous \
+            or (not self.conv._allow_zero_in_degree and (graph.in_degrees() == 0).any()):
+            return self.conv(graph, feat, *args, **kwargs)
+        return streaming_gat_conv(self.conv, graph, feat, int(chunk_edges))
@@ -2,123 +2,326 @@ import pynvml
 import torch
 from sklearn.linear_model import LinearRegression
 
-def get_auto_tuner(device, cached=0):
+from .utils import get_rss, get_peak_rss, reset_peak_rss, get_available_memory
+
+def get_auto_tuner(device, calibration_batches=4):
     if isinstance(device, torch.device):
         device = device.type
     if 'cuda' in device:
-        return GPUAutoTuner(cached)
+        return GPUAutoTuner(calibration_batches)
     elif 'cpu' in device:
-        return CPUAutoTuner()
+        return CPUAutoTuner(calibration_batches)
     else:
         raise NotImplementedError("Not implement Auto Tuner for device: {}.".format(device))
 
 
-class AutoTunerBase:
-    def __init__(self):
-        self.free_memory = 0
-        self.set_free()
+class MemoryModel:
+    """Per-layer peak memory model: memory ~ a * src + b * dst + c * edges + d.
 
-    def set_free(self):
-        raise NotImplementedError
+    The number of src (input) nodes is unknown before sampling, so it is predicted from the
+    planned dst nodes and edges by a second regression.
+    """
+    def __init__(self, min_samples=4):
+        self.min_samples = min_samples
+        self.mem_lin_reg = LinearRegression(positive=True)
+        self.src_lin_reg = LinearRegression(positive=True)
+        self.mem_x = []
+        self.mem_y = []
+        self.src_x = []
+        self.src_y = []
+        self.fitted = False
 
-    def get_max(self):
-        raise NotImplementedError
+    def update(self, src_nodes, dst_nodes, edges, memory):
+        self.mem_x.append([src_nodes, dst_nodes, edges])
+        self.mem_y.append(memory)
+        self.src_x.append([dst_nodes, edges])
+        self.src_y.append(src_nodes)
 
-    def search(self, g):
-        raise NotImplementedError
+    def fit(self):
+        if len(self.mem_y) < self.min_samples:
+            return False
+        self.mem_lin_reg.fit(self.mem_x, self.mem_y)
+        self.src_lin_reg.fit(self.src_x, self.src_y)
+        self.fitted = True
+        return True
 
-    def break_peak(self, g):
-        curr_node = g.number_of_dst_nodes()
-        curr_edge = g.num_edges()
-        return curr_node // 2, curr_edge // 2
+    def state_dict(self, max_samples=64):
+        return {
+            "mem_x": self.mem_x[-max_samples:],
+            "mem_y": self.mem_y[-max_samples:],
+            "src_x": self.src_x[-max_samples:],
+            "src_y": self.src_y[-max_samples:],
+        }
 
+    def load_state_dict(self, state):
+        self.mem_x = [list(x) for x in state["mem_x"]] + self.mem_x
+        self.mem_y = list(state["mem_y"]) + self.mem_y
+        self.src_x = [list(x) for x in state["src_x"]] + self.src_x
+        self.src_y = list(state["src_y"]) + self.src_y
+        self.fit()
 
-class GPUAutoTuner(AutoTunerBase):
-    def __init__(self, cached=0):
-        self.cached = cached
+    def rescale(self, scale):
+        """Map the samples to another layer, ``scale(src, dst, edges)`` is the ratio of their memory."""
+        self.mem_y = [memory * scale(*x) for x, memory in zip(self.mem_x, self.mem_y)]
+        if self.fitted:
+            self.fit()
+
+    @property
+    def coef(self):
+        # (a, b, c, d)
+        return tuple(self.mem_lin_reg.coef_.tolist()) + (float(self.mem_lin_reg.intercept_),)
+
+    def predict_src(self, dst_nodes, edges, max_src=None):
+        src = float(self.src_lin_reg.predict([[dst_nodes, edges]])[0])
+        src = max(src, dst_nodes)
+        return src if max_src is None else min(src, max_src)
+
+    def predict(self, src_nodes, dst_nodes, edges):
+        return float(self.mem_lin_reg.predict([[src_nodes, dst_nodes, edges]])[0])
+
+    def predict_batch(self, dst_nodes, edges, max_src=None):
+        return self.predict(self.predict_src(dst_nodes, edges, max_src), dst_nodes, edges)
+
+
+class AutoTunerBase:
+    """Pick the next batch (max_node, max_edge) from the memory budget.
+
+    The first ``calibration_batches`` batches scale the budget by measured peak memory (at most
+    doubling each step). Afterwards a ``MemoryModel`` fitted on all measured batches predicts the
+    peak, and the largest next batch of the planner which fits the budget is chosen.
+    """
+    def __init__(self, calibration_batches=4, max_growth=2):
+        self.free_memory = 0
         self.maxs = []
-        super().__init__()
+        # the last (max_node, max_edge) which is not truncated by the end of the layer
+        self.budget = None
+        # batches with more edges than this ran out of memory before
+        self.edge_ceiling = float("inf")
+        self.max_growth = max_growth
+        self.memory_model = MemoryModel(calibration_batches)
+        self.set_free()
 
     def reset_state(self):
         self.free_memory = 0
         self.maxs = []
+        self.reset_peak()
 
     def set_free(self, rate=0.9):
-        pynvml.nvmlInit()
-        handle = pynvml.nvmlDeviceGetHandleByIndex(0)
-        info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-        self.free_memory = info.free * rate
+        raise NotImplementedError
+
+    def reset_peak(self):
+        raise NotImplementedError
+
+    def peak_memory(self):
+        raise NotImplementedError
 
     def set_max(self):
-        self.maxs.append(torch.cuda.max_memory_allocated() - self.cached)
+        self.maxs.append(self.peak_memory())
 
     def get_max(self):
-        return max(self.maxs)
+        # no batch has finished since reset_state after an out of memory retry
+        return max(max(self.maxs, default=0), 1)
 
-    def search(self, g):
+    def search(self, g, planner=None):
+        src_nodes = g.number_of_src_nodes()
         curr_node = g.number_of_dst_nodes()
         curr_edge = g.num_edges()
-        increase_rate = self.free_memory / self.get_max()
-        # print(self.free_memory // 1024 ** 2, self.get_max() // 1024 ** 2)
-        curr_node = int(curr_node * increase_rate)
-        curr_edge = int(curr_edge * increase_rate)
-        return curr_node, curr_edge
-
-# TODO: not use yet
-class NewGPUAutoTuner(GPUAutoTuner):
-    def __init__(self, g):
-        super().__init__()
-        self.tot_node = g.num_nodes()
-        self.src_lin_reg = LinearRegression()
-        self.mem_lin_reg = LinearRegression()
-        self.num = 0
-        self.mem_x = []
-        self.mem_y = []
-        self.src_x = []
-        self.src_y = []
-        self.target = 1
+        self.memory_model.update(src_nodes, curr_node, curr_edge, self.get_max())
+        if not self.memory_model.fit():
+            increase_rate = min(self.free_memory / self.get_max(), self.max_growth)
+            nxt_edge = min(int(curr_edge * increase_rate), self.edge_ceiling)
+            self.budget = max(int(curr_node * increase_rate), 1), max(int(nxt_edge), 1)
+            return self.budget
+        return self.plan(curr_node, curr_edge, planner)
 
-    def update_src_lin_reg(self, src_nodes, curr_node, curr_edge):
-        self.src_x.append([curr_node, curr_edge])
-        self.src_y.append(src_nodes)
+    def warm_start(self, entry):
+        """Start from a cached budget; a cached memory model skips the calibration phase."""
+        if entry.get("memory_model") is not None:
+            self.memory_model = MemoryModel(self.memory_model.min_samples)
+            self.memory_model.load_state_dict(entry["memory_model"])
+        self.budget = entry["max_node"], entry["max_edge"]
 
-    def update_mem_lin_reg(self, src_nodes, curr_node, curr_edge, max_memory_allocated):
-        self.mem_x.append([src_nodes, curr_node, curr_edge])
-        self.mem_y.append(max_memory_allocated)
+    def carry_over(self, scale):
+        """Start the next layer from the state of this one.
 
-    def search(self, g):
-        self.num += 1
-        src_nodes = g.number_of_src_nodes()
+        ``scale(src, dst, edges)`` is the predicted memory of a batch in the next layer over this
+        layer; the samples of the memory model and the budget are rescaled by it.
+        """
+        self.memory_model.rescale(scale)
+        self.edge_ceiling = float("inf")
+        if self.budget is None:
+            return None
+        curr_node, curr_edge = self.budget
+        src = self.memory_model.predict_src(curr_node, curr_edge) if self.memory_model.fitted \
+            else curr_node + curr_edge
+        rate = 1 / max(scale(src, curr_node, curr_edge), 1e-6)
+        self.budget = max(int(curr_node * rate), 1), max(int(curr_edge * rate), 1)
+        return self.budget
+
+    def plan(self, curr_node, curr_edge, planner=None):
+        if planner is not None:
+            max_node = planner.remaining_nodes()
+            max_src = planner.total_nodes()
+            next_edges = planner.next_batch_edges
+        else:
+            max_node = max(int(curr_node * self.max_growth), 1)
+            max_src = None
+            next_edges = lambda node_count: node_count * curr_edge // max(curr_node, 1)
+        if max_node <= 0:
+            return curr_node, curr_edge
+
+        # binary search the largest batch whose predicted peak fits the budget.
+        lo, hi = 1, max_node
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            edges = next_edges(mid)
+            if edges <= self.edge_ceiling and \
+                self.memory_model.predict_batch(mid, edges, max_src) <= self.free_memory:
+                lo = mid
+            else:
+                hi = mid - 1
+        if lo < max_node or planner is None:
+            self.budget = lo, next_edges(lo) + 1
+        return lo, next_edges(lo) + 1
+
+    def break_peak(self, g):
         curr_node = g.number_of_dst_nodes()
         curr_edge = g.num_edges()
-        max_memory_allocated = self.get_max() // 1024 ** 2
-        self.update_src_lin_reg(src_nodes, curr_node, curr_edge)
-        self.update_mem_lin_reg(src_nodes, curr_node, curr_edge, max_memory_allocated)
-
-        increase_rate = self.free_memory / self.get_max()
-        if self.num < 5:
-            if self.target > 1:
-                # increase_rate *= min(self.target / max_memory_allocated, 2)
-                print(self.target, increase_rate)
-            self.target = self.free_memory // 1024 ** 2
-        next_node = int(curr_node * increase_rate)
-        next_edge = int(curr_edge * increase_rate)
-        if self.num > 5:
-            self.src_lin_reg.fit(self.src_x[-3:], self.src_y[-3:])
-            self.mem_lin_reg.fit(self.mem_x, self.mem_y)
-            pred_src = min(int(self.src_lin_reg.predict([[next_node, next_edge]])), self.tot_node)
-            pred_memory = int(self.mem_lin_reg.predict([[pred_src, next_node, next_edge]])[0])
-            print("src:", pred_src, pred_memory)
-            if pred_memory == self.tot_node:
-                next_node += next_node // 2
-                next_edge += next_edge // 2
-        print("free:", self.free_memory // 1024 ** 2, self.get_max() // 1024 ** 2)
-        return next_node, next_edge
+        self.edge_ceiling = min(self.edge_ceiling, max(curr_edge // 2, 1))
+        self.budget = max(curr_node // 2, 1), max(curr_edge // 2, 1)
+        return self.budget
+
+
+class GPUAutoTuner(AutoTunerBase):
+    def __init__(self, calibration_batches=4):
+        self.base_memory = 0
+        super().__init__(calibration_batches)
+
+    def set_free(self, rate=0.9):
+        pynvml.nvmlInit()
+        handle = pynvml.nvmlDeviceGetHandleByIndex(torch.cuda.current_device())
+        info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+        # the blocks cached by the allocator are free for the next batch
+        cached = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+        self.free_memory = (info.free + cached) * rate
+
+    def reset_peak(self):
+        torch.cuda.reset_peak_memory_stats()
+        self.base_memory = torch.cuda.memory_allocated()
+
+    def peak_memory(self):
+        return torch.cuda.max_memory_allocated() - self.base_memory
 
 
 class CPUAutoTuner(AutoTunerBase):
-    def set_free(self):
-        raise NotImplementedError
+    # Peak memory of a batch is measured by the resident set size of the process.
+    def __init__(self, calibration_batches=4):
+        self.base_memory = 0
+        super().__init__(calibration_batches)
 
-    def get_max(self):
-        raise NotImplementedError
+    def set_free(self, rate=0.9):
+        self.free_memory = get_available_memory() * rate
+
+    def reset_peak(self):
+        if not reset_peak_rss():
+            raise RuntimeError("Can't reset the peak RSS of this process.")
+        self.base_memory = get_rss()
+
+    def peak_memory(self):
+        return get_peak_rss() - self.base_memory
+
+
+class ThroughputTuner:
+    """Hill-climb the edge budget of the batches on the measured edges per second, under a memory ceiling.
+
+    Every budget is measured over at least ``min_batches`` batches. A budget which beats the best by
+    ``tolerance`` becomes the best, and the next one is ``step`` times further in the same direction; after a
+    miss the direction turns, and after a miss in both directions the step shrinks to its square root. Once
+    the step is below ``min_step`` the best budget is locked. A batch whose peak memory passed the ceiling
+    caps the budget at half of its edges.
+    """
+    def __init__(self, start_edge, memory_ceiling, step=2., min_step=1.15, min_batches=2, tolerance=0.02):
+        self.budget = max(int(start_edge), 1)
+        self.memory_ceiling = memory_ceiling
+        self.step = step
+        self.min_step = min_step
+        self.min_batches = min_batches
+        self.tolerance = tolerance
+        self.direction = 1
+        self.turned = False
+        self.best_edge = None
+        self.best_rate = 0.
+        # the peak memory of the batches of the best budget
+        self.best_peak = 0
+        self.edge_ceiling = float("inf")
+        self.locked = False
+        # (edge budget, edges per second) of every measured budget
+        self.history = []
+        self._reset_measure()
+
+    def _reset_measure(self):
+        self._edges = 0
+        self._time = 0.
+        self._batches = 0
+        self._peak = 0
+
+    def lock(self, max_edge=None):
+        """Keep ``max_edge``, or the best budget so far, for the rest of the batches."""
+        if max_edge is not None:
+            self.best_edge = max(int(max_edge), 1)
+        if self.best_edge is not None:
+            self.budget = self.best_edge
+        self.locked = True
+        return self.budget
+
+    def _miss(self):
+        if self.turned:
+            self.step = self.step ** 0.5
+        self.turned = not self.turned
+        self.direction = -self.direction
+
+    def observe(self, edges, seconds, peak_memory):
+        """Measure a batch of ``edges`` edges; return the edge budget of the next batch."""
+        if self.locked:
+            return self.budget
+        if peak_memory > self.memory_ceiling:
+            self.edge_ceiling = min(self.edge_ceiling, max(edges // 2, 1))
+            if self.best_edge is not None and self.best_edge > self.edge_ceiling:
+                self.best_edge, self.best_rate, self.best_peak = None, 0., 0
+            self.direction = -1
+            self.budget = min(self.budget, self.edge_ceiling)
+            self._reset_measure()
+            return self.budget
+        self._edges += edges
+        self._time += seconds
+        self._batches += 1
+        self._peak = max(self._peak, peak_memory)
+        if self._batches < self.min_batches:
+            return self.budget
+        rate = self._edges / max(self._time, 1e-9)
+        self.history.append((self.budget, rate))
+        peak = self._peak
+        self._reset_measure()
+        if rate > self.best_rate * (1 + self.tolerance):
+            self.best_edge, self.best_rate, self.best_peak = self.budget, rate, peak
+        else:
+            self._miss()
+        while not self.locked:
+            if self.step < self.min_step:
+                return self.lock()
+            budget = int(min(max(self.best_edge * self.step ** self.direction, 1), self.edge_ceiling))
+            if budget != self.best_edge:
+                self.budget = budget
+                return self.budget
+            # the ceiling, or a budget of one edge, is in the way
+            self._miss()
+        return self.budget
+
+    def summary(self):
+        return {
+            "best_edge": self.best_edge,
+            "edges_per_second": self.best_rate,
+            "peak_memory": self.best_peak,
+            "edge_ceiling": None if self.edge_ceiling == float("inf") else self.edge_ceiling,
+            "history": list(self.history),
+        }
@@ -0,0 +1,90 @@
+import dgl
+import torch
+from dgl.heterograph import DGLBlock
+
+# upper in-degree of every bucket, the dst nodes with more in-edges take the sparse path
+DEGREE_BUCKETS = (4, 16, 64)
+PADDED_REDUCERS = ("sum", "mean", "max")
+
+
+def plan_degree_buckets(block, buckets=DEGREE_BUCKETS):
+    """Group the dst nodes of a block by in-degree.
+
+    Return ``(plan, tail)``: ``plan`` has a ``(dst nodes, [n, D] src index padded by -1)`` pair for each
+    non-empty bucket, D is the largest in-degree in it; ``tail`` has the edge IDs into the other dst nodes.
+    """
+    u, v = block.edges()
+    u, v = u.long(), v.long()
+    order = torch.argsort(v, stable=True)
+    u_sorted, v_sorted = u[order], v[order]
+    degrees = block.in_degrees().long()
+    # the position of every edge among the in-edges of its dst node
+    pos = torch.arange(u.shape[0], device=u.device) - (torch.cumsum(degrees, 0) - degrees)[v_sorted]
+    plan = []
+    low = 0
+    for high in buckets:
+        dst = torch.nonzero((degrees > low) & (degrees <= high)).view(-1)
+        if dst.shape[0] > 0:
+            row = torch.full((block.num_dst_nodes(),), -1, dtype=torch.long, device=u.device)
+            row[dst] = torch.arange(dst.shape[0], device=u.device)
+            in_bucket = row[v_sorted] >= 0
+            index = torch.full((dst.shape[0], int(degrees[dst].max())), -1, dtype=torch.long, device=u.device)
+            index[row[v_sorted[in_bucket]], pos[in_bucket]] = u_sorted[in_bucket]
+            plan.append((dst, index))
+        low = high
+    tail = order[degrees[v_sorted] > low]
+    return plan, tail
+
+
+def padded_reduce(feat, index, reducer):
+    # reduce the rows of feat gathered into a dense [n, D, ...] tensor, the -1 entries are padding
+    mask = (index >= 0).view(index.shape + (1,) * (feat.dim() - 1))
+    gathered = feat[index.clamp(min=0)]
+    if reducer == "max":
+        return gathered.masked_fill(~mask, float("-inf")).amax(1)
+    ret = gathered.masked_fill(~mask, 0).sum(1)
+    if reducer == "mean":
+        ret = ret / mask.sum(1).to(ret.dtype)
+    return ret
+
+
+class BucketedBlock(DGLBlock):
+    """A block whose ``copy_u`` + sum/mean/max ``update_all`` aggregates low-degree dst nodes densely.
+
+    The dst nodes in each bucket of ``DEGREE_BUCKETS`` are reduced over a padded ``[n, D, ...]`` gather of
+    their src rows; the dst nodes of higher in-degree go through the sparse kernel. Other message and reduce
+    functions take the normal path.
+    """
+    @staticmethod
+    def wrap(block, buckets=DEGREE_BUCKETS):
+        bucketed_block = BucketedBlock(block._graph, (block.srctypes, block.dsttypes), block.etypes,
+                                       block._node_frames, block._edge_frames)
+        bucketed_block.buckets = buckets
+        # the buckets depend on the structure only, every update_all of the block shares them
+        bucketed_block.bucket_plan = None
+        return bucketed_block
+
+    def update_all(self, message_func, reduce_func, apply_node_func=None, etype=None):
+        reducer = getattr(reduce_func, "name", None)
+        if getattr(message_func, "name", None) != "copy_u" or reducer not in PADDED_REDUCERS \
+            or reduce_func.msg_field != message_func.out_field or apply_node_func is not None \
+            or not self.is_homogeneous:
+            return super().update_all(message_func, reduce_func, apply_node_func, etype)
+        if self.bucket_plan is None:
+            self.bucket_plan = plan_degree_buckets(self, self.buckets)
+        plan, tail = self.bucket_plan
+        feat = self.srcdata[message_func.in_field]
+        # as DGL, a dst node without in-edges gets zeros
+        out = feat.new_zeros((self.num_dst_nodes(),) + tuple(feat.shape[1:]))
+        for dst, index in plan:
+            out[dst] = padded_reduce(feat, index, reducer)
+        if tail.shape[0] > 0:
+            u, v = self.find_edges(tail.to(self.idtype))
+            tail_block = dgl.create_block((u, v), num_src_nodes=self.num_src_nodes(),
+                                          num_dst_nodes=self.num_dst_nodes(), idtype=self.idtype,
+                                          device=self.device)
+            tail_block.srcdata[message_func.in_field] = feat
+            DGLBlock.update_all(tail_block, message_func, reduce_func)
+            tail_dst = torch.unique(v.long())
+            out[tail_dst] = tail_block.dstdata[reduce_func.out_field][tail_dst]
+        self.dstdata[reduce_func.out_field] = out
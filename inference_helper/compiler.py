@@ -0,0 +1,140 @@
+import os
+import time
+
+import dgl
+import torch
+from dgl import DGLHeteroGraph
+
+from .tuning_cache import get_default_cache_path
+from .utils import get_bucket
+
+def enable_compile_cache(cache_dir=None):
+    """Keep the artifacts of inductor next to the tuning cache, so later runs reuse them."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(get_default_cache_path()), "inductor")
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    inductor_config = getattr(getattr(torch, "_inductor", None), "config", None)
+    if inductor_config is not None and hasattr(inductor_config, "fx_graph_cache"):
+        inductor_config.fx_graph_cache = True
+
+
+def pad_block(block, num_dst, num_src, num_edges):
+    """Pad a block to ``num_dst`` dst, ``num_src`` src nodes and ``num_edges`` edges.
+
+    The dst nodes stay the prefix of the src nodes, so the padded dst nodes are inserted after the real ones
+    and the other src nodes move back. The padded edges are self loops of the padded dst nodes, which must be
+    at least as many as those nodes, as some convolutions reject dst nodes without in-edges.
+    """
+    dst, src, edges = block.num_dst_nodes(), block.num_src_nodes(), block.num_edges()
+    shift = num_dst - dst
+    u, v = block.edges()
+    u = torch.where(u < dst, u, u + shift)
+    pad = dst + torch.arange(num_edges - edges, dtype=u.dtype, device=u.device) % shift
+    padded = dgl.create_block((torch.cat([u, pad]), torch.cat([v, pad])), num_src_nodes=num_src,
+                              num_dst_nodes=num_dst, idtype=block.idtype, device=block.device)
+    if dgl.EID in block.edata:
+        eids = block.edata[dgl.EID]
+        padded.edata[dgl.EID] = torch.cat([eids, eids.new_zeros((num_edges - edges,))])
+    return padded
+
+
+def pad_rows(val, dst, src, num_dst, num_src):
+    ret = val.new_zeros((num_src,) + tuple(val.shape[1:]))
+    ret[:dst] = val[:dst]
+    ret[num_dst:num_dst + src - dst] = val[dst:]
+    return ret
+
+
+def unpad_rows(val, dst, src, num_dst, num_src):
+    if val.shape[0] == num_dst:
+        return val[:dst]
+    if val.shape[0] == num_src and num_src != num_dst:
+        return torch.cat([val[:dst], val[num_dst:num_dst + src - dst]])
+    return val
+
+
+class CompiledConvBlock:
+    """A conv_block function run by ``torch.compile``, with every batch padded to a bucket of the ladder.
+
+    The first batch also runs the eager function, to report the compile time and the steady-state speedup.
+    ``edge_indexed`` flags the arguments with a row per edge, the other tensors with a row per src node are
+    padded as node rows.
+    """
+    def __init__(self, func, layer_id, edge_indexed=(), backend="inductor", dynamic=True, bucket=True):
+        self.func = func
+        self.layer_id = layer_id
+        self.edge_indexed = tuple(edge_indexed)
+        self.bucket = bucket
+        self.compiled = torch.compile(func, backend=backend, dynamic=dynamic)
+        self.shapes = set()
+        self.calls = 0
+        self.stats = {
+            "layer": layer_id,
+            "compiles": 0,
+            "compile_time": 0.,
+            "eager_time": 0.,
+            "eager_edges": 0,
+            "compiled_time": 0.,
+            "compiled_edges": 0,
+        }
+
+    def pad_args(self, args):
+        block = next((arg for arg in args if isinstance(arg, DGLHeteroGraph)), None)
+        if block is None or not self.bucket or not block.is_homogeneous:
+            return args, None
+        dst, src, edges = block.num_dst_nodes(), block.num_src_nodes(), block.num_edges()
+        # one more dst node than the batch, to receive the padded edges
+        num_dst = get_bucket(dst + 1)
+        num_src = num_dst + get_bucket(src - dst)
+        num_edges = get_bucket(edges + num_dst - dst)
+        new_args = ()
+        for i, arg in enumerate(args):
+            edge_indexed = i < len(self.edge_indexed) and self.edge_indexed[i]
+            if arg is block:
+                arg = pad_block(block, num_dst, num_src, num_edges)
+            elif edge_indexed:
+                # edge features, the padded edges are appended
+                arg = torch.cat([arg, arg.new_zeros((num_edges - edges,) + tuple(arg.shape[1:]))])
+            elif isinstance(arg, torch.Tensor) and arg.dim() > 0 and arg.shape[0] == src:
+                arg = pad_rows(arg, dst, src, num_dst, num_src)
+            new_args += (arg,)
+        return new_args, (dst, src, num_dst, num_src)
+
+    def __call__(self, *args):
+        block_index = next((i for i, arg in enumerate(args) if isinstance(arg, DGLHeteroGraph)), None)
+        edges = args[block_index].num_edges() if block_index is not None else 0
+        self.calls += 1
+        if self.calls == 1:
+            st = time.perf_counter()
+            ret = self.func(*args)
+            self.stats["eager_time"] += time.perf_counter() - st
+            self.stats["eager_edges"] += max(edges, 1)
+            return ret
+
+        new_args, padding = self.pad_args(args)
+        shape = tuple(arg.shape if isinstance(arg, torch.Tensor) else type(arg) for arg in new_args)
+        if block_index is not None:
+            shape += (new_args[block_index].num_edges(),)
+        st = time.perf_counter()
+        ret = self.compiled(*new_args)
+        cost = time.perf_counter() - st
+        if shape not in self.shapes:
+            # the first batch of a shape compiles
+            self.shapes.add(shape)
+            self.stats["compiles"] += 1
+            self.stats["compile_time"] += cost
+        else:
+            self.stats["compiled_time"] += cost
+            self.stats["compiled_edges"] += max(edges, 1)
+        if padding is None:
+            return ret
+        if isinstance(ret, tuple):
+            return tuple(unpad_rows(val, *padding) if isinstance(val, torch.Tensor) else val for val in ret)
+        return unpad_rows(ret, *padding) if isinstance(ret, torch.Tensor) else ret
+
+    def summary(self):
+        stats = dict(self.stats)
+        eager = stats["eager_time"] / max(stats["eager_edges"], 1)
+        compiled = stats["compiled_time"] / max(stats["compiled_edges"], 1)
+        stats["speedup"] = eager / compiled if stats["compiled_edges"] > 0 and compiled > 0 else None
+        return stats
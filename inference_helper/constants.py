@@ -6,6 +6,7 @@ CALL_METHOD = "call_method"
 PLACEHOLDER = "placeholder"
 OUTPUT = "output"
 CONV_BLOCK = "conv_block"
+FOLDED_PREFIX = "_folded_"
 
 TENSOR_DATA = "TensorData"
 UTIL_DATA = "UtilData"
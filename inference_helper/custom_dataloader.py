@@ -1,4 +1,5 @@
 from typing import Generic
+import bisect
 import functools
 
 import torch
@@ -16,11 +17,31 @@ def _divide_by_worker(dataset):
         dataset = dataset[start:end]
     return dataset
 
+# orders of the dst nodes in the batches: natural, by in-degree, or by power-of-two in-degree buckets
+BATCH_ORDERS = (None, "degree", "degree-buckets")
+
+
+def get_degree_order(in_degrees, batch_order):
+    """The permutation of the nodes taken by the batches, so consecutive nodes have similar in-degrees.
+
+    ``"degree"`` sorts by descending in-degree, ``"degree-buckets"`` groups the nodes by ``floor(log2(in-degree))``,
+    keeping their order inside a bucket for the locality of the gathers. The hubs come first.
+    """
+    if batch_order not in BATCH_ORDERS:
+        raise ValueError("Unknown batch order: {}.".format(batch_order))
+    in_degrees = in_degrees.long()
+    if batch_order is None:
+        return torch.arange(in_degrees.shape[0])
+    if batch_order == "degree-buckets":
+        in_degrees = torch.floor(torch.log2(in_degrees.clamp(min=1).double())).long()
+    return torch.sort(in_degrees, descending=True, stable=True).indices
+
+
 class CustomDataloader(dgl.dataloading.NodeDataLoader):
     def __init__(self, g, nids, sampler, start_max_node=1000, start_max_edge=10000, prefix_sum_in_degrees=None, \
-        device='cpu', shuffle=False, use_uva=False, num_workers=0):
+        device='cpu', shuffle=False, use_uva=False, num_workers=0, hub_threshold=None):
 
-        custom_dataset = CustomDataset(start_max_node, start_max_edge, g, nids, prefix_sum_in_degrees)
+        custom_dataset = CustomDataset(start_max_node, start_max_edge, g, nids, prefix_sum_in_degrees, hub_threshold)
         sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
         super().__init__(g,
                          custom_dataset,
@@ -42,6 +63,18 @@ class CustomDataloader(dgl.dataloading.NodeDataLoader):
         if self.dataset.curr_iter is not None:
             self.dataset.curr_iter.max_node = max_node
 
+    def total_nodes(self):
+        return self.dataset.curr_iter.num_item
+
+    def remaining_nodes(self):
+        curr_iter = self.dataset.curr_iter
+        return curr_iter.num_item - curr_iter.index
+
+    def next_batch_edges(self, node_count):
+        curr_iter = self.dataset.curr_iter
+        end_idx = min(curr_iter.index + node_count, curr_iter.num_item)
+        return int(curr_iter.prefix_sum_in_degrees[end_idx] - curr_iter.prefix_sum_in_degrees[curr_iter.index])
+
     def reset_batch_node(self, node_count):
         if self.dataset.curr_iter is not None:
             self.dataset.curr_iter.index -= node_count
@@ -50,7 +83,7 @@ class CustomDataloader(dgl.dataloading.NodeDataLoader):
         return super(Generic, self).__setattr__(__name, __value)
 
 class CustomDataset(dgl.dataloading.TensorizedDataset):
-    def __init__(self, max_node, max_edge, g, train_nids, prefix_sum_in_degrees=None):
+    def __init__(self, max_node, max_edge, g, train_nids, prefix_sum_in_degrees=None, hub_threshold=None):
         super().__init__(train_nids, max_node, False)
         self.device = train_nids.device
         self.max_node = max_node
@@ -64,11 +97,17 @@ class CustomDataset(dgl.dataloading.TensorizedDataset):
             in_degrees = g.in_degrees(train_nids.to(g.device))
             self.prefix_sum_in_degrees = [0]
             self.prefix_sum_in_degrees.extend(in_degrees.tolist())
-            for i in range(1, len(self.in_degrees)):
+            for i in range(1, len(self.prefix_sum_in_degrees)):
                 self.prefix_sum_in_degrees[i] += self.prefix_sum_in_degrees[i - 1]
             self.prefix_sum_in_degrees.append(2e18)
+        # positions of the nodes with more in-edges than hub_threshold, each of them is a batch of its own
+        hub_positions = []
+        if hub_threshold is not None:
+            prefix_sum = torch.tensor(self.prefix_sum_in_degrees[:-1], dtype=torch.int64)
+            hub_positions = torch.nonzero(prefix_sum[1:] - prefix_sum[:-1] > hub_threshold).view(-1).tolist()
         self.curr_iter = CustomDatasetIter(
-            id_tensor, self.max_node, self.max_edge, self.prefix_sum_in_degrees, self.drop_last, self._mapping_keys)
+            id_tensor, self.max_node, self.max_edge, self.prefix_sum_in_degrees, self.drop_last, self._mapping_keys,
+            hub_positions)
 
     def __getattr__(self, attribute_name):
         if attribute_name in CustomDataset.functions:
@@ -81,27 +120,27 @@ class CustomDataset(dgl.dataloading.TensorizedDataset):
         return self.curr_iter
 
 class CustomDatasetIter(_TensorizedDatasetIter):
-    def __init__(self, dataset, max_node, max_edge, prefix_sum_in_degrees, drop_last, mapping_keys):
+    def __init__(self, dataset, max_node, max_edge, prefix_sum_in_degrees, drop_last, mapping_keys,
+                 hub_positions=()):
         super().__init__(dataset, max_node, drop_last, mapping_keys)
         self.max_node = max_node
         self.max_edge = max_edge
         self.prefix_sum_in_degrees = prefix_sum_in_degrees
         self.num_item = self.dataset.shape[0]
+        self.hub_positions = hub_positions
 
     def get_end_idx(self):
-        # binary search
-        binary_start = self.index + 1
+        # binary search the last node which keeps the batch under max_edge, at least one node per batch.
         binary_end = min(self.index + self.max_node, self.num_item)
-        if self.prefix_sum_in_degrees[binary_end] - self.prefix_sum_in_degrees[self.index] < self.max_edge:
-            return binary_end
-        binary_middle = 0
-        while binary_end - binary_start > 5:
-            binary_middle = (binary_start + binary_end) // 2
-            if self.prefix_sum_in_degrees[binary_middle] - self.prefix_sum_in_degrees[self.index] < self.max_edge:
-                binary_start = binary_middle
-            else:
-                binary_end = binary_middle - 1
-        return binary_middle
+        target = self.prefix_sum_in_degrees[self.index] + self.max_edge
+        end_idx = bisect.bisect_left(self.prefix_sum_in_degrees, target, self.index + 1, binary_end + 1) - 1
+        end_idx = max(end_idx, self.index + 1)
+        # a hub runs alone, the batch before it stops at it
+        i = bisect.bisect_left(self.hub_positions, self.index)
+        if i < len(self.hub_positions):
+            hub = self.hub_positions[i]
+            end_idx = self.index + 1 if hub == self.index else min(end_idx, hub)
+        return end_idx
 
     def _next_indices(self):
         if self.index >= self.num_item:
@@ -110,3 +149,85 @@ class CustomDatasetIter(_TensorizedDatasetIter):
         batch = self.dataset[self.index:end_idx]
         self.index = end_idx
         return batch
+
+
+def get_hetero_in_degrees(g, nids):
+    """In-degrees over all relations of the nodes ``nids[ntype]``, concatenated in the order of ``g.ntypes``."""
+    degrees = []
+    for ntype in g.ntypes:
+        if ntype not in nids:
+            continue
+        in_degrees = torch.zeros(g.num_nodes(ntype), dtype=torch.int64, device=g.device)
+        for cetype in g.canonical_etypes:
+            if cetype[2] == ntype:
+                in_degrees += g.in_degrees(etype=cetype).long()
+        degrees.append(in_degrees[nids[ntype].to(g.device).long()].cpu())
+    return torch.cat(degrees)
+
+
+class HeteroDataloader:
+    """Batches of the nodes of a heterograph under a total edge budget over all relations.
+
+    The nodes of every type are taken in the order of ``g.ntypes``, so a batch may hold several node types.
+    It has the same planner interface as ``CustomDataloader``.
+    """
+    def __init__(self, g, nids, sampler, start_max_node=1000, start_max_edge=10000, prefix_sum_in_degrees=None,
+                 device='cpu'):
+        self.g = g
+        self.sampler = sampler
+        self.device = device
+        self.max_node = start_max_node
+        self.max_edge = start_max_edge
+        self.ntypes = [ntype for ntype in g.ntypes if ntype in nids]
+        self.nids = [nids[ntype] for ntype in self.ntypes]
+        self.offsets = [0]
+        for ids in self.nids:
+            self.offsets.append(self.offsets[-1] + ids.shape[0])
+        self.num_item = self.offsets[-1]
+        self.prefix_sum_in_degrees = prefix_sum_in_degrees
+        if self.prefix_sum_in_degrees is None:
+            self.prefix_sum_in_degrees = [0]
+            self.prefix_sum_in_degrees.extend(torch.cumsum(get_hetero_in_degrees(g, nids), 0).tolist())
+            self.prefix_sum_in_degrees.append(2e18)
+        self.index = 0
+
+    def modify_max_edge(self, max_edge):
+        self.max_edge = max_edge
+
+    def modify_max_node(self, max_node):
+        self.max_node = max_node
+
+    def total_nodes(self):
+        return self.num_item
+
+    def remaining_nodes(self):
+        return self.num_item - self.index
+
+    def next_batch_edges(self, node_count):
+        end_idx = min(self.index + node_count, self.num_item)
+        return int(self.prefix_sum_in_degrees[end_idx] - self.prefix_sum_in_degrees[self.index])
+
+    def reset_batch_node(self, node_count):
+        self.index -= node_count
+
+    def get_end_idx(self):
+        binary_end = min(self.index + self.max_node, self.num_item)
+        target = self.prefix_sum_in_degrees[self.index] + self.max_edge
+        end_idx = bisect.bisect_left(self.prefix_sum_in_degrees, target, self.index + 1, binary_end + 1) - 1
+        return max(end_idx, self.index + 1)
+
+    def __iter__(self):
+        self.index = 0
+        return self
+
+    def __next__(self):
+        if self.index >= self.num_item:
+            raise StopIteration
+        end_idx = self.get_end_idx()
+        seeds = {}
+        for ntype, ids, start, end in zip(self.ntypes, self.nids, self.offsets[:-1], self.offsets[1:]):
+            if start < end_idx and self.index < end:
+                seeds[ntype] = ids[max(self.index, start) - start:min(end_idx, end) - start]
+        self.index = end_idx
+        input_nodes, output_nodes, blocks = self.sampler.sample(self.g, seeds)
+        return input_nodes, output_nodes, [block.to(self.device) for block in blocks]
@@ -1,7 +1,30 @@
+from collections import OrderedDict
+
 import pynvml
 import torch
 from dgl.utils import pin_memory_inplace, unpin_memory_inplace
 
+from .utils import get_bucket, is_mmap_tensor
+
+
+def mmap_tensor(path, shape, dtype=torch.float32):
+    """A tensor backed by the file at ``path``, paged in by the OS when rows are read.
+
+    It may be larger than the memory, as a table of edge features gathered by the ``dgl.EID`` of each batch.
+    """
+    numel = 1
+    for dim in shape:
+        numel *= dim
+    return torch.from_file(path, shared=True, size=numel, dtype=dtype).view(tuple(shape))
+
+
+def save_mmap_tensor(val, path, chunk_rows=1 << 20):
+    # write the rows of val to path in chunks, to be opened by mmap_tensor
+    with open(path, "wb") as f:
+        for start in range(0, val.shape[0], chunk_rows):
+            f.write(val[start:start + chunk_rows].contiguous().cpu().numpy().tobytes())
+    return mmap_tensor(path, val.shape, val.dtype)
+
 
 class DataManager:
     def __init__(self, device, use_uva):
@@ -20,14 +43,19 @@ class DataManager:
     def __delitem__(self, arg_node):
         del self.arg2val_map[arg_node]
 
+    def _pinnable(self, arg_node):
+        # a file-backed tensor is read page by page, pinning would make it resident
+        val = self[arg_node]
+        return isinstance(val, torch.Tensor) and val.device.type == 'cpu' and not is_mmap_tensor(val)
+
     def pin_data_inplace(self, layer):
         for arg_node in layer.inputs:
-            if isinstance(self[arg_node], torch.Tensor) and self[arg_node].device.type == 'cpu':
+            if self._pinnable(arg_node):
                 pin_memory_inplace(self[arg_node])
 
     def unpin_data_inplace(self, layer):
         for arg_node in layer.inputs:
-            if isinstance(self[arg_node], torch.Tensor) and self[arg_node].device.type == 'cpu':
+            if self._pinnable(arg_node):
                 unpin_memory_inplace(self[arg_node])
 
 
@@ -82,3 +110,39 @@ class AutoDataManager(DataManager):
         self.curr -= self.arg_in_gpu[arg_node]
         print("remove {} from gpu, comsuption={}, curr={}".format(arg_node.name, self.arg_in_gpu[arg_node], self.curr) )
         del self.arg_in_gpu[arg_node]
+
+
+class StagingBuffers:
+    """Preallocated buffers which the features of a batch are gathered into, one per shape class.
+
+    The rows of a batch are rounded up to a step of the bucket ladder, so batches of the same class reuse
+    the buffer instead of allocating a new tensor. At most ``max_classes`` buffers are kept per input.
+    """
+    def __init__(self, max_classes=4):
+        self.max_classes = max_classes
+        self.buffers = {}
+        self.allocations = 0
+        self.reuses = 0
+        self.allocated_bytes = 0
+
+    def gather(self, arg_node, val, index):
+        num_rows = get_bucket(index.shape[0])
+        buffers = self.buffers.setdefault(arg_node, OrderedDict())
+        key = (num_rows, tuple(val.shape[1:]), val.dtype, val.device)
+        if key in buffers:
+            buffers.move_to_end(key)
+            self.reuses += 1
+        else:
+            if len(buffers) >= self.max_classes:
+                _, old = buffers.popitem(last=False)
+                self.allocated_bytes -= old.element_size() * old.nelement()
+            buffers[key] = torch.empty((num_rows,) + tuple(val.shape[1:]), dtype=val.dtype, device=val.device)
+            self.allocations += 1
+            self.allocated_bytes += buffers[key].element_size() * buffers[key].nelement()
+        out = buffers[key][:index.shape[0]]
+        torch.index_select(val, 0, index.to(val.device), out=out)
+        return out
+
+    def clear(self):
+        self.buffers = {}
+        self.allocated_bytes = 0
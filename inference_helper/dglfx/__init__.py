@@ -1,2 +1,3 @@
 from .tracer import dgl_symbolic_trace, DGLTracer
-from .cost_evaluater import CostEvaluater
+from .proxy import get_graph_meta, is_hetero_meta
+from .cost_evaluater import CostEvaluater, LayerCost, make_probe_block, make_probe_graph, get_device_rates
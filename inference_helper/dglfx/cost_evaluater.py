@@ -1,13 +1,342 @@
+import math
+import operator
+import time
+
 import dgl
 import torch
+import torch.nn as nn
+from dgl import DGLHeteroGraph
 from torch.fx import GraphModule, Interpreter
 
+from ..constants import CALL_MODULE, CALL_FUNCTION, CALL_METHOD, GET_ATTR, OUTPUT, PLACEHOLDER
+
+# A probe block with distinct src / dst / edge counts tells which of them the rows of a tensor follow.
+PROBE_SRC = 53
+PROBE_DST = 31
+PROBE_EDGES = 97
+# index of a cost vector: (per src node, per dst node, per edge, constant)
+SRC, DST, EDGE, CONST = range(4)
+PROBE_COUNTS = (PROBE_SRC, PROBE_DST, PROBE_EDGES, 1)
+# the probe of a heterograph shifts the counts of each node and edge type by this, so the row count of a
+# tensor also tells its type.
+HETERO_PROBE_STEP = 100
+
+MATMULS = (torch.matmul, torch.mm, torch.bmm, operator.matmul, nn.functional.linear, "matmul", "mm", "bmm")
+VIEWS = (operator.getitem, getattr, "view", "reshape", "flatten", "unsqueeze", "squeeze", "permute",
+         "transpose", "expand", "contiguous", "size", "dim")
+
+
+def probe_counts(graph_meta=None):
+    """(src counts, dst counts, edge counts) of the probe, by node type and canonical edge type."""
+    if graph_meta is None:
+        return {None: PROBE_SRC}, {None: PROBE_DST}, {None: PROBE_EDGES}
+    ntypes, cetypes = graph_meta["ntypes"], graph_meta["canonical_etypes"]
+    num_src = {ntype: PROBE_SRC + HETERO_PROBE_STEP * (i + 1) for i, ntype in enumerate(ntypes)}
+    num_dst = {ntype: PROBE_DST + HETERO_PROBE_STEP * (i + 1) for i, ntype in enumerate(ntypes)}
+    num_edges = {cetype: PROBE_EDGES + HETERO_PROBE_STEP * (len(ntypes) + r + 1) for r, cetype in enumerate(cetypes)}
+    return num_src, num_dst, num_edges
+
+
+def make_probe_block(device, graph_meta=None):
+    if graph_meta is None:
+        eids = torch.arange(PROBE_EDGES)
+        # the first PROBE_DST edges are self loops, so every dst node has an in-edge.
+        return dgl.create_block((eids % PROBE_SRC, eids % PROBE_DST), num_src_nodes=PROBE_SRC,
+                                num_dst_nodes=PROBE_DST, device=device)
+    num_src, num_dst, num_edges = probe_counts(graph_meta)
+    data = {}
+    for (srctype, etype, dsttype), count in num_edges.items():
+        eids = torch.arange(count)
+        data[(srctype, etype, dsttype)] = (eids % num_src[srctype], eids % num_dst[dsttype])
+    return dgl.create_block(data, num_src_nodes=num_src, num_dst_nodes=num_dst, device=device)
+
+
+def make_probe_graph(device, graph_meta=None):
+    # a graph of PROBE_SRC nodes and PROBE_EDGES edges, where every node has an in-edge.
+    if graph_meta is None:
+        eids = torch.arange(PROBE_EDGES)
+        return dgl.graph(((eids * 7 + eids // PROBE_SRC) % PROBE_SRC, eids % PROBE_SRC), num_nodes=PROBE_SRC,
+                         device=device)
+    num_src, _, num_edges = probe_counts(graph_meta)
+    data = {}
+    for (srctype, etype, dsttype), count in num_edges.items():
+        eids = torch.arange(count)
+        data[(srctype, etype, dsttype)] = ((eids * 7 + eids // num_src[srctype]) % num_src[srctype],
+                                           eids % num_src[dsttype])
+    return dgl.heterograph(data, num_nodes_dict=num_src, device=device)
+
+
+def get_row_kinds(graph_meta=None):
+    # row count of the probe -> (row kind, node type)
+    num_src, num_dst, num_edges = probe_counts(graph_meta)
+    kinds = {}
+    kinds.update({count: (SRC, ntype) for ntype, count in num_src.items()})
+    kinds.update({count: (DST, ntype) for ntype, count in num_dst.items()})
+    kinds.update({count: (EDGE, None) for count in num_edges.values()})
+    return kinds
+
+
+_row_kinds = get_row_kinds()
+
+def row_kind(val, kinds=None):
+    if val.dim() == 0:
+        return CONST
+    kinds = _row_kinds if kinds is None else kinds
+    return kinds.get(val.shape[0], (CONST, None))[0]
+
+
+def row_ntype(val, kinds=None):
+    if val.dim() == 0:
+        return None
+    kinds = _row_kinds if kinds is None else kinds
+    return kinds.get(val.shape[0], (CONST, None))[1]
+
+
+def dot(cost, src, dst, edges):
+    return cost[SRC] * src + cost[DST] * dst + cost[EDGE] * edges + cost[CONST]
+
+
+def _flatten(val):
+    if isinstance(val, dict):
+        return _flatten(list(val.values()))
+    if isinstance(val, (tuple, list)):
+        ret = []
+        for v in val:
+            ret.extend(_flatten(v))
+        return ret
+    return [val]
+
+
+def _storage_ptr(val):
+    if hasattr(val, "untyped_storage"):
+        return val.untyped_storage().data_ptr()
+    return val.storage().data_ptr()
+
+
+_device_rates = {}
+
+def get_device_rates(device):
+    """Measured (FLOP/s, bytes/s) of the device, from a matmul and a copy."""
+    device = torch.device(device)
+    if str(device) in _device_rates:
+        return _device_rates[str(device)]
+    sync = torch.cuda.synchronize if device.type == 'cuda' else (lambda: None)
+    a = torch.rand(512, 512, device=device)
+    b = torch.rand(8 * 1024 ** 2, device=device)
+    a @ a, b.clone()
+    sync()
+    st = time.perf_counter()
+    for _ in range(4):
+        a @ a
+    sync()
+    flop_rate = 4 * 2 * 512 ** 3 / max(time.perf_counter() - st, 1e-9)
+    st = time.perf_counter()
+    for _ in range(4):
+        b.clone()
+    sync()
+    # a copy reads and writes every byte
+    bandwidth = 4 * 2 * b.numel() * b.element_size() / max(time.perf_counter() - st, 1e-9)
+    _device_rates[str(device)] = flop_rate, bandwidth
+    return flop_rate, bandwidth
+
+
+class LayerCost:
+    """Bytes and FLOPs of one conv_block, as vectors of (per src node, per dst node, per edge, constant)."""
+    def __init__(self, layer_id):
+        self.layer_id = layer_id
+        # bytes alive after each node
+        self.live_bytes = []
+        # bytes of every allocation
+        self.total_bytes = [0.] * 4
+        self.input_bytes = [0.] * 4
+        self.output_bytes = [0.] * 4
+        self.flops = [0.] * 4
+        self.output_shapes = []
+
+    def peak_step(self, src, dst, edges):
+        if len(self.live_bytes) == 0:
+            return [0.] * 4
+        return max(self.live_bytes, key=lambda step: dot(step, src, dst, edges))
+
+    def peak_bytes(self, src, dst, edges):
+        return dot(self.peak_step(src, dst, edges), src, dst, edges)
+
+    def predict_time(self, src, dst, edges, rates):
+        flop_rate, bandwidth = rates
+        return dot(self.flops, src, dst, edges) / flop_rate + \
+            dot(self.total_bytes, src, dst, edges) / bandwidth
+
+    def plan(self, num_nodes, num_edges, free_memory, rates):
+        """Largest batch of consecutive nodes predicted to fit ``free_memory``, and the predicted time of the layer.
+
+        Each edge of a batch is assumed to bring a new src node, so the budget is a lower bound.
+        """
+        degree = num_edges / max(num_nodes, 1)
+        def batch(node_count):
+            return min(num_nodes, node_count * (1 + degree)), node_count, node_count * degree
+
+        lo, hi = 1, max(num_nodes, 1)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.peak_bytes(*batch(mid)) <= free_memory:
+                lo = mid
+            else:
+                hi = mid - 1
+        src, dst, edges = batch(lo)
+        peak = self.peak_step(src, dst, edges)
+        num_batches = math.ceil(num_nodes / lo)
+        return {
+            "layer": self.layer_id,
+            "bytes_per_src": peak[SRC],
+            "bytes_per_dst": peak[DST],
+            "bytes_per_edge": peak[EDGE],
+            "const_bytes": peak[CONST],
+            "input_bytes_per_edge": self.input_bytes[EDGE],
+            "flops_per_src": self.flops[SRC],
+            "flops_per_dst": self.flops[DST],
+            "flops_per_edge": self.flops[EDGE],
+            "max_node": lo,
+            "max_edge": int(edges) + 1,
+            "peak_memory": dot(peak, src, dst, edges),
+            "output_bytes": dot(self.output_bytes, 0, num_nodes, 0),
+            "time": num_batches * self.predict_time(src, dst, edges, rates),
+        }
+
 
 class CostEvaluater(Interpreter):
-    def __init__(self, gm: GraphModule):
+    """Propagate shapes and dtypes through one conv_block graph on a probe block, tracking live bytes and FLOPs.
+
+    DGL's sparse kernels have no meta kernels, so the graph runs on real tensors of a few rows. The
+    row count of every tensor tells whether it scales with src nodes, dst nodes or edges, and on the probe
+    of a heterograph (``graph_meta``) also the node type. Per-type costs are summed, as if every node had
+    all types, which overestimates.
+    """
+    def __init__(self, gm: GraphModule, layer_id=0, graph_meta=None):
         super().__init__(gm)
+        self.cost = LayerCost(layer_id)
+        self.kinds = get_row_kinds(graph_meta)
+        # node name -> (row kind, bytes of a row) of every tensor value
+        self.node_rows = {}
+        # node name -> FLOPs per row of the node itself
+        self.node_flops = {}
+        self.block = None
+        self.last_use = {}
+        self.live = {}
+        self.storages = set()
+        # keep every value, so no storage is reused during the run
+        self.keep = []
 
     def eval(self, *args):
-        fake_graph = dgl.graph((torch.tensor([0]), torch.tensor([0]))).to('cuda')
-        new_args = (fake_graph, torch.zeros((1, 3703)).to('cuda'))
-        self.run(*new_args)
+        self.block = next((arg for arg in args if isinstance(arg, DGLHeteroGraph)), None)
+        for node in self.module.graph.nodes:
+            for arg in node.all_input_nodes:
+                self.last_use[arg] = node
+        with torch.no_grad():
+            outputs = self.run(*args)
+        for val in (outputs if isinstance(outputs, (tuple, list)) else (outputs,)):
+            for v in _flatten(val):
+                if isinstance(v, torch.Tensor):
+                    self._add(self.cost.output_bytes, v, v.element_size() * v.numel())
+            if isinstance(val, torch.Tensor):
+                ntype = row_ntype(val, self.kinds)
+                # a tensor of one node type of a heterograph
+                self.cost.output_shapes.append((torch.Tensor, val.size()[1:]) + (() if ntype is None else (ntype,)))
+            elif isinstance(val, dict) and all(isinstance(v, torch.Tensor) for v in val.values()):
+                self.cost.output_shapes.append((dict, {k: v.size()[1:] for k, v in val.items()}))
+            else:
+                self.cost.output_shapes.append((val.__class__, None))
+        return outputs, self.cost
+
+    def _add(self, cost, val, total):
+        kind = row_kind(val, self.kinds)
+        cost[kind] += total / (val.shape[0] if kind != CONST else 1)
+
+    def _allocate(self, owner, val):
+        # the bytes of a tensor are counted once per storage, views are free.
+        ptr = _storage_ptr(val)
+        self.keep.append(val)
+        if ptr in self.storages:
+            return False
+        self.storages.add(ptr)
+        live = self.live.setdefault(owner, [0.] * 4)
+        self._add(live, val, val.element_size() * val.numel())
+        self._add(self.cost.total_bytes, val, val.element_size() * val.numel())
+        return True
+
+    def _block_tensors(self):
+        if self.block is None:
+            return {}
+        ret = {}
+        for frame_name in ("srcdata", "dstdata", "edata"):
+            for key, val in getattr(self.block, frame_name).items():
+                if isinstance(val, torch.Tensor):
+                    ret[(frame_name, key)] = val
+        return ret
+
+    def _flops(self, n, args, val, new_tensors):
+        flops = self.cost.flops
+        tensors = [v for v in _flatten(val) if isinstance(v, torch.Tensor)]
+        if n.op == CALL_MODULE:
+            mod = self.fetch_attr(n.target)
+            if isinstance(mod, nn.Linear):
+                for t in tensors:
+                    self._add(flops, t, 2 * t.numel() * mod.in_features)
+            elif any(isinstance(arg, DGLHeteroGraph) for arg in args):
+                # a graph conv module: a dense transform of every row and an aggregation over the edges.
+                params = sum(p.numel() for p in mod.parameters())
+                for t in tensors:
+                    if t.dim() > 0:
+                        self._add(flops, t, 2 * params * t.shape[0])
+                        flops[EDGE] += t.numel() / t.shape[0]
+            else:
+                for t in tensors:
+                    self._add(flops, t, t.numel())
+        elif n.op in (CALL_FUNCTION, CALL_METHOD) and n.target in MATMULS:
+            for t in tensors:
+                self._add(flops, t, 2 * t.numel() * args[0].shape[-1])
+        elif n.op in (CALL_FUNCTION, CALL_METHOD) and n.target not in VIEWS:
+            for t in new_tensors:
+                self._add(flops, t, t.numel())
+
+    def run_node(self, n):
+        if n.op == OUTPUT:
+            self.cost.live_bytes.append(self._live_sum())
+            return super().run_node(n)
+        args, _ = self.fetch_args_kwargs_from_env(n)
+        before = self._block_tensors()
+        val = super().run_node(n)
+
+        if n.op == GET_ATTR:
+            # parameters and buffers stay resident, they are not part of a batch.
+            for v in _flatten(val):
+                if isinstance(v, torch.Tensor):
+                    self.storages.add(_storage_ptr(v))
+            return val
+        if isinstance(val, torch.Tensor) and val.dim() > 0:
+            self.node_rows[n.name] = (row_kind(val, self.kinds), val.element_size() * val.numel() / max(val.shape[0], 1))
+        new_tensors = [v for v in _flatten(val) if isinstance(v, torch.Tensor) and self._allocate(n, v)]
+        if n.op == PLACEHOLDER:
+            for t in new_tensors:
+                self._add(self.cost.input_bytes, t, t.element_size() * t.numel())
+        flops = list(self.cost.flops)
+        # message passing writes into the block instead of returning a value.
+        for key, data in self._block_tensors().items():
+            if before.get(key) is not data and self._allocate("block", data) and data.dim() > 0:
+                self.cost.flops[EDGE] += data.numel() / data.shape[0]
+        self._flops(n, args, val, new_tensors)
+        self.node_flops[n.name] = sum(self.cost.flops[i] - flops[i] for i in range(4))
+
+        self.cost.live_bytes.append(self._live_sum())
+        for arg in n.all_input_nodes:
+            if self.last_use.get(arg) is n:
+                self.live.pop(arg, None)
+        if len(n.users) == 0:
+            self.live.pop(n, None)
+        return val
+
+    def _live_sum(self):
+        ret = [0.] * 4
+        for live in self.live.values():
+            for i in range(4):
+                ret[i] += live[i]
+        return ret
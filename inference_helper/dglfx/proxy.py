@@ -3,7 +3,21 @@ import builtins
 
 from torch.fx import Proxy, Node, Tracer
 from ..constants import CALL_METHOD, CALL_FUNCTION, \
-    DGL_GRAPH, DGL_GRAPH_ATTRIBUTE
+    DGL_GRAPH, DGL_GRAPH_ATTRIBUTE, DGL_GRAPH_DATA
+
+
+def get_graph_meta(graph):
+    """The node and edge types of a graph, which the tracer unrolls the loops over types with."""
+    return {
+        "ntypes": list(graph.ntypes),
+        "etypes": list(graph.etypes),
+        "canonical_etypes": [tuple(cetype) for cetype in graph.canonical_etypes],
+    }
+
+
+def is_hetero_meta(graph_meta):
+    return graph_meta is not None and \
+        (len(graph_meta["ntypes"]) > 1 or len(graph_meta["canonical_etypes"]) > 1)
 
 class DGLGraphProxy(Proxy):
     def __init__(self, node: Node, tracer: Tracer = None):
@@ -21,9 +35,57 @@ class DGLGraphProxy(Proxy):
         return self
 
     def __getitem__(self, rhs):
+        if isinstance(rhs, (str, tuple)):
+            # a relation of a heterograph, e.g. G[srctype, etype, dsttype]
+            return self.tracer.create_proxy(CALL_FUNCTION, operator.getitem, (self, rhs), {},
+                proxy_factory_fn=self.tracer.dgl_relation_graph)
         return self.tracer.create_proxy(CALL_FUNCTION, operator.getitem, (self, rhs), {}, 
             proxy_factory_fn=self.tracer.dgl_graph_proxy)
 
+    def _graph_meta(self, key):
+        if self.tracer.graph_meta is None:
+            raise Exception("Tracing {} of a graph needs the graph_meta of the inference graph.".format(key))
+        return self.tracer.graph_meta[key]
+
+    @property
+    def ntypes(self):
+        return self._graph_meta("ntypes")
+
+    @property
+    def srctypes(self):
+        return self._graph_meta("ntypes")
+
+    @property
+    def dsttypes(self):
+        return self._graph_meta("ntypes")
+
+    @property
+    def etypes(self):
+        return self._graph_meta("etypes")
+
+    @property
+    def canonical_etypes(self):
+        return self._graph_meta("canonical_etypes")
+
+    @property
+    def nodes(self):
+        return self.tracer.create_proxy(CALL_FUNCTION, builtins.getattr, (self, "nodes"), {},
+            proxy_factory_fn=self.tracer.dgl_node_view)
+
+    @property
+    def srcnodes(self):
+        return self.tracer.create_proxy(CALL_FUNCTION, builtins.getattr, (self, "srcnodes"), {},
+            proxy_factory_fn=self.tracer.dgl_node_view)
+
+    @property
+    def dstnodes(self):
+        return self.tracer.create_proxy(CALL_FUNCTION, builtins.getattr, (self, "dstnodes"), {},
+            proxy_factory_fn=self.tracer.dgl_node_view)
+
+    def multi_update_all(self, *args, **kwargs):
+        return self.tracer.create_proxy(CALL_METHOD, "multi_update_all", (self,) + args, kwargs,
+            proxy_factory_fn=self.tracer.dgl_void_call)
+
     def apply_edges(self, *args, **kwargs):
         return self.tracer.create_proxy(CALL_METHOD, "apply_edges", (self,) + args, kwargs, 
             proxy_factory_fn=self.tracer.dgl_void_call)
@@ -56,6 +118,25 @@ class DGLGraphProxy(Proxy):
         return "{}{}".format(DGL_GRAPH, super().__str__())
 
 
+class DGLNodeView(Proxy):
+    # G.nodes, G.srcnodes or G.dstnodes, and G.nodes[ntype]
+    def __init__(self, node: Node, tracer: Tracer = None):
+        super().__init__(node, tracer)
+        node.node_type = DGL_GRAPH_DATA
+
+    def __getitem__(self, rhs):
+        return self.tracer.create_proxy(CALL_FUNCTION, operator.getitem, (self, rhs), {},
+            proxy_factory_fn=self.tracer.dgl_node_view)
+
+    @property
+    def data(self):
+        return self.tracer.create_proxy(CALL_FUNCTION, builtins.getattr, (self, "data"), {},
+            proxy_factory_fn=self.tracer.dgl_graph_attribute)
+
+    def __str__(self):
+        return "{}{}".format(DGL_GRAPH_DATA, super().__str__())
+
+
 class DGLGraphAttribute(Proxy):
     def __init__(self, node: Node, tracer: Tracer = None):
         super().__init__(node, tracer)
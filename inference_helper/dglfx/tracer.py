@@ -8,7 +8,7 @@ from dgl.nn.functional import edge_softmax
 from dgl.function.message import BinaryMessageFunction, CopyMessageFunction
 from dgl.function.reducer import SimpleReduceFunction
 
-from .proxy import DGLGraphProxy, DGLGraphAttribute
+from .proxy import DGLGraphProxy, DGLGraphAttribute, DGLNodeView
 from ..constants import DGL_GRAPH, DGL_TENSOR_DATA, DGL_VOID_CALL, DGL_FUNCTION, DGL_GRAPH_DATA, \
     CALL_FUNCTION, CALL_METHOD, GET_ATTR, TENSOR_DATA, UTIL_DATA
 
@@ -41,8 +41,11 @@ class DGLTracer(Tracer):
     @compatibility(is_backward_compatible=True)
     def __init__(self, autowrap_modules = (math, ),
                  autowrap_functions = (),
-                 param_shapes_constant = False) -> None:
+                 param_shapes_constant = False,
+                 graph_meta = None) -> None:
         self.graph_proxy = None
+        # node and edge types of the graph, from get_graph_meta
+        self.graph_meta = graph_meta
         self.conv_modules = dgl.nn.conv.__dict__["__all__"]
         autowrap_functions += (edge_softmax,)
         super().__init__(autowrap_modules, autowrap_functions, param_shapes_constant)
@@ -88,6 +91,16 @@ class DGLTracer(Tracer):
     def dgl_graph_proxy(self, node: Node) -> "Proxy":
         return DGLGraphProxy(node, self)
 
+    @compatibility(is_backward_compatible=True)
+    def dgl_relation_graph(self, node: Node) -> "Proxy":
+        proxy = DGLGraphProxy(node, self)
+        node.relation = node.args[1]
+        return proxy
+
+    @compatibility(is_backward_compatible=True)
+    def dgl_node_view(self, node: Node) -> "Proxy":
+        return DGLNodeView(node, self)
+
     @compatibility(is_backward_compatible=True)
     def dgl_graph_attribute(self, node: Node) -> "Proxy":
         return DGLGraphAttribute(node, self)
@@ -121,8 +134,8 @@ class DGLTracer(Tracer):
 
 
 @compatibility(is_backward_compatible=True)
-def dgl_symbolic_trace(root, concrete_args=None):
-    tracer = DGLTracer()
+def dgl_symbolic_trace(root, concrete_args=None, graph_meta=None):
+    tracer = DGLTracer(graph_meta=graph_meta)
     graph = tracer.trace(root, concrete_args)
     name = root.__class__.__name__ if isinstance(root, torch.nn.Module) else root.__name__
     gm = GraphModule(tracer.root, graph, name)
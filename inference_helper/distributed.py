@@ -0,0 +1,78 @@
+import math
+
+import torch
+import torch.distributed as dist
+
+
+def partition_ranges(graph, world_size, balance_edges=True):
+    """Cut the nodes of a graph into ``world_size`` contiguous ranges, rank ``i`` owns the nodes
+    ``[bounds[i], bounds[i + 1])``.
+
+    With ``balance_edges`` every range has about the same number of in-edges, otherwise of nodes.
+    """
+    num_nodes = graph.num_nodes()
+    if not balance_edges or graph.num_edges() == 0:
+        return [num_nodes * i // world_size for i in range(world_size + 1)]
+    cum_degrees = torch.cumsum(graph.in_degrees().long(), 0)
+    targets = torch.arange(1, world_size) * int(cum_degrees[-1]) // world_size
+    return [0] + torch.searchsorted(cum_degrees, targets, right=True).tolist() + [num_nodes]
+
+
+class HaloExchange():
+    """The rows of the in-neighbors of the owned dst nodes which other ranks own, fetched by all-to-all.
+
+    The halo only depends on the structure, so the IDs are exchanged once; every ``exchange`` of a node
+    shard then sends ``chunk_rows`` rows at most to every peer per round, to bound the buffers.
+    """
+    def __init__(self, graph, bounds, rank, world_size, chunk_rows=1 << 20, group=None):
+        self.start, self.end = bounds[rank], bounds[rank + 1]
+        self.world_size = world_size
+        self.chunk_rows = chunk_rows
+        self.group = group
+        u, _ = graph.in_edges(torch.arange(self.start, self.end, dtype=graph.idtype))
+        u = torch.unique(u.long())
+        self.halo_ids = u[(u < self.start) | (u >= self.end)]
+        # rows received from and sent to every rank
+        self.recv_counts = (torch.searchsorted(self.halo_ids, torch.tensor(bounds[1:]))
+                            - torch.searchsorted(self.halo_ids, torch.tensor(bounds[:-1]))).tolist()
+        send_counts = torch.empty(world_size, dtype=torch.long)
+        dist.all_to_all_single(send_counts, torch.tensor(self.recv_counts), group=group)
+        self.send_counts = send_counts.tolist()
+        requested = torch.empty(sum(self.send_counts), dtype=torch.long)
+        dist.all_to_all_single(requested, self.halo_ids, output_split_sizes=self.send_counts,
+                               input_split_sizes=self.recv_counts, group=group)
+        self.send_rows = requested - self.start
+        rounds = torch.tensor([max(self.send_counts + self.recv_counts + [0])])
+        dist.all_reduce(rounds, op=dist.ReduceOp.MAX, group=group)
+        self.rounds = (int(rounds) + chunk_rows - 1) // chunk_rows
+
+    @property
+    def num_owned(self):
+        return self.end - self.start
+
+    def local_ids(self, nids):
+        # global node IDs of owned or halo nodes -> rows of the shard followed by the halo rows
+        nids = nids.long()
+        owned = (nids >= self.start) & (nids < self.end)
+        halo_rows = torch.searchsorted(self.halo_ids, nids).clamp(max=max(len(self.halo_ids) - 1, 0))
+        return torch.where(owned, nids - self.start, self.num_owned + halo_rows)
+
+    def exchange(self, shard):
+        """The halo rows of a node shard; return ``(rows, bytes sent, bytes received)``."""
+        row_shape = tuple(shard.shape[1:])
+        send_offsets = [0] + torch.cumsum(torch.tensor(self.send_counts), 0).tolist()
+        recv_offsets = [0] + torch.cumsum(torch.tensor(self.recv_counts), 0).tolist()
+        halo = shard.new_empty((len(self.halo_ids),) + row_shape)
+        for i in range(self.rounds):
+            lo, hi = i * self.chunk_rows, (i + 1) * self.chunk_rows
+            send_splits = [max(min(count, hi) - lo, 0) for count in self.send_counts]
+            recv_splits = [max(min(count, hi) - lo, 0) for count in self.recv_counts]
+            send_index = torch.cat([self.send_rows[send_offsets[p] + lo:send_offsets[p] + lo + send_splits[p]]
+                                    for p in range(self.world_size)])
+            recv = shard.new_empty((sum(recv_splits),) + row_shape)
+            dist.all_to_all_single(recv, shard[send_index].contiguous(), output_split_sizes=recv_splits,
+                                   input_split_sizes=send_splits, group=self.group)
+            for p, rows in enumerate(torch.split(recv, recv_splits)):
+                halo[recv_offsets[p] + lo:recv_offsets[p] + lo + recv_splits[p]] = rows
+        row_bytes = math.prod(row_shape) * shard.element_size()
+        return halo, sum(self.send_counts) * row_bytes, len(self.halo_ids) * row_bytes
@@ -1,3 +1,5 @@
+import copy
+import hashlib
 import types
 
 import dgl
@@ -9,15 +11,34 @@ from .schema import Schema
 from .dglfx import dgl_symbolic_trace
 from .graph_rewriter import GraphRewriter
 from .graph_rearranger import GraphRearranger
-from .constants import CONV_BLOCK
+from .constants import CONV_BLOCK, FOLDED_PREFIX, TENSOR_DATA, UTIL_DATA, DGL_GRAPH_DATA
 
 
 class FunctionGenerator(nn.Module):
-    def __init__(self, module: nn.Module, debug):
+    def __init__(self, module: nn.Module, debug, simplify=True, graph_meta=None):
         super().__init__()
         self.debug = debug
+        self.simplify = simplify
+        # node and edge types of a heterogeneous inference graph
+        self.graph_meta = graph_meta
+        # placeholder name -> (ntype, key) of the node features read from the inference graph
+        self.graph_inputs = {}
+        # placeholder name -> key of the edge features read from the inference graph
+        self.edge_inputs = {}
+        # submodule name -> StreamingGATConv which runs a GATConv of the forward
+        self.streaming = {}
         self.schema = None
         self.funcs = []
+        self.func_srcs = []
+        self.graphs = []
+        # graph-only computations, run once on the full graph
+        self.hoisted = None
+        self.hoisted_inputs = {}
+        # nodes removed by constant folding and common subexpression elimination
+        self.eliminated = {"folded": 0, "cse": 0, "layer_cse": 0}
+        # the forward before the eval-mode simplification, to check the simplified one against
+        self.unsimplified = None
+        self.simplified = {"dropout": 0, "norms": 0, "activations": 0}
         for name in module.__dict__:
             if hasattr(module, name):
                 attr = getattr(module, name)
@@ -28,7 +49,7 @@ class FunctionGenerator(nn.Module):
         if isinstance(module, GraphModule):
             self.traced = module
         else:
-            self.traced = dgl_symbolic_trace(module)
+            self.traced = dgl_symbolic_trace(module, graph_meta=self.graph_meta)
 
         if self.debug:
             print("-------- Origin forward function -------")
@@ -39,21 +60,75 @@ class FunctionGenerator(nn.Module):
         self.schema.record_inputs_and_outputs(self.traced.graph)
         GraphRewriter.blocks_to_graph(self.traced.graph)
         GraphRewriter.remove_unused_nodes(self.traced.graph)
+        self.graph_inputs = GraphRewriter.graph_data_to_inputs(self.traced.graph)
+        self.edge_inputs = GraphRewriter.edge_data_to_inputs(self.traced.graph)
+        if self.simplify:
+            self.unsimplified = GraphModule(self.traced, copy.deepcopy(self.traced.graph))
+            self.simplified = GraphRewriter.simplify_for_inference(self.traced)
+            GraphRewriter.remove_unused_nodes(self.traced.graph)
+        self.streaming = GraphRewriter.stream_attention(self.traced)
+        for name, streaming in self.streaming.items():
+            setattr(self, name, streaming)
+        self.eliminated["folded"] += GraphRewriter.fold_constants(self.traced)
+        # the generated functions read the folded values from self, as buffers they follow .to() of the generator.
+        # They are computed from the weights once: a helper must be rebuilt after the weights of its module change.
+        for name, buffer in self.traced.named_buffers():
+            if name.startswith(FOLDED_PREFIX):
+                self.register_buffer(name, buffer, persistent=False)
+        # graph calls are per batch values, they are only merged inside a layer below.
+        self.eliminated["cse"] += GraphRewriter.eliminate_common_subexpressions(
+            self.traced.graph, (TENSOR_DATA,), self.traced)
+        GraphRewriter.remove_unused_nodes(self.traced.graph)
+        if self.simplify:
+            # after the elimination, which merges the tensors the activations would write
+            self.simplified["activations"] = GraphRewriter.fuse_activations(self.traced)
+            if self.debug:
+                print("Removed {dropout} dropout, folded {norms} norm layers, "
+                      "fused {activations} activations.".format(**self.simplified))
+        hoisted_graph, self.hoisted_inputs = GraphRewriter.hoist_graph_data(self.traced.graph)
+        if hoisted_graph is not None:
+            self.hoisted = GraphModule(self.traced, hoisted_graph)
         self.traced.recompile()
 
+        if self.debug and self.hoisted is not None:
+            print("-------- Hoisted graph function --------")
+            print(self.hoisted.code.strip())
+            print("----------------------------------------")
+
         if self.debug:
             print("------- Modified forward function ------")
             print(self.traced.code.strip())
             print("----------------------------------------")
 
-        rearranger = GraphRearranger(self.traced)
+        self.split()
+
+    def split(self, node_bytes=None, node_flops=None):
+        """Split the traced forward into the per-layer functions.
+
+        ``node_bytes`` maps node names to the bytes of a row of their value, which lets the rearranger
+        pick the layer boundaries storing the fewest bytes; with ``node_flops``, the FLOPs per row of each
+        node, cheap values are recomputed instead of stored. Return whether the functions changed.
+        """
+        old_srcs = self.func_srcs
+        self.schema.reset_layers()
+        self.funcs, self.func_srcs, self.graphs = [], [], []
+        self.eliminated["layer_cse"] = 0
+
+        rearranger = GraphRearranger(self.traced, node_bytes, node_flops)
         rearranger.rearrange()
         graphs_list = rearranger.get_splited_graphs()
 
         for layer_id, graph in enumerate(graphs_list):
+            self.eliminated["layer_cse"] += GraphRewriter.eliminate_common_subexpressions(
+                graph, (TENSOR_DATA, UTIL_DATA, DGL_GRAPH_DATA), self.traced)
             self.register_func_from_graph(graph, layer_id)
             self.schema.create_layer(graph)
 
+        if self.debug:
+            print("Folded {} constant nodes, eliminated {} common subexpressions.".format(
+                self.eliminated["folded"], self.eliminated["cse"] + self.eliminated["layer_cse"]))
+        return self.func_srcs != old_srcs
+
     def register_func_from_graph(self, graph: Graph, layer_id: int):
         graph_src = graph.python_code("self").src
 
@@ -64,6 +139,8 @@ class FunctionGenerator(nn.Module):
         graph_src = graph_src.replace("dgl_function_reducer_", "dgl.function.reducer.")
         graph_src = graph_src.replace("dgl_ops_edge_softmax_", "dgl.ops.")
         self.set_function_from_string(graph_src, func_name)
+        self.func_srcs.append(graph_src)
+        self.graphs.append(graph)
 
         if self.debug:
             print("--------- Layer {} conv function --------".format(layer_id))
@@ -76,8 +153,20 @@ class FunctionGenerator(nn.Module):
         setattr(self, func_name, types.MethodType(globals_vals[func_name], self))
         self.funcs.append(getattr(self, func_name))
 
+    def get_fingerprint(self):
+        # identify the generated functions and the parameter shapes they run with.
+        sha = hashlib.sha1()
+        for func_src in self.func_srcs:
+            sha.update(func_src.encode())
+        for name, param in self.state_dict().items():
+            sha.update("{}:{}:{}".format(name, tuple(param.shape), param.dtype).encode())
+        return sha.hexdigest()
+
     def get_schema(self):
         return self.schema
 
     def get_funcs(self):
         return self.funcs
+
+    def get_graphs(self):
+        return self.graphs
@@ -1,14 +1,33 @@
+import networkx as nx
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
 from torch.fx import GraphModule
 
 from .dglfx.node_relation import get_node_relation
 from .graph_replicator import GraphReplicator
 from .constants import CALL_METHOD, CALL_MODULE, DGL_GRAPH, DGL_GRAPH_DATA, DGL_VOID_CALL, TENSOR_DATA, UTIL_DATA, \
-    OUTPUT, PLACEHOLDER
+    DGL_TENSOR_DATA, DGL_FUNCTION, OUTPUT, PLACEHOLDER, CALL_FUNCTION
+
+# A value is recomputed in a later layer instead of stored if its FLOPs are at most this many per byte saved.
+REMAT_FLOPS_PER_BYTE = 16
+REMAT_MODULES = (nn.ReLU, nn.LeakyReLU, nn.ELU, nn.GELU, nn.PReLU, nn.Sigmoid, nn.Tanh, nn.Dropout, nn.Identity,
+                 nn.Linear)
+REMAT_FUNCTIONS = (F.relu, F.elu, F.leaky_relu, F.gelu, F.dropout, torch.relu, torch.sigmoid, torch.tanh)
+REMAT_METHODS = ("relu", "sigmoid", "tanh", "flatten", "view", "reshape")
 
 
 class GraphRearranger():
-    def __init__(self, traced: GraphModule):
+    def __init__(self, traced: GraphModule, node_bytes=None, node_flops=None,
+                 remat_flops_per_byte=REMAT_FLOPS_PER_BYTE):
         self.traced = traced
+        # bytes of a row of every node-indexed value and FLOPs per row of every node, from shape propagation
+        self.node_bytes = node_bytes
+        self.node_flops = node_flops
+        self.remat_flops_per_byte = remat_flops_per_byte
+        # layer -> nodes recomputed at its start, and the nodes no layer computes any more
+        self.remat = {}
+        self.dead = set()
         self.output = None
         self.inputs = []
         self.graphs_list = []
@@ -24,7 +43,7 @@ class GraphRearranger():
             self.tagging_node(node)
             if node.op == PLACEHOLDER:
                 self.inputs.append(node)
-                if node.node_type != DGL_GRAPH:
+                if node.node_type != DGL_GRAPH and not getattr(node.node, "hoisted", False):
                     node.message_degree = 0
             if node.op == CALL_MODULE:
                 for e in node.in_edges:
@@ -91,22 +110,150 @@ class GraphRearranger():
                 e.dst.message_degree = message_layer
                 e = e.dst.out_edges[0]
 
+    def boundary_cost(self, node):
+        # bytes per node of storing the value across layers, None if it can't be stored.
+        if self.node_bytes is None or node.node_type not in (TENSOR_DATA, DGL_TENSOR_DATA) \
+            or node.op == PLACEHOLDER:
+            return None
+        return self.node_bytes.get(node.name)
+
+    def min_cut_search(self, nodes):
+        """Move the changable nodes around each layer boundary, so the stored values take the fewest bytes.
+
+        For the boundary after degree d, the nodes are split into the ones computed up to layer d and the
+        ones computed later. A node on the early side with a user on the late side is stored, which costs
+        its bytes once however many users it has. That is a min vertex cut, solved as a min edge cut of a
+        network with every node split into an "in" and an "out" vertex.
+        """
+        for d in range(self.output.message_degree):
+            # a node computed in layer d after its messages works on dst rows, it can only be moved there
+            # if all of its data inputs are dst rows too.
+            post_message = {}
+            for node in nodes:
+                inputs = [e.src for e in node.in_edges
+                          if e.src.node_type not in (DGL_GRAPH, DGL_FUNCTION, DGL_GRAPH_DATA, UTIL_DATA)]
+                if node.is_message:
+                    post_message[node] = node.message_degree == d
+                else:
+                    post_message[node] = len(inputs) > 0 and all(post_message.get(src, False) for src in inputs)
+
+            network = nx.DiGraph()
+            free = []
+            for node in nodes:
+                if node.node_type == DGL_GRAPH:
+                    continue
+                cost = self.boundary_cost(node)
+                if cost is None:
+                    network.add_edge(("in", node.name), ("out", node.name))
+                else:
+                    network.add_edge(("in", node.name), ("out", node.name), capacity=cost)
+                if node.changable and not node.is_message and node.message_degree in (d, d + 1) \
+                    and node.node_type == TENSOR_DATA and post_message[node] \
+                    and not getattr(node.node, "hoisted", False):
+                    free.append(node)
+                elif node.message_degree <= d:
+                    network.add_edge("source", ("in", node.name))
+                else:
+                    network.add_edge(("in", node.name), "sink")
+                for e in node.out_edges:
+                    if e.dst.node_type == DGL_GRAPH:
+                        continue
+                    # the value is stored if the user is computed later ...
+                    network.add_edge(("out", node.name), ("in", e.dst.name))
+                    # ... and a user can't be computed before its input.
+                    network.add_edge(("in", e.dst.name), ("in", node.name))
+                    if not e.allow_break:
+                        network.add_edge(("in", node.name), ("in", e.dst.name))
+            if len(free) == 0 or "source" not in network or "sink" not in network:
+                continue
+
+            curr_cost = 0
+            for node in nodes:
+                if node.node_type != DGL_GRAPH and node.message_degree <= d \
+                    and any(e.dst.message_degree > d for e in node.out_edges if e.dst.node_type != DGL_GRAPH):
+                    cost = self.boundary_cost(node)
+                    curr_cost = float("inf") if cost is None else curr_cost + cost
+            try:
+                cut_cost, (early, _) = nx.minimum_cut(network, "source", "sink")
+            except nx.NetworkXUnbounded:
+                continue
+            if cut_cost < curr_cost:
+                for node in free:
+                    node.message_degree = d if ("in", node.name) in early else d + 1
+
+    def is_cheap_row_wise(self, node):
+        if node.op == CALL_MODULE:
+            module = self.traced.get_submodule(node.target)
+            return isinstance(module, REMAT_MODULES) and not module.training
+        if node.op == CALL_FUNCTION:
+            # an in-place activation changes its input, which may be stored for the next layers.
+            return node.target in REMAT_FUNCTIONS and not node.kwargs.get("inplace", False) and \
+                (node.target is not F.dropout or not node.kwargs.get("training"))
+        return node.op == CALL_METHOD and node.target in REMAT_METHODS
+
+    def remat_search(self, nodes):
+        """Recompute a cheap row-wise value in the later layers using it, from an input which is stored for
+        those layers anyway, instead of storing the value too."""
+        for node in nodes:
+            if node.node_type != TENSOR_DATA or len(node.in_edges) != 1 or not self.is_cheap_row_wise(node):
+                continue
+            src = node.in_edges[0].src
+            if src.node_type != TENSOR_DATA or src.op == PLACEHOLDER or src in self.dead \
+                or any(src in remat_nodes for remat_nodes in self.remat.values()):
+                continue
+            users_degree = set(e.dst.message_degree for e in node.out_edges)
+            src_last = max(e.dst.message_degree for e in src.out_edges)
+            later = [d for d in users_degree if node.message_degree < d and src.message_degree < d <= src_last]
+            if len(later) == 0:
+                continue
+            row_bytes = self.node_bytes.get(node.name)
+            row_flops = self.node_flops.get(node.name)
+            if row_bytes is None or row_flops is None:
+                continue
+            # the value is stored from its layer until the last layer using it.
+            remaining = [d for d in users_degree if d not in later] + [node.message_degree]
+            saved = row_bytes * (max(users_degree) - max(remaining))
+            if row_flops * len(later) > self.remat_flops_per_byte * saved:
+                continue
+            for d in later:
+                self.remat.setdefault(d, []).append(node)
+            if max(remaining) == node.message_degree and \
+                all(e.dst.message_degree in later for e in node.out_edges):
+                self.dead.add(node)
+
+    def place_hoisted_nodes(self, nodes):
+        # a hoisted graph value is read in the layer of its user.
+        for node in reversed(nodes):
+            if getattr(node.node, "hoisted", False):
+                node.message_degree = min(e.dst.message_degree for e in node.out_edges)
+
     def generate_new_graphs(self, nodes):
         message_layers = [[] for _ in range(self.output.message_degree + 1)]
         layers_input = [set() for _ in range(self.output.message_degree + 1)]
         layers_output = [set() for _ in range(self.output.message_degree + 1)]
         for node in nodes:
-            message_layers[node.message_degree].append(node)
+            if node not in self.dead:
+                message_layers[node.message_degree].append(node)
             for e in node.out_edges:
                 if node.message_degree != e.dst.message_degree:
+                    if node in self.remat.get(e.dst.message_degree, ()):
+                        continue
                     layers_input[e.dst.message_degree].add(node)
                     if node.node_type != DGL_GRAPH:
                         layers_output[node.message_degree].add(node)
+        # a recomputed value reads its input in the layer using it.
+        for d, remat_nodes in self.remat.items():
+            for node in remat_nodes:
+                src = node.in_edges[0].src
+                layers_input[d].add(src)
+                layers_output[src.message_degree].add(src)
 
         for i, (inputs, nodes, outputs) in enumerate(zip(layers_input, message_layers, layers_output)):
             curr_graph = GraphReplicator()
             for input_node in inputs:
                 curr_graph.insert_input(input_node.name)
+            for node in self.remat.get(i, ()):
+                curr_graph.insert_node_copy(node.node)
             for node in nodes:
                 curr_graph.insert_node_copy(node.node)
             if i != self.output.message_degree:
@@ -125,4 +272,11 @@ class GraphRearranger():
 
         self.greedy_search(node_relation)
 
+        if self.node_bytes is not None:
+            self.min_cut_search(node_relation)
+        if self.node_bytes is not None and self.node_flops is not None:
+            self.remat_search(node_relation)
+
+        self.place_hoisted_nodes(node_relation)
+
         self.generate_new_graphs(node_relation)
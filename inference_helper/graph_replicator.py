@@ -13,11 +13,13 @@ class GraphReplicator(Graph):
     def insert_node_copy(self, node: Node):
         new_args = map_arg(node.args, self.arg_transform)
         new_node = self.create_node(node.op, node.target, new_args, node.kwargs, node.name)
+        new_node.node_type = getattr(node, "node_type", None)
         self.env[node.name] = new_node
         return new_node
 
     def insert_input(self, name):
         new_node = self.placeholder(name)
+        new_node.node_type = None
         self.env[name] = new_node
 
     def insert_inputs(self, names):
@@ -1,6 +1,173 @@
-from torch.fx import Graph
+import builtins
+import operator
+import re
 
-from .constants import OUTPUT, DGL_GRAPH, DGL_VOID_CALL
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.fx import Graph, GraphModule, Node
+from torch.fx.node import map_arg
+
+from .attention import GATConv, StreamingGATConv
+from .graph_replicator import GraphReplicator
+from .constants import OUTPUT, PLACEHOLDER, CALL_METHOD, CALL_FUNCTION, CALL_MODULE, GET_ATTR, DGL_GRAPH, \
+    DGL_VOID_CALL, DGL_GRAPH_DATA, DGL_GRAPH_ATTRIBUTE, DGL_TENSOR_DATA, DGL_FUNCTION, TENSOR_DATA, UTIL_DATA, \
+    FOLDED_PREFIX
+
+# graph functions giving one value per node: the nodes they are indexed by in a block.
+GRAPH_NODE_FUNCS = {"in_degrees": "dst", "out_degrees": "src"}
+# row-wise ops, which give the same rows on the full graph as on a block.
+ROW_WISE_METHODS = ("float", "double", "half", "to", "type", "clamp", "clamp_min", "clamp_max", "pow", "sqrt",
+                    "rsqrt", "reciprocal", "log", "exp", "abs", "neg",
+                    "__add__", "__sub__", "__mul__", "__truediv__", "__pow__", "__radd__", "__rmul__")
+ROW_WISE_FUNCTIONS = (operator.add, operator.sub, operator.mul, operator.truediv, operator.pow, operator.neg,
+                      torch.pow, torch.sqrt, torch.rsqrt, torch.clamp, torch.reciprocal, torch.log, torch.exp)
+# reshaping ops, row-wise only when they keep dim 0, see ``_keeps_rows``.
+RESHAPE_METHODS = ("unsqueeze", "view", "reshape")
+RESHAPE_FUNCTIONS = (torch.unsqueeze, torch.reshape)
+
+# ops whose result is not a function of their inputs.
+RANDOM_OPS = (torch.rand, torch.randn, torch.randint, torch.rand_like, torch.randn_like, torch.bernoulli,
+              torch.multinomial, torch.dropout, torch.nn.functional.dropout, "bernoulli", "dropout")
+
+DROPOUT_MODULES = (nn.Dropout, nn.Dropout1d, nn.Dropout2d, nn.Dropout3d, nn.AlphaDropout, nn.FeatureAlphaDropout)
+# activation -> its in-place form, as a function with ``inplace=True`` or a tensor method.
+INPLACE_ACTIVATIONS = {"relu": (F.relu, None), "elu": (F.elu, None), "leaky_relu": (F.leaky_relu, None),
+                       "sigmoid": (None, "sigmoid_"), "tanh": (None, "tanh_")}
+# ops whose result is a new tensor, never a view of an input.
+ALLOCATING_FUNCTIONS = (operator.add, operator.sub, operator.mul, operator.truediv, operator.matmul, torch.add,
+                        torch.sub, torch.mul, torch.div, torch.matmul, torch.mm, torch.cat, F.linear)
+ALLOCATING_METHODS = ("__add__", "__sub__", "__mul__", "__truediv__", "__radd__", "__rmul__", "add", "sub", "mul",
+                      "div", "matmul", "mm", "sum", "mean")
+
+
+def _is_pure(node: Node, root=None):
+    if node.op not in (CALL_FUNCTION, CALL_METHOD, CALL_MODULE):
+        return False
+    if node.target in RANDOM_OPS or node.kwargs.get("inplace", False):
+        return False
+    if node.op == CALL_METHOD and node.target.endswith("_"):
+        return False
+    if node.op == CALL_MODULE:
+        module = root.get_submodule(node.target) if root is not None else None
+        return module is not None and not module.training
+    return True
+
+
+def _keeps_rows(node: Node):
+    # the reshaping node keeps dim 0, so row i of its result only depends on row i of its input.
+    if node.target in ("unsqueeze", torch.unsqueeze):
+        dim = node.args[1] if len(node.args) > 1 else node.kwargs.get("dim")
+        # a negative dim depends on the rank, which is unknown here
+        return isinstance(dim, int) and dim >= 1
+    if node.op == CALL_METHOD:
+        shape = node.args[1:] if len(node.args) > 1 else node.kwargs.get("size", node.kwargs.get("shape"))
+    else:
+        shape = node.args[1] if len(node.args) > 1 else node.kwargs.get("shape")
+    if isinstance(shape, (tuple, list)) and len(shape) == 1 and isinstance(shape[0], (tuple, list)):
+        shape = shape[0]
+    if not isinstance(shape, (tuple, list)) or len(shape) == 0:
+        return False
+    # dim 0 is inferred from the other dims, which are constant
+    return shape[0] == -1 and all(isinstance(size, int) and size >= 0 for size in shape[1:])
+
+
+def _writes_input(node: Node):
+    return node.kwargs.get("inplace", False) or (node.op == CALL_METHOD and node.target.endswith("_"))
+
+
+def _cse_key(node: Node):
+    # get_attr nodes of the same attribute are equal, other nodes by identity.
+    def hashable(a):
+        if isinstance(a, Node):
+            return ("get_attr", a.target) if a.op == GET_ATTR else a
+        if isinstance(a, (tuple, list)):
+            return (type(a).__name__,) + tuple(hashable(v) for v in a)
+        if isinstance(a, dict):
+            return ("dict",) + tuple((k, hashable(v)) for k, v in sorted(a.items()))
+        if isinstance(a, slice):
+            return ("slice", hashable(a.start), hashable(a.stop), hashable(a.step))
+        try:
+            hash(a)
+            return a
+        except TypeError:
+            return ("id", id(a))
+    return node.op, node.target, hashable(node.args), hashable(node.kwargs)
+
+
+def _module_of(node: Node, root):
+    if node.op != CALL_MODULE:
+        return None
+    return root.get_submodule(node.target)
+
+
+def _activation(node: Node, root):
+    # (kind, args after the input, kwargs) of an elementwise activation node, or None.
+    module = _module_of(node, root)
+    if module is not None:
+        if len(node.args) != 1 or len(node.kwargs) != 0:
+            return None
+        if isinstance(module, nn.ReLU):
+            return "relu", (), {}
+        if isinstance(module, nn.ELU):
+            return "elu", (), {"alpha": module.alpha}
+        if isinstance(module, nn.LeakyReLU):
+            return "leaky_relu", (), {"negative_slope": module.negative_slope}
+        if isinstance(module, nn.Sigmoid):
+            return "sigmoid", (), {}
+        if isinstance(module, nn.Tanh):
+            return "tanh", (), {}
+        return None
+    if len(node.args) == 0 or node.kwargs.get("inplace", False):
+        return None
+    kwargs = {k: v for k, v in node.kwargs.items() if k != "inplace"}
+    if node.op == CALL_FUNCTION:
+        kind = {F.relu: "relu", torch.relu: "relu", F.elu: "elu", F.leaky_relu: "leaky_relu",
+                torch.sigmoid: "sigmoid", torch.tanh: "tanh"}.get(node.target)
+        if kind is None or (INPLACE_ACTIVATIONS[kind][0] is None and (len(node.args) != 1 or kwargs)):
+            return None
+        return kind, node.args[1:], kwargs
+    if node.op == CALL_METHOD and node.target in ("relu", "sigmoid", "tanh") \
+        and len(node.args) == 1 and len(node.kwargs) == 0:
+        return node.target, (), {}
+    return None
+
+
+def _allocates(node: Node, root):
+    # the value of the node is a new tensor, which no other node reads through a view.
+    if node.op == CALL_FUNCTION and node.target in ALLOCATING_FUNCTIONS:
+        return True
+    if node.op == CALL_METHOD and node.target in ALLOCATING_METHODS:
+        return True
+    module = _module_of(node, root)
+    if isinstance(module, nn.Linear):
+        return True
+    # graph convolutions return the result of a message passing.
+    return module is not None and type(module).__module__.startswith("dgl.nn") and \
+        any(getattr(arg, "node_type", None) == DGL_GRAPH for arg in node.all_input_nodes)
+
+
+def _register_folded(traced: GraphModule, name, val, user: Node):
+    traced.register_buffer(name, val.detach(), persistent=False)
+    with traced.graph.inserting_before(user):
+        new_node = traced.graph.get_attr(name)
+    new_node.node_type = UTIL_DATA
+    return new_node
+
+
+def _batch_norm_affine(bn):
+    # BatchNorm in eval mode as x * scale + shift
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        scale = scale * bn.weight
+        shift = shift * bn.weight + bn.bias
+    return scale, shift
+
+
+def _is_foldable_batch_norm(module):
+    return isinstance(module, nn.BatchNorm1d) and not module.training and module.track_running_stats \
+        and module.running_mean is not None
 
 
 class GraphRewriter():
@@ -10,7 +177,7 @@ class GraphRewriter():
         for node in graph.nodes:
             if node.node_type == DGL_GRAPH and blocks is None:
                 blocks = node
-            elif node.node_type == DGL_GRAPH:
+            elif node.node_type == DGL_GRAPH and not hasattr(node, "relation"):
                 node.replace_all_uses_with(blocks)
                 graph.erase_node(node)
         graph.lint()
@@ -22,3 +189,380 @@ class GraphRewriter():
                 if len(node.users) == 0:
                     graph.erase_node(node)
         graph.lint()
+
+    @staticmethod
+    def eliminate_common_subexpressions(graph: Graph, node_types=(TENSOR_DATA,), root=None):
+        """Replace every pure node of ``node_types`` computing the same as an earlier node by the earlier
+        one; return the number of nodes eliminated."""
+        seen = {}
+        eliminated = 0
+        for node in list(graph.nodes):
+            if getattr(node, "node_type", None) not in node_types:
+                continue
+            if node.op == GET_ATTR:
+                key = (GET_ATTR, node.target)
+            elif _is_pure(node, root):
+                key = _cse_key(node)
+            else:
+                continue
+            if key in seen:
+                # a tensor written in place by one of its users can't be shared
+                if any(_writes_input(user) for user in list(node.users) + list(seen[key].users)):
+                    continue
+                node.replace_all_uses_with(seen[key])
+                graph.erase_node(node)
+                eliminated += 1
+            else:
+                seen[key] = node
+        graph.lint()
+        return eliminated
+
+    @staticmethod
+    def _written_graph_keys(graph: Graph):
+        # the keys the forward stores into the frames of a graph
+        written = set()
+        for node in graph.nodes:
+            if node.op == CALL_FUNCTION and node.target is operator.setitem and len(node.args) > 1 \
+                and getattr(node.args[0], "node_type", None) == DGL_GRAPH_ATTRIBUTE:
+                written.add(node.args[1])
+            elif node.node_type == DGL_VOID_CALL and node.target == "update" and len(node.args) > 1 \
+                and isinstance(node.args[1], dict):
+                written.update(node.args[1].keys())
+            elif node.node_type == DGL_FUNCTION and "out_field" in node.kwargs:
+                written.add(node.kwargs["out_field"])
+        return written
+
+    @staticmethod
+    def edge_data_to_inputs(graph: Graph):
+        """Read the edge features stored in the inference graph from new placeholders.
+
+        ``g.edata[key]`` of the input graph, with a key the forward never writes, becomes a placeholder
+        named ``edata_<key>``, which is gathered for every batch by the ``dgl.EID`` of its block. Return a
+        map from each new placeholder name to the key.
+        """
+        blocks = next((node for node in graph.nodes if node.node_type == DGL_GRAPH), None)
+        if blocks is None:
+            return {}
+        written = GraphRewriter._written_graph_keys(graph)
+        first_node = next(node for node in graph.nodes if node.op != PLACEHOLDER)
+        placeholders = {}
+        edge_inputs = {}
+        for node in list(graph.nodes):
+            if node.node_type != DGL_TENSOR_DATA or node.target is not operator.getitem \
+                or not isinstance(node.args[1], str) or node.args[1] in written:
+                continue
+            attr = node.args[0]
+            if attr.target is not builtins.getattr or attr.args[0] is not blocks or attr.args[1] != "edata":
+                continue
+            key = node.args[1]
+            if key not in placeholders:
+                with graph.inserting_before(first_node):
+                    placeholders[key] = graph.placeholder(re.sub(r"\W", "_", "edata_{}".format(key)))
+                placeholders[key].node_type = TENSOR_DATA
+                placeholders[key].edge_data = key
+                edge_inputs[placeholders[key].name] = key
+            node.replace_all_uses_with(placeholders[key])
+            graph.erase_node(node)
+        GraphRewriter.remove_unused_nodes(graph)
+        return edge_inputs
+
+    @staticmethod
+    def graph_data_to_inputs(graph: Graph):
+        """Read the node features stored in the inference graph from new placeholders.
+
+        ``g.ndata[key]``, ``g.srcdata[key]`` and ``g.nodes[ntype].data[key]`` of the input graph, with a key
+        the forward never writes, become a placeholder each, which is filled from the graph before the
+        inference and batched like any other input. Return a map from each new placeholder name to
+        (ntype, key), ntype is None for a homogeneous graph.
+        """
+        blocks = next((node for node in graph.nodes if node.node_type == DGL_GRAPH), None)
+        if blocks is None:
+            return {}
+        written = GraphRewriter._written_graph_keys(graph)
+
+        def read_of_input(node):
+            # (ntype, key) of a read of the input graph's node data, or None
+            if node.node_type != DGL_TENSOR_DATA or node.target is not operator.getitem \
+                or not isinstance(node.args[1], str) or node.args[1] in written:
+                return None
+            attr = node.args[0]
+            if attr.target is not builtins.getattr:
+                return None
+            if attr.args[0] is blocks and attr.args[1] in ("ndata", "srcdata"):
+                return None, node.args[1]
+            view = attr.args[0]
+            if attr.args[1] == "data" and isinstance(view, Node) and view.target is operator.getitem:
+                nodes = view.args[0]
+                if isinstance(nodes, Node) and nodes.target is builtins.getattr and nodes.args[0] is blocks \
+                    and nodes.args[1] in ("nodes", "srcnodes"):
+                    return view.args[1], node.args[1]
+            return None
+
+        first_node = next(node for node in graph.nodes if node.op != PLACEHOLDER)
+        placeholders = {}
+        graph_inputs = {}
+        for node in list(graph.nodes):
+            read = read_of_input(node)
+            if read is None:
+                continue
+            if read not in placeholders:
+                name = re.sub(r"\W", "_", "ndata_{}_{}".format(*read) if read[0] is not None
+                              else "ndata_{}".format(read[1]))
+                with graph.inserting_before(first_node):
+                    placeholders[read] = graph.placeholder(name)
+                placeholders[read].node_type = TENSOR_DATA
+                placeholders[read].graph_data = read
+                graph_inputs[placeholders[read].name] = read
+            node.replace_all_uses_with(placeholders[read])
+            graph.erase_node(node)
+        GraphRewriter.remove_unused_nodes(graph)
+        return graph_inputs
+
+    @staticmethod
+    def simplify_for_inference(traced: GraphModule):
+        """Eval-mode simplification of the traced forward.
+
+        Drop dropout and fold BatchNorm1d into an adjacent Linear and the affine parameters of a LayerNorm into
+        the Linear after it, the activations are run in place by ``fuse_activations``. Modules in training
+        mode are kept. Return the number of nodes rewritten by each of them.
+        """
+        graph = traced.graph
+        counts = {"dropout": 0, "norms": 0, "activations": 0}
+        with torch.no_grad():
+            for node in list(graph.nodes):
+                module = _module_of(node, traced)
+                if isinstance(module, DROPOUT_MODULES) and not module.training and len(node.args) == 1:
+                    dropped = True
+                elif node.op == CALL_FUNCTION and node.target in (F.dropout, torch.dropout) and len(node.args) > 0:
+                    training = node.kwargs.get("training", node.kwargs.get("train",
+                        node.args[2] if len(node.args) > 2 else True))
+                    dropped = training is False
+                else:
+                    dropped = False
+                if dropped:
+                    node.replace_all_uses_with(node.args[0])
+                    graph.erase_node(node)
+                    counts["dropout"] += 1
+
+            for node in list(graph.nodes):
+                if getattr(node, "_erased", False):
+                    continue
+                norm = _module_of(node, traced)
+                if len(node.args) != 1 or len(node.kwargs) != 0 or not isinstance(node.args[0], Node):
+                    continue
+                prev = node.args[0]
+                prev_module = _module_of(prev, traced)
+                users = list(node.users)
+                next_module = _module_of(users[0], traced) if len(users) == 1 else None
+                # Linear -> BatchNorm1d: scale the rows of the weight
+                if _is_foldable_batch_norm(norm) and isinstance(prev_module, nn.Linear) and len(prev.users) == 1 \
+                    and len(prev.args) == 1 and len(prev.kwargs) == 0:
+                    scale, shift = _batch_norm_affine(norm)
+                    weight = prev_module.weight * scale[:, None]
+                    bias = shift if prev_module.bias is None else prev_module.bias * scale + shift
+                    linear_input, old_nodes = prev.args[0], (node, prev)
+                # BatchNorm1d / LayerNorm -> Linear: scale the columns of the weight
+                elif isinstance(next_module, nn.Linear) and len(users[0].args) == 1 and len(users[0].kwargs) == 0 \
+                    and (_is_foldable_batch_norm(norm) or (isinstance(norm, nn.LayerNorm)
+                         and norm.elementwise_affine and len(norm.normalized_shape) == 1)):
+                    if isinstance(norm, nn.LayerNorm):
+                        scale = norm.weight
+                        shift = torch.zeros_like(scale) if norm.bias is None else norm.bias
+                    else:
+                        scale, shift = _batch_norm_affine(norm)
+                    weight = next_module.weight * scale[None, :]
+                    bias = next_module.weight @ shift
+                    bias = bias if next_module.bias is None else bias + next_module.bias
+                    linear_input, old_nodes = prev, (users[0], node)
+                    if isinstance(norm, nn.LayerNorm):
+                        with graph.inserting_before(node):
+                            linear_input = graph.call_function(F.layer_norm, (prev, norm.normalized_shape),
+                                                               {"eps": norm.eps})
+                        linear_input.node_type = node.node_type
+                else:
+                    continue
+                user = old_nodes[0]
+                weight = _register_folded(traced, FOLDED_PREFIX + user.name + "_weight", weight, user)
+                bias = _register_folded(traced, FOLDED_PREFIX + user.name + "_bias", bias, user)
+                with graph.inserting_before(user):
+                    linear = graph.call_function(F.linear, (linear_input, weight, bias))
+                linear.node_type = user.node_type
+                user.replace_all_uses_with(linear)
+                for old_node in old_nodes:
+                    graph.erase_node(old_node)
+                counts["norms"] += 1
+        graph.lint()
+        return counts
+
+    @staticmethod
+    def fuse_activations(traced: GraphModule):
+        """Run the elementwise activations in place on the new tensor they read, if it has no other user.
+
+        Runs after the common subexpression elimination, which may give a tensor more users. Return the
+        number of activations rewritten.
+        """
+        graph = traced.graph
+        count = 0
+        fresh = set(node for node in graph.nodes if _allocates(node, traced))
+        for node in list(graph.nodes):
+            activation = _activation(node, traced)
+            if activation is None or not isinstance(node.args[0], Node):
+                continue
+            kind, extra_args, kwargs = activation
+            src = node.args[0]
+            src_activation = getattr(src, "activation", None) or (_activation(src, traced) or (None,))[0]
+            # relu is idempotent
+            if kind == "relu" and src_activation == "relu":
+                node.replace_all_uses_with(src)
+                graph.erase_node(node)
+                count += 1
+                continue
+            if src not in fresh or len(src.users) != 1:
+                continue
+            function, method = INPLACE_ACTIVATIONS[kind]
+            with graph.inserting_before(node):
+                if function is not None:
+                    new_node = graph.call_function(function, (src,) + tuple(extra_args), dict(kwargs, inplace=True))
+                else:
+                    new_node = graph.call_method(method, (src,))
+            new_node.node_type = node.node_type
+            new_node.activation = kind
+            node.replace_all_uses_with(new_node)
+            graph.erase_node(node)
+            fresh.add(new_node)
+            count += 1
+        graph.lint()
+        return count
+
+    @staticmethod
+    def stream_attention(traced: GraphModule):
+        """Run every GATConv of the forward by a ``StreamingGATConv``, registered on ``traced`` as a new submodule.
+
+        The conv modules are leaves of the trace, so the edge softmax and the aggregation inside them are
+        replaced together. Return a map from each new submodule name to the module.
+        """
+        streaming = {}
+        for node in traced.graph.nodes:
+            module = _module_of(node, traced)
+            if not isinstance(module, GATConv):
+                continue
+            name = "_streaming_" + re.sub(r"\W", "_", node.target)
+            if name not in streaming:
+                streaming[name] = StreamingGATConv(module)
+                traced.add_submodule(name, streaming[name])
+            node.target = name
+        return streaming
+
+    @staticmethod
+    def fold_constants(traced: GraphModule):
+        """Evaluate the computations on parameters and constants only (e.g. weight reshapes) once.
+
+        A tensor result is registered as a buffer of ``traced`` and read by a get_attr node, a scalar or
+        shape is inlined into its users; the results are not updated when the parameters change later.
+        Return the number of nodes eliminated.
+        """
+        graph = traced.graph
+        vals = {}
+        for node in graph.nodes:
+            if node.op == GET_ATTR:
+                val = traced
+                for atom in node.target.split("."):
+                    val = getattr(val, atom)
+                vals[node] = val
+            elif node.op in (CALL_FUNCTION, CALL_METHOD) and node.node_type in (TENSOR_DATA, UTIL_DATA) \
+                and _is_pure(node) and len(node.all_input_nodes) > 0 \
+                and all(arg in vals for arg in node.all_input_nodes):
+                args = map_arg(node.args, lambda n: vals[n])
+                kwargs = map_arg(node.kwargs, lambda n: vals[n])
+                with torch.no_grad():
+                    if node.op == CALL_FUNCTION:
+                        vals[node] = node.target(*args, **kwargs)
+                    else:
+                        vals[node] = getattr(args[0], node.target)(*args[1:], **kwargs)
+
+        count = len(graph.nodes)
+        for node in list(graph.nodes):
+            if node.op == GET_ATTR or node not in vals or all(user in vals for user in node.users):
+                continue
+            val = vals[node]
+            for i, user in enumerate([user for user in node.users if user not in vals]):
+                if isinstance(val, torch.Tensor):
+                    name = FOLDED_PREFIX + node.name
+                    if not hasattr(traced, name):
+                        traced.register_buffer(name, val.detach(), persistent=False)
+                    with graph.inserting_before(user):
+                        new_node = graph.get_attr(name)
+                    new_node.node_type = UTIL_DATA
+                    user.replace_input_with(node, new_node)
+                elif isinstance(val, (int, float, bool)) or \
+                    (isinstance(val, tuple) and all(isinstance(v, (int, float, bool)) for v in val)):
+                    user.args = map_arg(user.args, lambda n: val if n is node else n)
+                    user.kwargs = map_arg(user.kwargs, lambda n: val if n is node else n)
+        GraphRewriter.remove_unused_nodes(graph)
+        return count - len(graph.nodes)
+
+    @staticmethod
+    def hoist_graph_data(graph: Graph):
+        """Move the per-node computations depending only on the graph structure out of the batches.
+
+        They are copied into a separate graph which runs once on the full graph, and each of their uses
+        reads a new placeholder instead, gathered by the src nodes of a batch like a feature.
+
+        Returns the graph to run on the full graph (or None) and a map from each new placeholder name to
+        the index of its value in the outputs of that graph.
+        """
+        blocks = None
+        hoisted = {}
+        for node in graph.nodes:
+            if node.node_type == DGL_GRAPH and blocks is None:
+                blocks = node
+            if node.op == CALL_METHOD and node.target in GRAPH_NODE_FUNCS and len(node.args) == 1 \
+                and node.args[0] is blocks and len(node.kwargs) == 0:
+                hoisted[node] = GRAPH_NODE_FUNCS[node.target]
+                continue
+            if node.op == CALL_METHOD and node.target in RESHAPE_METHODS \
+                or node.op == CALL_FUNCTION and node.target in RESHAPE_FUNCTIONS:
+                if not _keeps_rows(node):
+                    continue
+            elif not (node.op == CALL_METHOD and node.target in ROW_WISE_METHODS) \
+                and not (node.op == CALL_FUNCTION and node.target in ROW_WISE_FUNCTIONS):
+                continue
+            inputs = node.all_input_nodes
+            kinds = set(hoisted[arg] for arg in inputs if arg in hoisted)
+            if len(kinds) == 1 and all(arg in hoisted or arg.op == GET_ATTR for arg in inputs):
+                hoisted[node] = kinds.pop()
+        frontier = [node for node in hoisted if any(user not in hoisted for user in node.users)]
+        if len(frontier) == 0:
+            return None, {}
+
+        hoisted_graph = GraphReplicator()
+        hoisted_graph.insert_input(blocks.name)
+        for node in graph.nodes:
+            if node.op == GET_ATTR and any(user in hoisted for user in node.users):
+                hoisted_graph.insert_node_copy(node)
+            elif node in hoisted:
+                hoisted_graph.insert_node_copy(node)
+        hoisted_graph.insert_output(frontier)
+        hoisted_graph.lint()
+
+        first_node = next(node for node in graph.nodes if node.op != PLACEHOLDER)
+        hoisted_inputs = {}
+        for i, node in enumerate(frontier):
+            for j, user in enumerate([user for user in node.users if user not in hoisted]):
+                with graph.inserting_before(first_node):
+                    new_node = graph.placeholder("hoisted_{}_{}".format(node.name, j))
+                new_node.node_type = TENSOR_DATA
+                new_node.hoisted = True
+                hoisted_inputs[new_node.name] = i
+                if hoisted[node] == "dst":
+                    # the dst nodes are the prefix of the src nodes of a block
+                    with graph.inserting_before(user):
+                        num_dst = graph.call_method("number_of_dst_nodes", (blocks,))
+                        num_dst.node_type = DGL_GRAPH_DATA
+                        num_dst.hoisted = True
+                        new_node = graph.call_function(operator.getitem, (new_node, slice(None, num_dst, None)))
+                        new_node.node_type = TENSOR_DATA
+                        new_node.hoisted = True
+                user.replace_input_with(node, new_node)
+        GraphRewriter.remove_unused_nodes(graph)
+        return hoisted_graph, hoisted_inputs
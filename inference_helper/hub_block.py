@@ -0,0 +1,66 @@
+import dgl
+import torch
+from dgl.heterograph import DGLBlock
+
+# reducers whose results over slices of the in-edges merge exactly
+PARTIAL_REDUCERS = ("sum", "mean", "max")
+
+
+def slice_block(block, start, end):
+    """The edges [start, end) of a block over all of its nodes, sharing its node features."""
+    u, v = block.edges()
+    sub_block = dgl.create_block((u[start:end], v[start:end]), num_src_nodes=block.num_src_nodes(),
+                                 num_dst_nodes=block.num_dst_nodes(), idtype=block.idtype, device=block.device)
+    sub_block.srcdata.update(block.srcdata)
+    sub_block.dstdata.update(block.dstdata)
+    sub_block.edata.update({key: val[start:end] for key, val in block.edata.items()})
+    return sub_block
+
+
+def merge_partial(reducer, merged, partial, degrees):
+    # fold the result of a slice of the in-edges into the results of the slices before it
+    degrees = degrees.view((-1,) + (1,) * (partial.dim() - 1))
+    if reducer == "sum":
+        return partial if merged is None else merged + partial
+    if reducer == "mean":
+        partial = partial * degrees
+        return partial if merged is None else merged + partial
+    if merged is None:
+        merged = torch.full_like(partial, float("-inf"))
+    return torch.where(degrees > 0, torch.maximum(merged, partial), merged)
+
+
+class HubBlock(DGLBlock):
+    """A block whose ``update_all`` runs over slices of at most ``chunk_edges`` in-edges at a time.
+
+    The partial results of sum, mean and max reducers are merged exactly, so the messages of a hub dst node
+    never exist for all of its in-edges at once. Other reducers, and an ``apply_node_func``, take the
+    normal path.
+    """
+    @staticmethod
+    def wrap(block, chunk_edges):
+        hub_block = HubBlock(block._graph, (block.srctypes, block.dsttypes), block.etypes,
+                             block._node_frames, block._edge_frames)
+        hub_block.chunk_edges = max(int(chunk_edges), 1)
+        return hub_block
+
+    def update_all(self, message_func, reduce_func, apply_node_func=None, etype=None):
+        reducer = getattr(reduce_func, "name", None)
+        num_edges = self.num_edges()
+        if reducer not in PARTIAL_REDUCERS or apply_node_func is not None or not self.is_homogeneous \
+            or num_edges <= self.chunk_edges:
+            return super().update_all(message_func, reduce_func, apply_node_func, etype)
+        out_field = reduce_func.out_field
+        merged = None
+        for start in range(0, num_edges, self.chunk_edges):
+            sub_block = slice_block(self, start, min(start + self.chunk_edges, num_edges))
+            DGLBlock.update_all(sub_block, message_func, reduce_func)
+            merged = merge_partial(reducer, merged, sub_block.dstdata[out_field], sub_block.in_degrees())
+            del sub_block
+        degrees = self.in_degrees().view((-1,) + (1,) * (merged.dim() - 1))
+        if reducer == "mean":
+            merged = merged / degrees.clamp(min=1).to(merged.dtype)
+        elif reducer == "max":
+            # as DGL, a dst node without in-edges gets zeros
+            merged = torch.where(degrees > 0, merged, torch.zeros_like(merged))
+        self.dstdata[out_field] = merged
@@ -4,56 +4,427 @@ import torch
 import torch.nn as nn
 import tqdm
 import gc
+import os
 import time
 
+from torch.fx import GraphModule
+
 from .profiler import Profiler
-from .auto_tuner import get_auto_tuner
+from .dglfx import CostEvaluater, make_probe_block, make_probe_graph, get_device_rates, is_hetero_meta
+from .dglfx.cost_evaluater import PROBE_SRC, SRC, get_row_kinds, row_ntype
+from .constants import PLACEHOLDER
+from .auto_tuner import get_auto_tuner, ThroughputTuner
 from .function_generator import FunctionGenerator
-from .data_manager import DataManager
-from .custom_dataloader import CustomDataloader
-from .utils import get_new_arg_input, update_ret_output
+from .data_manager import DataManager, StagingBuffers, save_mmap_tensor
+from .custom_dataloader import CustomDataloader, HeteroDataloader, get_hetero_in_degrees, get_degree_order
+from .compiler import CompiledConvBlock, enable_compile_cache
+from .hub_block import HubBlock
+from .bucketed_block import BucketedBlock
+from .wavefront import ResidencyWindow, get_band_windows
+from .distributed import HaloExchange, partition_ranges
+from .tuning_cache import TuningCache, get_device_profile, get_graph_stats
+from .utils import get_new_arg_input, update_ret_output, is_oom_error, split_block, get_edge_balanced_split, \
+    get_bucket_floor, get_tensors_bytes, is_mmap_tensor, get_chain_edges, get_in_frontier
 
 class InferenceHelperBase():
-    def __init__(self, module: nn.Module, device, use_uva = False, debug = False):
+    def __init__(self, module: nn.Module, device, use_uva = False, debug = False, profile = False, graph_meta = None):
         # add a '_' in order not crash with the origin one.
         self._device = device
         self._use_uva = use_uva
-        self._function_generator = FunctionGenerator(module, debug)
+        self._module = module
+        # node and edge types of the inference graph (see get_graph_meta), None for a homogeneous graph
+        self._graph_meta = graph_meta
+        self._probe_meta = graph_meta if is_hetero_meta(graph_meta) else None
+        self._function_generator = FunctionGenerator(module, debug, graph_meta=graph_meta)
         self._traced = self._function_generator.traced
         self._schema = self._function_generator.get_schema()
         self._funcs = self._function_generator.get_funcs()
         self._data_manager = DataManager(device, use_uva)
         self._debug = debug
+        self.profiler = Profiler(device, enabled=profile)
+        # set by the user, or propagated from the inputs of every inference
+        self.ret_shapes = None
+        self._layer_modules = None
+        self._boundaries_planned = False
+        # run the conv_block functions by torch.compile, with the batches padded to buckets
+        self.compile_layers = False
+        self._compiled = {}
+        self.compile_stats = {}
+        # buffers the batches are gathered into, None to allocate them for every batch
+        self._staging = None
+        # placeholder name -> node features read from the inference graph
+        self._graph_data = {}
+        # the layer whose outputs the batches of the running layer write back
+        self._ret_layer = None
+        # names of the edge-indexed inputs: edge features read from the graph, and the tensor arguments with
+        # a row per edge
+        self._edge_input_names = set()
+        # names of the forward arguments with a row per edge; None to tell them by their number of rows, which
+        # is ambiguous when the graph has as many nodes as edges
+        self.edge_args = None
+        # a directory the edge features are written to, to be read from file-backed tensors
+        self.edge_mmap_dir = None
+        # run up to this many consecutive layers in one pass over a k-hop block chain, for the batches whose
+        # chain has at most expansion_threshold times the edges of running the layers one by one
+        self.fuse_layers = 1
+        self.expansion_threshold = 1.5
+        self.fuse_batch_size = 1024
+        self.fusion_stats = {}
+        # the order the batches take the dst nodes in, see get_degree_order; the outputs are written back by
+        # the node IDs of the batches, so they keep the order of the graph
+        self.batch_order = None
+        # aggregate the low-degree dst nodes of every batch as dense padded tensors, see BucketedBlock
+        self.bucketed_aggregation = False
+        # GAT layers with more edges in a batch run their attention over slices of this many edges; None to
+        # stream in the batches of hub nodes only
+        self.attention_chunk_edges = None
+
+    @property
+    def is_hetero(self):
+        return self._probe_meta is not None
+
+    def _read_graph_data(self, graph, args=()):
+        for name, (ntype, key) in self._function_generator.graph_inputs.items():
+            data = graph.ndata if ntype is None else graph.nodes[ntype].data
+            if key not in data:
+                raise Exception("The forward reads node feature '{}' which is not in the graph.".format(key))
+            self._graph_data[name] = data[key]
+        edge_inputs = self._function_generator.edge_inputs
+        if len(edge_inputs) > 0 and not graph.is_homogeneous:
+            raise Exception("Edge features of a heterograph are not supported.")
+        for name, key in edge_inputs.items():
+            if key not in graph.edata:
+                raise Exception("The forward reads edge feature '{}' which is not in the graph.".format(key))
+            self._graph_data[name] = graph.edata[key]
+        self._edge_input_names = set(edge_inputs.keys())
+        if self.edge_args is not None:
+            self._edge_input_names.update(self.edge_args)
+            return
+        if not graph.is_homogeneous:
+            return
+        for val, arg_name in zip(args, self._schema.first_layer_input[1:]):
+            if isinstance(val, torch.Tensor) and val.dim() > 0 and val.shape[0] == graph.number_of_edges():
+                if graph.number_of_edges() == graph.number_of_nodes():
+                    raise Exception("The graph has as many nodes as edges, can't tell if argument '{}' is a node "
+                                    "or an edge feature; set edge_args.".format(arg_name))
+                self._edge_input_names.add(arg_name)
+
+    def _num_ret_rows(self, graph, ntype=None):
+        # the rows of an output tensor of the nodes of a type
+        return graph.num_nodes(ntype)
+
+    def _node_ids(self, graph):
+        if not self.is_hetero:
+            return torch.arange(graph.number_of_nodes()).to(graph.device)
+        return {ntype: torch.arange(graph.num_nodes(ntype)).to(graph.device) for ntype in graph.ntypes}
+
+    def _batch_node_ids(self, graph):
+        # the dst nodes of a layer, in the order of the batches
+        nids = self._node_ids(graph)
+        if self.batch_order is None or self.is_hetero:
+            return nids
+        return nids[get_degree_order(graph.in_degrees(nids), self.batch_order).to(nids.device)]
+
+    def _probe_inputs(self, graph, args):
+        # the first layer inputs and hoisted values on PROBE_SRC nodes (of every type), by name.
+        index = torch.arange(PROBE_SRC)
+        name2val = {}
+        for val, arg_name in zip((graph,) + tuple(args), self._schema.first_layer_input):
+            if isinstance(val, torch.Tensor) and arg_name in self._edge_input_names:
+                val = val[torch.arange(graph.num_edges()).to(val.device) % val.shape[0]].to(self._device)
+            elif isinstance(val, torch.Tensor):
+                val = val[index.to(val.device) % val.shape[0]].to(self._device)
+            elif isinstance(val, dict) and self.is_hetero:
+                val = {ntype: v[torch.arange(graph.num_src_nodes(ntype)).to(v.device) % v.shape[0]].to(self._device)
+                       for ntype, v in val.items()}
+            name2val[arg_name] = val
+        for name, (ntype, _) in self._function_generator.graph_inputs.items():
+            val = self._graph_data[name]
+            num_rows = graph.num_src_nodes(ntype) if graph.is_block else graph.num_nodes(ntype)
+            name2val[name] = val[torch.arange(num_rows).to(val.device) % val.shape[0]].to(self._device)
+        for name in self._function_generator.edge_inputs:
+            val = self._graph_data[name]
+            name2val[name] = val[torch.arange(graph.num_edges()).to(val.device) % val.shape[0]].to(self._device)
+        if self._function_generator.hoisted is not None:
+            name2val.update(self._hoisted_values(make_probe_graph(self._device, self._probe_meta)))
+        return name2val
+
+    def _check_simplified(self, args):
+        """Compare the simplified forward with the unsimplified one on the probe graph.
 
-    def _trace_output_shape(self, args):
-        first_layer_inputs = (dgl.graph(([0], [0]), device=self._device),)
-        for arg in tuple(args):
-            first_layer_inputs += (arg[[0]].to(self._device),)
+        Without folded norm layers the outputs must be bit-for-bit equal; a folded norm changes the rounding
+        only. On a mismatch, the functions are generated again without the simplification.
+        """
+        function_generator = self._function_generator
+        if function_generator.unsimplified is None:
+            return True
+        outputs = []
+        for gm in (function_generator.unsimplified, self._traced):
+            name2val = self._probe_inputs(make_probe_graph(self._device, self._probe_meta), args)
+            with torch.no_grad():
+                output_vals = gm(*[name2val[node.name] for node in gm.graph.nodes if node.op == PLACEHOLDER])
+            outputs.append(output_vals if isinstance(output_vals, tuple) else (output_vals,))
+        for expected, actual in zip(*outputs):
+            if not isinstance(expected, torch.Tensor):
+                continue
+            if expected.shape == actual.shape and (torch.equal(expected, actual) or (
+                function_generator.simplified["norms"] > 0 and torch.allclose(expected, actual, rtol=1e-4, atol=1e-5))):
+                continue
+            if self._debug:
+                print("The simplified forward doesn't match the original one, generate it again without simplification.")
+            self._function_generator = FunctionGenerator(self._module, self._debug, simplify=False,
+                                                         graph_meta=self._graph_meta)
+            self._traced = self._function_generator.traced
+            self._schema = self._function_generator.get_schema()
+            self._funcs = self._function_generator.get_funcs()
+            self._layer_modules = None
+            return False
+        return True
+
+    def _plan_boundaries(self, args):
+        # propagate the shapes of these inputs through the whole forward, and split it into the layers
+        # which store the fewest bytes.
+        self._boundaries_planned = True
+        self._check_simplified(args)
+        name2val = self._probe_inputs(make_probe_graph(self._device, self._probe_meta), args)
+        evaluater = CostEvaluater(self._traced, graph_meta=self._probe_meta)
+        evaluater.eval(*[name2val[node.name] for node in self._traced.graph.nodes if node.op == PLACEHOLDER])
+        node_bytes = {name: row_bytes for name, (kind, row_bytes) in evaluater.node_rows.items() if kind == SRC}
+        if self._function_generator.split(node_bytes, evaluater.node_flops):
+            self._funcs = self._function_generator.get_funcs()
+            self._layer_modules = None
+
+    def analyze(self, args, graph=None):
+        """Propagate shapes through every layer on a probe block; return the ``LayerCost`` of each layer.
+
+        The node features the forward reads from the graph are taken from ``graph``, or the last inference graph.
+        """
+        if graph is not None:
+            self._read_graph_data(graph, args)
+        if not self._boundaries_planned:
+            self._plan_boundaries(args)
+        probe_block = make_probe_block(self._device, self._probe_meta)
+        kinds = get_row_kinds(self._probe_meta)
         arg2val_map = {}
-        for val, arg_name in zip(first_layer_inputs, self._schema.first_layer_input):
-            arg_node = self._schema.name2arg_map[arg_name]
-            arg2val_map[arg_node] = val
-        ret_shapes = [[] for _ in range(self._schema.layers_count)]
-        for layer, func in zip(self._schema.layers, self._funcs):
-            new_args = ()
-            for arg_node in layer.inputs:
-                new_args += (arg2val_map[arg_node],)
-            output_vals = func(*new_args)
+        for name, val in self._probe_inputs(probe_block, args).items():
+            if name in self._schema.name2arg_map:
+                arg2val_map[self._schema.name2arg_map[name]] = val
+
+        if self._layer_modules is None:
+            self._layer_modules = [GraphModule(self._function_generator, graph)
+                                   for graph in self._function_generator.get_graphs()]
+        costs = []
+        for layer, layer_module in zip(self._schema.layers, self._layer_modules):
+            evaluater = CostEvaluater(layer_module, layer.id, self._probe_meta)
+            new_args = tuple(arg2val_map[arg_node] for arg_node in layer.inputs)
+            output_vals, cost = evaluater.eval(*new_args)
             if not isinstance(output_vals, tuple):
                 output_vals = (output_vals,)
             if len(output_vals) != len(layer.outputs):
                 raise Exception("output values not match with layer's output.")
+            # the next layer gathers the outputs by its src nodes.
             for val, arg_node in zip(output_vals, layer.outputs):
                 if isinstance(val, torch.Tensor):
-                    arg2val_map[arg_node] = val
-                    ret_shapes[layer.id].append((torch.Tensor, val.size()[1:]))
+                    val = torch.zeros((probe_block.num_src_nodes(row_ntype(val, kinds)),) + tuple(val.shape[1:]),
+                                      dtype=val.dtype, device=val.device)
+                elif isinstance(val, dict) and self.is_hetero:
+                    val = {ntype: torch.zeros((probe_block.num_src_nodes(ntype),) + tuple(v.shape[1:]),
+                                              dtype=v.dtype, device=v.device) for ntype, v in val.items()}
+                arg2val_map[arg_node] = val
+            costs.append(cost)
+        return costs
+
+    def _hoisted_values(self, graph):
+        # graph-only computations of every layer, computed once on the full graph.
+        vals = self._function_generator.hoisted(graph)
+        if not isinstance(vals, tuple):
+            vals = (vals,)
+        ret = {}
+        for name, i in self._function_generator.hoisted_inputs.items():
+            ret[name] = vals[i]
+        return ret
+
+    def _trace_output_shape(self, args, graph=None):
+        return [cost.output_shapes for cost in self.analyze(args, graph)]
+
+    def plan(self, graph, *args, free_memory=None, free_rate=0.9):
+        """Predicted per-layer budget, peak memory and time of an inference of ``graph``, before running it."""
+        return self._plan_layers(graph, self.analyze(args, graph), free_memory, free_rate)
+
+    def _plan_layers(self, graph, costs, free_memory=None, free_rate=0.9):
+        if free_memory is None:
+            auto_tuner = get_auto_tuner(self._device)
+            auto_tuner.set_free(free_rate)
+            free_memory = auto_tuner.free_memory
+        rates = get_device_rates(self._device)
+        return [cost.plan(graph.number_of_nodes(), graph.number_of_edges(), free_memory, rates)
+                for cost in costs]
+
+    def _spill_edge_input(self, name, val):
+        # keep an edge feature table in a file under edge_mmap_dir, its rows are read for every batch
+        if self.edge_mmap_dir is None or val.device.type != 'cpu' or is_mmap_tensor(val):
+            return val
+        os.makedirs(self.edge_mmap_dir, exist_ok=True)
+        return save_mmap_tensor(val, os.path.join(self.edge_mmap_dir, "{}.bin".format(name)))
+
+    def _fused_groups(self, max_layers=None):
+        # first layer id -> runs of up to fuse_layers layers, where every layer but the last feeds only the next
+        max_layers = self.fuse_layers if max_layers is None else max_layers
+        if max_layers <= 1 or self.is_hetero:
+            return {}
+        groups = {}
+        layers = self._schema.layers
+        i = 0
+        while i < len(layers):
+            group = [layers[i]]
+            while len(group) < max_layers and group[-1].next_layer is not None and \
+                all(arg_node.input_layers == [group[-1].next_layer] and
+                    arg_node.name not in self._schema.last_layer_output for arg_node in group[-1].outputs):
+                group.append(group[-1].next_layer)
+            if len(group) > 1:
+                groups[layers[i].id] = group
+            i += len(group)
+        return groups
+
+    def run_fused_batch(self, group, funcs, rets, input_nodes, output_nodes, blocks):
+        """Run the layers of a group on the block chain of a batch; the outputs of a layer are the src rows
+        of the next block, only the last layer writes back."""
+        profiler = self.profiler
+        vals = {}
+        for j, (layer, func) in enumerate(zip(group, funcs)):
+            block = blocks[j]
+            src_nodes = input_nodes if j == 0 else block.srcdata[dgl.NID].to(input_nodes.device)
+            profiler.count("input nodes", src_nodes.shape[0])
+            profiler.count("output nodes", block.num_dst_nodes())
+            with profiler.span("gather"):
+                gathered = iter(get_new_arg_input([arg_node for arg_node in layer.inputs if arg_node not in vals],
+                                                  self._data_manager, src_nodes, block, self._device, self._use_uva))
+                new_args = tuple(vals[arg_node] if arg_node in vals else next(gathered) for arg_node in layer.inputs)
+            profiler.count("edges", block.num_edges())
+            with profiler.span("compute"):
+                output_vals = func(*new_args)
+            del new_args
+            if not isinstance(output_vals, tuple):
+                output_vals = (output_vals,)
+            if j == len(group) - 1:
+                with profiler.span("write-back"):
+                    rets = update_ret_output(output_vals, rets, src_nodes, output_nodes, [block])
+            else:
+                vals = {arg_node: val[:block.num_dst_nodes()] if isinstance(val, torch.Tensor) else val
+                        for arg_node, val in zip(layer.outputs, output_vals)}
+        return rets
+
+    def _run_layer_on(self, graph, layer, func, rets, nids):
+        # run one layer for the dst nodes nids only
+        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+        for start in range(0, nids.shape[0], self.fuse_batch_size):
+            input_nodes, output_nodes, blocks = sampler.sample_blocks(graph, nids[start:start + self.fuse_batch_size])
+            blocks = [block.to(self._device) for block in blocks]
+            rets = self.run_batch(layer, func, rets, input_nodes, output_nodes, blocks)
+        return rets
+
+    def compute_group(self, graph, rets, group, funcs, ret_shapes):
+        """Run the layers of a group in one pass for the batches whose k-hop block chain is small enough.
+
+        A batch is fused when its chain has at most ``expansion_threshold`` times the ``k * 1-hop`` edges it
+        costs layer by layer; the recomputation of the shared neighbors is traded against the N x D tensors
+        between the layers. The other dst nodes run layer by layer over the in-frontiers they need, with
+        the outputs between the layers materialized.
+        """
+        k = len(group)
+        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(k)
+        in_degrees = graph.in_degrees()
+        nids = self._node_ids(graph)
+        stats = {"layers": [layer.id for layer in group], "fused_batches": 0, "fused_edges": 0,
+                 "fallback_nodes": 0, "fallback_edges": 0}
+        fallback = []
+        for start in range(0, nids.shape[0], self.fuse_batch_size):
+            seeds = nids[start:start + self.fuse_batch_size]
+            limit = self.expansion_threshold * k * max(int(in_degrees[seeds].sum()), 1)
+            chain_edges = get_chain_edges(graph, seeds, k, in_degrees, limit)
+            if chain_edges > limit:
+                fallback.append(seeds)
+                continue
+            input_nodes, output_nodes, blocks = sampler.sample_blocks(graph, seeds)
+            blocks = [block.to(self._device) for block in blocks]
+            rets = self.run_fused_batch(group, funcs, rets, input_nodes, output_nodes, blocks)
+            stats["fused_batches"] += 1
+            stats["fused_edges"] += chain_edges
+        if len(fallback) > 0:
+            # the dst nodes every layer needs, from the last layer back
+            needed = [torch.cat(fallback)]
+            for _ in range(k - 1):
+                needed.insert(0, get_in_frontier(graph, needed[0]))
+            for j, (layer, func) in enumerate(zip(group, funcs)):
+                if j == k - 1:
+                    layer_rets = rets
                 else:
-                    ret_shapes[layer.id].append((val.__class__, None))
-        return ret_shapes
+                    layer_rets = [torch.zeros((graph.number_of_nodes(),) + tuple(ret_shapes[layer.id][i][1]))
+                                  if ret_shapes[layer.id][i][0] == torch.Tensor else None
+                                  for i in range(len(layer.outputs))]
+                    for ret, arg_node in zip(layer_rets, layer.outputs):
+                        self._data_manager[arg_node] = ret
+                self._ret_layer = layer
+                layer_rets = self._run_layer_on(graph, layer, func, layer_rets, needed[j])
+                stats["fallback_nodes"] += needed[j].shape[0]
+                stats["fallback_edges"] += int(in_degrees[needed[j]].sum())
+            self._ret_layer = group[-1]
+            rets = layer_rets
+        self.fusion_stats[group[0].id] = stats
+        if self._debug:
+            print("Layers {}: {} fused batches over {} edges, {} nodes and {} edges layer by layer.".format(
+                stats["layers"], stats["fused_batches"], stats["fused_edges"], stats["fallback_nodes"],
+                stats["fallback_edges"]))
+        return rets
+
+    def _compiled_func(self, layer, func):
+        compiled = self._compiled.get(layer.id)
+        edge_indexed = tuple(arg_node.edge_indexed for arg_node in layer.inputs)
+        if compiled is None or compiled.func is not func or compiled.edge_indexed != edge_indexed:
+            enable_compile_cache()
+            compiled = CompiledConvBlock(func, layer.id, edge_indexed)
+            self._compiled[layer.id] = compiled
+        return compiled
+
+    def _report_compile(self, layer):
+        stats = self._compiled[layer.id].summary()
+        self.compile_stats[layer.id] = stats
+        self.profiler.count("compile time", stats["compile_time"])
+        if self._debug:
+            print("Layer {}: {} compiles in {:.2f}s, speedup {}.".format(
+                layer.id, stats["compiles"], stats["compile_time"],
+                "n/a" if stats["speedup"] is None else "{:.2f}x".format(stats["speedup"])))
 
     def compute(self, inference_graph, rets, layer, func):
         raise NotImplementedError()
 
+    def run_batch(self, layer, func, rets, input_nodes, output_nodes, blocks):
+        profiler = self.profiler
+        profiler.count("input nodes", sum(v.shape[0] for v in input_nodes.values())
+                       if isinstance(input_nodes, dict) else input_nodes.shape[0])
+        profiler.count("output nodes", sum(v.shape[0] for v in output_nodes.values())
+                       if isinstance(output_nodes, dict) else output_nodes.shape[0])
+        profiler.count("edges", blocks[0].num_edges())
+        if self.bucketed_aggregation and not self.is_hetero and not isinstance(blocks[0], HubBlock):
+            blocks = [BucketedBlock.wrap(blocks[0])] + list(blocks[1:])
+        with profiler.span("gather"):
+            new_args = get_new_arg_input(layer.inputs, self._data_manager, input_nodes,
+                blocks[0], self._device, self._use_uva, self._staging)
+        profiler.count_bytes("bytes gathered", new_args)
+        profiler.count("edge bytes gathered", get_tensors_bytes(
+            [val for arg_node, val in zip(layer.inputs, new_args) if arg_node.edge_indexed]))
+
+        with profiler.span("compute"):
+            output_vals = func(*new_args)
+        del new_args
+
+        with profiler.span("write-back"):
+            rets = update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks,
+                                     [arg_node.ntype for arg_node in self._ret_layer.outputs])
+        profiler.count_bytes("bytes written", output_vals)
+        del output_vals
+        return rets
+
     def before_inference(self, graph, *args):
         pass
 
@@ -61,14 +432,19 @@ class InferenceHelperBase():
         pass
 
     def inference(self, inference_graph, *args):
-        t0 = time.time()
-        self.before_inference(inference_graph, *args)
-        t1 = time.time()
-        print("before", t1-t0)
-        for k in list(inference_graph.ndata.keys()):
-            inference_graph.ndata.pop(k)
-        for k in list(inference_graph.edata.keys()):
-            inference_graph.edata.pop(k)
+        with self.profiler.span("prepare"):
+            self._read_graph_data(inference_graph, args)
+            self.before_inference(inference_graph, *args)
+            # may split the layers again, before any value is stored by its ArgNode
+            ret_shapes = self.ret_shapes if self.ret_shapes is not None else self._trace_output_shape(args)
+        for streaming in self._function_generator.streaming.values():
+            streaming.chunk_edges = self.attention_chunk_edges
+        for ntype in inference_graph.ntypes:
+            for k in list(inference_graph.nodes[ntype].data.keys()):
+                inference_graph.nodes[ntype].data.pop(k)
+        for cetype in inference_graph.canonical_etypes:
+            for k in list(inference_graph.edges[cetype].data.keys()):
+                inference_graph.edges[cetype].data.pop(k)
 
         first_layer_inputs = (inference_graph,) + tuple(args)
         if len(first_layer_inputs) != len(self._schema.first_layer_input):
@@ -76,32 +452,80 @@ class InferenceHelperBase():
         for val, arg_name in zip(first_layer_inputs, self._schema.first_layer_input):
             arg_node = self._schema.name2arg_map[arg_name]
             self._data_manager[arg_node] = val
-        ret_shapes = self.ret_shapes
+        for name, (ntype, _) in self._function_generator.graph_inputs.items():
+            if name in self._schema.name2arg_map:
+                arg_node = self._schema.name2arg_map[name]
+                arg_node.ntype = ntype
+                self._data_manager[arg_node] = self._graph_data[name]
+        for name in self._function_generator.edge_inputs:
+            if name in self._schema.name2arg_map:
+                self._data_manager[self._schema.name2arg_map[name]] = self._graph_data[name]
+        for name in self._schema.first_layer_input + list(self._function_generator.edge_inputs):
+            if name not in self._schema.name2arg_map:
+                continue
+            arg_node = self._schema.name2arg_map[name]
+            arg_node.edge_indexed = name in self._edge_input_names
+            if arg_node.edge_indexed:
+                self._data_manager[arg_node] = self._spill_edge_input(name, self._data_manager[arg_node])
+                if name in self._graph_data:
+                    self._graph_data[name] = self._data_manager[arg_node]
+        if self._function_generator.hoisted is not None:
+            with self.profiler.span("hoisted"):
+                for name, val in self._hoisted_values(inference_graph).items():
+                    if name in self._schema.name2arg_map:
+                        self._data_manager[self._schema.name2arg_map[name]] = val
 
+        groups = self._fused_groups()
+        # layers run in the pass of a group before them
+        grouped = set(layer.id for group in groups.values() for layer in group[1:])
+        self.fusion_stats = {}
         for layer, func in zip(self._schema.layers, self._funcs):
+            if layer.id in grouped:
+                continue
+            # the layer whose outputs are written back
+            ret_layer = layer if layer.id not in groups else groups[layer.id][-1]
+            if self.compile_layers and layer.id not in groups:
+                func = self._compiled_func(layer, func)
+            with self.profiler.layer(layer.id):
+                rets = []
+                for j, arg_node in enumerate(ret_layer.outputs):
+                    cls, shape = ret_shapes[ret_layer.id][j][:2]
+                    # the node type of a tensor output of a heterograph
+                    arg_node.ntype = ret_shapes[ret_layer.id][j][2] if len(ret_shapes[ret_layer.id][j]) > 2 else None
+                    if cls == torch.Tensor:
+                        rets.append(
+                            torch.zeros((self._num_ret_rows(inference_graph, arg_node.ntype),) + tuple(shape))
+                        )
+                    elif cls == dict:
+                        rets.append({ntype: torch.zeros((inference_graph.num_nodes(ntype),) + tuple(shape[ntype]))
+                                     for ntype in shape})
+                    else:
+                        rets.append(None)
 
-            rets = []
-            for j, _ in enumerate(layer.outputs):
-                cls, shape = ret_shapes[layer.id][j]
-                if cls == torch.Tensor:
-                    rets.append(
-                        torch.zeros((inference_graph.number_of_nodes(),) + tuple(shape))
-                    )
-                else:
-                    rets.append(None)
-
-            for ret, arg_node in zip(rets, layer.outputs):
-                self._data_manager[arg_node] = ret
+                for ret, arg_node in zip(rets, ret_layer.outputs):
+                    self._data_manager[arg_node] = ret
+                self._ret_layer = ret_layer
 
-            gc.collect()
-            torch.cuda.empty_cache()
+                with self.profiler.span("gc"):
+                    gc.collect()
+                    torch.cuda.empty_cache()
 
-            rets = self.compute(inference_graph, rets, layer, func)
+                if layer.id in groups:
+                    group = groups[layer.id]
+                    rets = self.compute_group(inference_graph, rets, group,
+                                              [self._funcs[group_layer.id] for group_layer in group], ret_shapes)
+                else:
+                    rets = self.compute(inference_graph, rets, layer, func)
+                    if self.compile_layers:
+                        self._report_compile(layer)
 
-            # delete intermediate val
-            for arg_node in layer.inputs:
-                if arg_node.input_layers[-1] == layer and arg_node.input_layers[0] != self._schema.get_layer(0):
-                    del self._data_manager[arg_node]
+                # delete intermediate val
+                for group_layer in groups.get(layer.id, [layer]):
+                    for arg_node in group_layer.inputs:
+                        if arg_node.input_layers[-1] == group_layer and \
+                            arg_node.input_layers[0] != self._schema.get_layer(0) and \
+                            arg_node in self._data_manager.arg2val_map:
+                            del self._data_manager[arg_node]
 
         outputs = ()
         for name in self._schema.last_layer_output:
@@ -109,6 +533,8 @@ class InferenceHelperBase():
             outputs += (self._data_manager[arg_node],)
 
         self.after_inference()
+        if self._debug:
+            self.profiler.show()
 
         if len(outputs) == 1:
             return outputs[0]
@@ -116,8 +542,9 @@ class InferenceHelperBase():
 
 
 class InferenceHelper(InferenceHelperBase):
-    def __init__(self, module: nn.Module, batch_size, device, num_workers = 4, debug = False):
-        super().__init__(module, device, debug=debug)
+    def __init__(self, module: nn.Module, batch_size, device, num_workers = 4, debug = False, profile = False,
+                 graph_meta = None):
+        super().__init__(module, device, debug=debug, profile=profile, graph_meta=graph_meta)
         self._batch_size = batch_size
         self._num_workers = num_workers
 
@@ -125,7 +552,7 @@ class InferenceHelper(InferenceHelperBase):
         sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
         dataloader = dgl.dataloading.NodeDataLoader(
             graph,
-            torch.arange(graph.number_of_nodes()).to(graph.device),
+            self._batch_node_ids(graph),
             sampler,
             batch_size=self._batch_size,
             device=self._device if self._num_workers == 0 else 'cpu',
@@ -133,150 +560,613 @@ class InferenceHelper(InferenceHelperBase):
             drop_last=False,
             num_workers=self._num_workers)
 
-        for input_nodes, output_nodes, blocks in tqdm.tqdm(dataloader):
-            new_args = get_new_arg_input(layer.inputs, self._data_manager, input_nodes, blocks[0], self._device)
+        for input_nodes, output_nodes, blocks in self.profiler.batches(tqdm.tqdm(dataloader)):
+            rets = self.run_batch(layer, func, rets, input_nodes, output_nodes, blocks)
 
+        return rets
+
+
+class WavefrontInferenceHelper(InferenceHelper):
+    """Interleave the batches of consecutive layers on a banded graph, see ``reorder_banded``.
+
+    The dst nodes are cut into ranges of ``batch_size`` nodes. A range of a layer is ready once the layer
+    before it has finished every range its in-neighbors lie in, so the deepest ready layer runs next, and
+    an intermediate output keeps only the ranges a pending range of the next layer still reads.
+    """
+    def __init__(self, module: nn.Module, batch_size, device, num_workers = 4, debug = False, profile = False,
+                 graph_meta = None):
+        super().__init__(module, batch_size, device, num_workers=num_workers, debug=debug, profile=profile,
+                         graph_meta=graph_meta)
+        self.wavefront_stats = {}
+
+    def _fused_groups(self, max_layers=None):
+        # every run of layers feeding only the next one is scheduled together
+        return super()._fused_groups(len(self._schema.layers))
+
+    def run_wavefront_batch(self, layer, func, windows, window, input_nodes, output_nodes, blocks):
+        """Run a range of a layer; the outputs of the layer before it are read from ``windows``, where they
+        lie in the ranges ``window``."""
+        profiler = self.profiler
+        profiler.count("input nodes", input_nodes.shape[0])
+        profiler.count("output nodes", output_nodes.shape[0])
+        profiler.count("edges", blocks[0].num_edges())
+        with profiler.span("gather"):
+            gathered = iter(get_new_arg_input([arg_node for arg_node in layer.inputs if arg_node not in windows],
+                                              self._data_manager, input_nodes, blocks[0], self._device,
+                                              self._use_uva))
+            new_args = ()
+            for arg_node in layer.inputs:
+                if arg_node not in windows:
+                    new_args += (next(gathered),)
+                elif isinstance(windows[arg_node], ResidencyWindow):
+                    new_args += (windows[arg_node].gather(input_nodes, *window).to(self._device),)
+                else:
+                    new_args += (windows[arg_node],)
+        with profiler.span("compute"):
             output_vals = func(*new_args)
-            del new_args
+        del new_args
+        if not isinstance(output_vals, tuple):
+            output_vals = (output_vals,)
+        return output_vals
 
-            rets = update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks)
+    def compute_group(self, graph, rets, group, funcs, ret_shapes):
+        range_size = self._batch_size
+        nids = self._node_ids(graph)
+        num_ranges = (nids.shape[0] + range_size - 1) // range_size
+        lo, hi, bandwidth = get_band_windows(graph, range_size)
+        # the first range a pending range of the next layer, from this one on, still reads
+        first_needed = torch.flip(torch.cummin(torch.flip(lo, (0,)), 0).values, (0,)).tolist()
+        lo, hi = lo.tolist(), hi.tolist()
+        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+        # the output ArgNodes of a layer of the group -> their windows, or their values when not tensors
+        windows = {}
+        done = [0] * len(group)
+        switches = 0
+        last = None
+        while done[-1] < num_ranges:
+            # the deepest ready layer, so the windows are released as early as possible
+            j = next(j for j in reversed(range(len(group)))
+                     if done[j] < num_ranges and (j == 0 or done[j - 1] > hi[done[j]]))
+            switches += last is not None and last != j
+            last = j
+            r = done[j]
+            input_nodes, output_nodes, blocks = sampler.sample_blocks(graph, nids[r * range_size:(r + 1) * range_size])
+            blocks = [block.to(self._device) for block in blocks]
+            output_vals = self.run_wavefront_batch(group[j], funcs[j], windows, (lo[r], hi[r]),
+                                                   input_nodes, output_nodes, blocks)
+            if j == len(group) - 1:
+                with self.profiler.span("write-back"):
+                    rets = update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks)
+            else:
+                for arg_node, val in zip(group[j].outputs, output_vals):
+                    if not isinstance(val, torch.Tensor):
+                        windows[arg_node] = val
+                        continue
+                    if arg_node not in windows:
+                        windows[arg_node] = ResidencyWindow(range_size)
+                    windows[arg_node].add(r, val[:blocks[0].num_dst_nodes()])
             del output_vals
+            done[j] += 1
+            if j > 0:
+                release = first_needed[done[j]] if done[j] < num_ranges else num_ranges
+                for arg_node in group[j - 1].outputs:
+                    if isinstance(windows.get(arg_node), ResidencyWindow):
+                        windows[arg_node].release_before(release)
+        self.wavefront_stats[group[0].id] = {
+            "layers": [layer.id for layer in group],
+            "ranges": num_ranges,
+            "bandwidth": bandwidth,
+            "switches": switches,
+            "peak_rows": {arg_node.name: window.peak_rows for arg_node, window in windows.items()
+                          if isinstance(window, ResidencyWindow)},
+        }
+        if self._debug:
+            print("Layers {}: {} ranges, bandwidth {}, peak resident rows {}.".format(
+                self.wavefront_stats[group[0].id]["layers"], num_ranges, bandwidth,
+                self.wavefront_stats[group[0].id]["peak_rows"]))
+        return rets
+
+
+class DistributedInferenceHelper(InferenceHelperBase):
+    """Layer-wise inference over the ranks of a ``torch.distributed`` process group.
+
+    Every rank owns a contiguous range of nodes, see ``partition``, is given the rows of that range of the
+    node features and returns the rows of that range of the outputs. Per layer it fetches the halo, the rows
+    of the remote in-neighbors of its nodes, by all-to-all, then runs the batches of its own dst nodes.
+    The graph structure and the edge features are replicated on every rank.
+    """
+    def __init__(self, module: nn.Module, batch_size, device, group=None, balance_edges=True,
+                 halo_chunk_rows=1 << 20, debug = False, profile = False, graph_meta = None):
+        super().__init__(module, device, debug=debug, profile=profile, graph_meta=graph_meta)
+        self._batch_size = batch_size
+        self._group = group
+        self.balance_edges = balance_edges
+        self.halo_chunk_rows = halo_chunk_rows
+        self._bounds = None
+        self._halo = None
+        self.dist_stats = {}
+
+    @property
+    def rank(self):
+        return torch.distributed.get_rank(self._group)
+
+    def partition(self, graph):
+        """The ``(start, end)`` range of the nodes this rank owns; every rank must call it."""
+        if self.is_hetero:
+            raise RuntimeError("Distributed inference of a heterograph is not supported.")
+        world_size = torch.distributed.get_world_size(self._group)
+        self._bounds = partition_ranges(graph, world_size, self.balance_edges)
+        self._halo = HaloExchange(graph, self._bounds, self.rank, world_size, self.halo_chunk_rows, self._group)
+        return self._halo.start, self._halo.end
+
+    def _fused_groups(self, max_layers=None):
+        # the outputs between fused layers have no shards to exchange
+        return {}
+
+    def _num_ret_rows(self, graph, ntype=None):
+        return self._halo.num_owned
+
+    def before_inference(self, graph, *args):
+        if self._halo is None:
+            self.partition(graph)
+        self.dist_stats = {"rank": self.rank, "owned": self._halo.num_owned,
+                           "halo_rows": len(self._halo.halo_ids), "layers": []}
+
+    def _is_shard(self, graph, arg_node, val):
+        # node rows of this rank, a full node tensor is cut to them
+        return isinstance(val, torch.Tensor) and not arg_node.edge_indexed and val.dim() > 0 and \
+            val.shape[0] in (self._halo.num_owned, graph.number_of_nodes())
 
+    def compute(self, graph, rets, layer, func):
+        halo = self._halo
+        stats = {"layer": layer.id, "exchange_time": 0., "compute_time": 0., "bytes_sent": 0, "bytes_received": 0}
+        shards = {}
+        st = time.perf_counter()
+        with self.profiler.span("halo exchange"):
+            for arg_node in layer.inputs:
+                val = self._data_manager[arg_node]
+                if not self._is_shard(graph, arg_node, val):
+                    continue
+                if val.shape[0] != halo.num_owned:
+                    val = val[halo.start:halo.end]
+                shards[arg_node] = self._data_manager[arg_node]
+                halo_rows, bytes_sent, bytes_received = halo.exchange(val)
+                self._data_manager[arg_node] = torch.cat([val, halo_rows])
+                stats["bytes_sent"] += bytes_sent
+                stats["bytes_received"] += bytes_received
+        self.profiler.count("halo bytes sent", stats["bytes_sent"])
+        self.profiler.count("halo bytes received", stats["bytes_received"])
+        stats["exchange_time"] = time.perf_counter() - st
+
+        st = time.perf_counter()
+        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+        owned = torch.arange(halo.start, halo.end)
+        for start in tqdm.trange(0, owned.shape[0], self._batch_size, disable=not self._debug):
+            input_nodes, output_nodes, blocks = sampler.sample_blocks(graph, owned[start:start + self._batch_size])
+            blocks = [block.to(self._device) for block in blocks]
+            # the rows of the local tensors, the shard followed by the halo
+            rets = self.run_batch(layer, func, rets, halo.local_ids(input_nodes), halo.local_ids(output_nodes),
+                                  blocks)
+        stats["compute_time"] = time.perf_counter() - st
+
+        for arg_node, val in shards.items():
+            self._data_manager[arg_node] = val
+        self.dist_stats["layers"].append(stats)
+        if self._debug:
+            print("Rank {} layer {}: exchange {:.3f}s, {} bytes sent, {} bytes received, compute {:.3f}s.".format(
+                self.dist_stats["rank"], layer.id, stats["exchange_time"], stats["bytes_sent"],
+                stats["bytes_received"], stats["compute_time"]))
         return rets
 
 
 class EdgeControlInferenceHelper(InferenceHelperBase):
-    def __init__(self, module: nn.Module, max_edge_in_batch, device, num_workers = 4, debug = False):
-        super().__init__(module, device, debug=debug)
+    def __init__(self, module: nn.Module, max_edge_in_batch, device, num_workers = 4, debug = False, profile = False,
+                 graph_meta = None):
+        super().__init__(module, device, debug=debug, profile=profile, graph_meta=graph_meta)
         self._max_edge_in_batch = max_edge_in_batch
         self._num_workers = num_workers
 
     def compute(self, graph, rets, layer, func):
         sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
-        dataloader = CustomDataloader(
-            graph,
-            self._max_edge_in_batch,
-            sampler,
-            device=self._device if self._num_workers == 0 else 'cpu',
-            shuffle=False,
-            drop_last=False,
-            num_workers=self._num_workers)
+        if self.is_hetero:
+            dataloader = HeteroDataloader(
+                graph,
+                self._node_ids(graph),
+                sampler,
+                graph.number_of_nodes(),
+                self._max_edge_in_batch,
+                device=self._device)
+        else:
+            dataloader = CustomDataloader(
+                graph,
+                self._batch_node_ids(graph),
+                sampler,
+                graph.number_of_nodes(),
+                self._max_edge_in_batch,
+                device=self._device if self._num_workers == 0 else 'cpu',
+                shuffle=False,
+                num_workers=self._num_workers)
 
         pbar = tqdm.tqdm(total=graph.number_of_nodes())
-        for input_nodes, output_nodes, blocks in dataloader:
-            new_args = get_new_arg_input(layer.inputs, self._data_manager, input_nodes, blocks[0], self._device)
-
-            output_vals = func(*new_args)
-            del new_args
-
-            rets = update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks)
-            del output_vals
-            pbar.update(output_nodes.shape[0])
+        for input_nodes, output_nodes, blocks in self.profiler.batches(dataloader):
+            rets = self.run_batch(layer, func, rets, input_nodes, output_nodes, blocks)
+            pbar.update(blocks[0].num_dst_nodes())
         pbar.close()
 
         return rets
 
 
 class AutoInferenceHelper(InferenceHelperBase):
-    def __init__(self, module: nn.Module, device, use_uva, free_rate, use_random, debug = False):
+    def __init__(self, module: nn.Module, device, use_uva, free_rate, use_random, debug = False, profile = False,
+                 tuning_cache = None, pressure_rate = 0.9, graph_meta = None):
         self.free_rate = free_rate
+        # the allocator cache is only flushed after a batch whose peak passed this rate of the free memory
+        self.pressure_rate = pressure_rate
         self.use_random = use_random
-        super().__init__(module, device, use_uva, debug)
+        # None / False: disabled; True: the default path; str: a cache file; or a TuningCache.
+        if tuning_cache is True:
+            tuning_cache = TuningCache()
+        elif isinstance(tuning_cache, str):
+            tuning_cache = TuningCache(tuning_cache)
+        self._tuning_cache = tuning_cache or None
+        self._cache_key = None
+        # the memory budget the cached entries are checked against
+        self._cache_budget = None
+        self._plan = None
+        self._costs = None
+        self._auto_tuner = None
+        self.oom_stats = None
+        self.alloc_stats = None
+        # a dst node with more in-edges than this (None: than the edge budget) is a hub, which runs alone
+        # with its message passing split over slices of its in-edges
+        self.hub_threshold = None
+        self.hub_stats = None
+        # per layer: the direction changes of the edge budget, the batches after OOM, and how much the
+        # edges per dst node vary between the batches
+        self.tuner_stats = {}
+        super().__init__(module, device, use_uva, debug, profile, graph_meta)
+        self._staging = StagingBuffers()
 
     def before_inference(self, graph, *args):
-        if not self.use_random:
-            self.nids = torch.arange(graph.number_of_nodes()).to(graph.device)
+        self.nids = self._batch_node_ids(graph)
+        if self.is_hetero:
+            in_degrees = get_hetero_in_degrees(graph, self.nids).numpy()
         else:
-            self.nids = torch.arange(graph.number_of_nodes()).to(graph.device)
-        in_degrees = graph.in_degrees(self.nids).numpy()
+            in_degrees = graph.in_degrees(self.nids).numpy()
         prefix_sum_in_degrees = np.cumsum(in_degrees)
         self.prefix_sum_in_degrees = [0]
         self.prefix_sum_in_degrees.extend(prefix_sum_in_degrees.tolist())
         self.prefix_sum_in_degrees.append(2e18)
+        self._costs = self.analyze(args, graph)
+        self._plan = self._plan_layers(graph, self._costs, free_rate=self.free_rate)
+        # one tuner for all layers of this inference, carried over between them.
+        self._auto_tuner = get_auto_tuner(self._device)
+
+        if self._tuning_cache is not None:
+            auto_tuner = self._auto_tuner
+            auto_tuner.set_free(self.free_rate)
+            input_shapes = [tuple(arg.shape[1:]) for arg in args if isinstance(arg, torch.Tensor)]
+            graph_stats = get_graph_stats(graph, torch.from_numpy(in_degrees))
+            if self.is_hetero:
+                graph_stats["meta"] = self._graph_meta
+            if self.batch_order is not None:
+                graph_stats["batch_order"] = self.batch_order
+            self._cache_key = TuningCache.make_key(
+                self._function_generator.get_fingerprint(),
+                graph_stats,
+                input_shapes,
+                get_device_profile(self._device))
+            self._cache_budget = auto_tuner.free_memory
+
+    def run_batch_bisect(self, layer, func, rets, input_nodes, output_nodes, block):
+        """Run a batch; when it runs out of memory, split its dst nodes into two edge-balanced halves
+        which reuse the sampled block, and run them instead. Errors other than OOM are raised."""
+        oom_count = 0
+        pending = [(input_nodes, output_nodes, block)]
+        while len(pending) > 0:
+            sub_input_nodes, sub_output_nodes, sub_block = pending.pop()
+            st = time.perf_counter()
+            try:
+                rets = self.run_batch(layer, func, rets, sub_input_nodes, sub_output_nodes, [sub_block])
+                continue
+            except Exception as e:
+                if not is_oom_error(e):
+                    raise
+            # leave the except clause first, so the traceback does not keep the batch tensors alive.
+            oom_count += 1
+            self.oom_stats["retries"] += 1
+            self.oom_stats["wasted_time"] += time.perf_counter() - st
+            self.oom_stats["wasted_nodes"] += sub_block.num_dst_nodes()
+            self.oom_stats["wasted_edges"] += sub_block.num_edges()
+            self.profiler.count("oom retries", 1)
+            self.profiler.count("oom wasted edges", sub_block.num_edges())
+            num_dst = sub_block.num_dst_nodes()
+            if self.is_hetero:
+                raise RuntimeError("Out of memory on a batch of a heterograph with {} edges, lower the "
+                                   "free_rate.".format(sub_block.num_edges()))
+            if num_dst <= 1:
+                raise RuntimeError("Out of memory on a single destination node with {} in-edges.".format(
+                    sub_block.num_edges()))
+            with self.profiler.span("gc"):
+                gc.collect()
+                torch.cuda.empty_cache()
+            mid = get_edge_balanced_split(sub_block, 0, num_dst)
+            # the first half is popped first.
+            pending.append(split_block(sub_block, sub_input_nodes, sub_output_nodes, mid, num_dst))
+            pending.append(split_block(sub_block, sub_input_nodes, sub_output_nodes, 0, mid))
+        return rets, oom_count
+
+    def run_hub_batch(self, layer, func, rets, input_nodes, output_nodes, block, chunk_edges):
+        """Run the batch of one hub dst node on a ``HubBlock``, which aggregates at most ``chunk_edges`` of its
+        in-edges at a time. The tuner doesn't see it, so it keeps the budget of the other batches."""
+        st = time.perf_counter()
+        rets = self.run_batch(layer, func, rets, input_nodes, output_nodes, [HubBlock.wrap(block, chunk_edges)])
+        self.hub_stats["hubs"] += 1
+        self.hub_stats["hub_edges"] += block.num_edges()
+        self.hub_stats["hub_time"] += time.perf_counter() - st
+        self.profiler.count("hub nodes", 1)
+        return rets
+
+    def _allocator_stats(self):
+        if torch.device(self._device).type != 'cuda':
+            return {}
+        return torch.cuda.memory_stats(self._device)
+
+    def _update_alloc_stats(self, start):
+        # allocations and fragmentation of the caching allocator and the staging buffers in this layer
+        stats = self._allocator_stats()
+        alloc_stats = self.alloc_stats
+        alloc_stats["staging_allocations"] = self._staging.allocations - start["staging_allocations"]
+        alloc_stats["staging_reuses"] = self._staging.reuses - start["staging_reuses"]
+        alloc_stats["staging_bytes"] = self._staging.allocated_bytes
+        if len(stats) > 0:
+            alloc_stats["allocations"] = stats.get("allocation.all.allocated", 0) - start["allocations"]
+            alloc_stats["alloc_retries"] = stats.get("num_alloc_retries", 0) - start["alloc_retries"]
+            reserved = stats.get("reserved_bytes.all.current", 0)
+            allocated = stats.get("allocated_bytes.all.current", 0)
+            alloc_stats["fragmentation"] = 1 - allocated / reserved if reserved > 0 else 0.
+        self.profiler.count("cache flushes", alloc_stats["cache_flushes"])
+        self.profiler.count("staging allocations", alloc_stats["staging_allocations"])
 
     def compute(self, graph, rets, layer, func):
 
-        if self._use_uva:
+        if self._use_uva and not self.is_hetero:
             self.nids = self.nids.to(self._device)
             self._data_manager.pin_data_inplace(layer)
 
-        auto_tuner = get_auto_tuner(self._device)
-        start_max_node = 2000
-        start_max_edge = 500000
+        # out of memory retries of this layer
+        self.oom_stats = {"retries": 0, "wasted_time": 0., "wasted_nodes": 0, "wasted_edges": 0}
+        self.hub_stats = {"hubs": 0, "hub_edges": 0, "hub_time": 0.}
+        self.alloc_stats = {"cache_flushes": 0, "staging_allocations": 0, "staging_reuses": 0, "staging_bytes": 0,
+                            "allocations": None, "alloc_retries": None, "fragmentation": None}
+        allocator_stats = self._allocator_stats()
+        alloc_start = {"staging_allocations": self._staging.allocations, "staging_reuses": self._staging.reuses,
+                       "allocations": allocator_stats.get("allocation.all.allocated", 0),
+                       "alloc_retries": allocator_stats.get("num_alloc_retries", 0)}
+        auto_tuner = self._auto_tuner
+        # start from the largest batch predicted to fit, the tuner measures and corrects it.
+        start_max_node = self._plan[layer.id]["max_node"]
+        start_max_edge = self._plan[layer.id]["max_edge"]
+        cached = None
+        if self._tuning_cache is not None:
+            cached = self._tuning_cache.get(self._cache_key, layer.id, self._cache_budget)
+        if cached is not None:
+            auto_tuner.warm_start(cached)
+            start_max_node, start_max_edge = auto_tuner.budget
+        elif layer.id > 0 and auto_tuner.budget is not None:
+            prev_cost, curr_cost = self._costs[layer.id - 1], self._costs[layer.id]
+            scale = lambda src, dst, edges: curr_cost.peak_bytes(src, dst, edges) / \
+                max(prev_cost.peak_bytes(src, dst, edges), 1.)
+            start_max_node, start_max_edge = auto_tuner.carry_over(scale)
+        # batches are planned in shape classes, which the allocator and the staging buffers reuse
+        start_max_node, start_max_edge = get_bucket_floor(start_max_node), get_bucket_floor(start_max_edge)
 
         sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
-        dataloader = CustomDataloader(
-            graph,
-            self.nids,
-            sampler,
-            start_max_node,
-            start_max_edge,
-            self.prefix_sum_in_degrees,
-            device=self._device,
-            use_uva=self._use_uva,
-            shuffle=False)
-
-        # pbar = tqdm.tqdm(total=graph.number_of_nodes())
+        if self.is_hetero:
+            dataloader = HeteroDataloader(
+                graph,
+                self.nids,
+                sampler,
+                start_max_node,
+                start_max_edge,
+                self.prefix_sum_in_degrees,
+                device=self._device)
+        else:
+            dataloader = CustomDataloader(
+                graph,
+                self.nids,
+                sampler,
+                start_max_node,
+                start_max_edge,
+                self.prefix_sum_in_degrees,
+                device=self._device,
+                use_uva=self._use_uva,
+                shuffle=False,
+                hub_threshold=self.hub_threshold)
+
         max_memory = 0
-        memorys = []
-        nodes = []
-        profiler = Profiler()
-        profiler.record_and_reset()
-        for input_nodes, output_nodes, blocks in dataloader:
-            profiler.tag()
-            try:
-                auto_tuner.reset_state()
-                torch.cuda.empty_cache()
-                auto_tuner.set_free(self.free_rate)
+        profiler = self.profiler
+        flush = False
+        max_edge = start_max_edge
+        tuner_stats = {"batches": 0, "reversals": 0, "break_peaks": 0, "edges": 0, "time": 0.}
+        edge_ratios = []
+        direction = 0
+        st = time.perf_counter()
+        for input_nodes, output_nodes, blocks in profiler.batches(dataloader):
+            hub_edges = max_edge if self.hub_threshold is None else self.hub_threshold
+            if not self.is_hetero and blocks[0].num_dst_nodes() == 1 and blocks[0].num_edges() > hub_edges:
+                # a batch can't have fewer dst nodes, the in-edges of this one are split instead
+                rets = self.run_hub_batch(layer, func, rets, input_nodes, output_nodes, blocks[0], max_edge)
+                continue
+            if flush:
+                with profiler.span("gc"):
+                    torch.cuda.empty_cache()
+                self.alloc_stats["cache_flushes"] += 1
+            auto_tuner.reset_state()
+            auto_tuner.set_free(self.free_rate)
 
-                profiler.record_name("total input nodes", input_nodes.shape[0])
+            rets, oom_count = self.run_batch_bisect(layer, func, rets, input_nodes, output_nodes, blocks[0])
 
-                new_args = get_new_arg_input(layer.inputs, self._data_manager, input_nodes, 
-                    blocks[0], self._device, self._use_uva)
-                profiler.tag()
-                # if isinstance(new_args[0], torch.Tensor):
-                #     h = new_args[0]
-                # else:
-                #     h = new_args[1]
-                # print(h.shape, "%.2f"%(profiler.last()), "s;", "%.2f"%(h.shape[0]*h.shape[1]*4/1000**3), "GB;", "%.2f"%(h.shape[0]*h.shape[1]*4 / profiler.last() / 1000**3), "GB/s")
+            with profiler.span("tune"):
+                if oom_count == 0:
+                    auto_tuner.set_max()
+                    nxt_max_node, nxt_max_edge = auto_tuner.search(blocks[0], dataloader)
+                    max_memory = max(auto_tuner.get_max(), max_memory)
+                else:
+                    nxt_max_node, nxt_max_edge = auto_tuner.break_peak(blocks[0])
+            nxt_max_node, nxt_max_edge = get_bucket_floor(nxt_max_node), get_bucket_floor(nxt_max_edge)
+            # keep the blocks cached by the allocator, unless the batch came close to the budget.
+            flush = oom_count > 0 or auto_tuner.get_max() > self.pressure_rate * auto_tuner.free_memory
+            if self._debug:
+                if oom_count == 0:
+                    print(blocks[0], "; max memory = ", auto_tuner.get_max() // 1024 ** 2, "MB")
+                else:
+                    print(blocks[0], "; {} out of memory retries".format(oom_count))
+            dataloader.modify_max_node(nxt_max_node)
+            dataloader.modify_max_edge(nxt_max_edge)
+            tuner_stats["batches"] += 1
+            tuner_stats["break_peaks"] += oom_count > 0
+            tuner_stats["edges"] += blocks[0].num_edges()
+            edge_ratios.append(blocks[0].num_edges() / max(blocks[0].num_dst_nodes(), 1))
+            if nxt_max_edge != max_edge:
+                step = 1 if nxt_max_edge > max_edge else -1
+                tuner_stats["reversals"] += direction != 0 and step != direction
+                direction = step
+            max_edge = nxt_max_edge
 
-                output_vals = func(*new_args)
-                del new_args
-                profiler.tag()
-                if self._debug:
-                    print(blocks[0], "; max memory = ", torch.cuda.max_memory_allocated() // 1024 ** 2, "MB")
-
-                rets = update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks)
-                del output_vals
-                profiler.tag()
-
-                auto_tuner.set_max()
-                nxt_max_node, nxt_max_edge = auto_tuner.search(blocks[0])
-                memorys.append(torch.cuda.max_memory_allocated() // 1024 ** 2)
-                nodes.append(output_nodes.shape[0])
-                max_memory = max(torch.cuda.max_memory_allocated() // 1024 ** 2, max_memory)
-                # pbar.update(output_nodes.shape[0])
+        tuner_stats["time"] = time.perf_counter() - st
+        tuner_stats["edges_per_second"] = tuner_stats["edges"] / max(tuner_stats["time"], 1e-9)
+        edge_ratios = torch.tensor(edge_ratios, dtype=torch.float64)
+        tuner_stats["edge_ratio_cv"] = float(edge_ratios.std() / edge_ratios.mean()) if len(edge_ratios) > 1 else 0.
+        self.tuner_stats[layer.id] = tuner_stats
 
-            except Exception as e:
-                print(e)
-                profiler.tag()
-                nxt_max_node, nxt_max_edge = auto_tuner.break_peak(blocks[0])
-                dataloader.reset_batch_node(output_nodes.shape[0])
-                gc.collect()
+        if self._use_uva and not self.is_hetero:
+            self._data_manager.unpin_data_inplace(layer)
+        self._update_alloc_stats(alloc_start)
+        # the next layer gathers other inputs
+        self._staging.clear()
 
-            finally:
-                dataloader.modify_max_node(nxt_max_node)
-                dataloader.modify_max_edge(nxt_max_edge)
-                torch.cuda.empty_cache()
-                torch.cuda.reset_peak_memory_stats()
-                profiler.record_and_reset()
+        if self._tuning_cache is not None and auto_tuner.budget is not None:
+            self._tuning_cache.put(self._cache_key, layer.id, *auto_tuner.budget, auto_tuner.memory_model,
+                                   budget=self._cache_budget)
+            self._tuning_cache.save()
 
-        if self._use_uva:
-            self._data_manager.unpin_data_inplace(layer)
+        if self.hub_stats["hubs"] > 0 and self._debug:
+            print("layer {}: {} hub nodes with {} in-edges in {:.2f}s.".format(
+                layer.id, self.hub_stats["hubs"], self.hub_stats["hub_edges"], self.hub_stats["hub_time"]))
+        if self.oom_stats["retries"] > 0 and self._debug:
+            print("layer {}: {} out of memory retries, wasted {:.2f}s on {} dst nodes and {} edges.".format(
+                layer.id, self.oom_stats["retries"], self.oom_stats["wasted_time"],
+                self.oom_stats["wasted_nodes"], self.oom_stats["wasted_edges"]))
+        if self._debug:
+            print("predicted peak memory: ", int(self._plan[layer.id]["peak_memory"]) // 1024 ** 2, "MB")
+            print("maximum memory allocated: ", max_memory // 1024 ** 2, "MB")
+            print("allocations: ", self.alloc_stats)
+            if auto_tuner.memory_model.fitted:
+                print("memory model (src, dst, edges, const): ", auto_tuner.memory_model.coef)
+        return rets
+
+
+class ThroughputInferenceHelper(InferenceHelperBase):
+    """Batches under an edge budget hill-climbed on the measured edges per second, see ``ThroughputTuner``.
+
+    On CPU the best batch is set by the caches and the thread scaling rather than by the memory, which is
+    only a ceiling here. Every layer tunes over its first ``tune_fraction`` of the edges, starting from the
+    budget of the layer before it, then keeps the best budget; with a ``tuning_cache`` a later run of the
+    same model, graph and machine starts locked to the cached budget, unless the peak memory it was measured
+    at no longer fits under the memory ceiling.
+    """
+    def __init__(self, module: nn.Module, device, use_uva = False, start_max_edge = 100000, memory_rate = 0.9,
+                 tune_fraction = 0.25, tuning_cache = None, debug = False, profile = False, graph_meta = None):
+        super().__init__(module, device, use_uva, debug, profile, graph_meta)
+        self.start_max_edge = start_max_edge
+        self.memory_rate = memory_rate
+        self.tune_fraction = tune_fraction
+        # None / False: disabled; True: the default path; str: a cache file; or a TuningCache.
+        if tuning_cache is True:
+            tuning_cache = TuningCache()
+        elif isinstance(tuning_cache, str):
+            tuning_cache = TuningCache(tuning_cache)
+        self._tuning_cache = tuning_cache or None
+        self._cache_key = None
+        self._memory = None
+        self._max_edge = None
+        self.throughput_stats = {}
+
+    def before_inference(self, graph, *args):
+        self._memory = get_auto_tuner(self._device)
+        self._memory.set_free(self.memory_rate)
+        self._max_edge = self.start_max_edge
+        self.throughput_stats = {}
+        if self._tuning_cache is not None:
+            graph_stats = get_graph_stats(graph) if not self.is_hetero else \
+                {"num_nodes": graph.number_of_nodes(), "num_edges": graph.number_of_edges(), "meta": self._graph_meta}
+            graph_stats["tuner"] = "throughput"
+            if not self.is_hetero and graph.number_of_edges() > 0:
+                # the node order changes the cache behaviour, a reordered graph gets budgets of its own
+                u, v = graph.find_edges(torch.arange(0, graph.number_of_edges(),
+                                                     max(graph.number_of_edges() // 4096, 1)).to(graph.device, graph.idtype))
+                graph_stats["locality"] = int(np.log2(float((u - v).abs().double().mean()) + 1))
+            if self.batch_order is not None:
+                graph_stats["batch_order"] = self.batch_order
+            self._cache_key = TuningCache.make_key(
+                self._function_generator.get_fingerprint(),
+                graph_stats,
+                [tuple(arg.shape[1:]) for arg in args if isinstance(arg, torch.Tensor)],
+                # the throughput depends on the threads the kernels run on
+                "{}:threads={}".format(get_device_profile(self._device), torch.get_num_threads()))
 
-        # pbar.close()
-        print(memorys)
-        print(nodes)
-        profiler.show()
-        print("maximum memory allocated: ", max_memory)
+    def compute(self, graph, rets, layer, func):
+        memory = self._memory
+        # the outputs of the layer are allocated
+        memory.set_free(self.memory_rate)
+        cached = self._tuning_cache.get(self._cache_key, layer.id) if self._tuning_cache is not None else None
+        if cached is not None and cached.get("peak_memory", 0) > memory.free_memory:
+            # the budget was measured with more free memory than there is now
+            cached = None
+        tuner = ThroughputTuner(self._max_edge, memory.free_memory)
+        if cached is not None:
+            tuner.lock(cached["max_edge"])
+
+        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+        if self.is_hetero:
+            dataloader = HeteroDataloader(graph, self._node_ids(graph), sampler, graph.number_of_nodes(),
+                                          tuner.budget, device=self._device)
+        else:
+            nids = self._batch_node_ids(graph)
+            if self._use_uva:
+                nids = nids.to(self._device)
+                self._data_manager.pin_data_inplace(layer)
+            dataloader = CustomDataloader(graph, nids, sampler, graph.number_of_nodes(), tuner.budget,
+                                          device=self._device, use_uva=self._use_uva, shuffle=False)
+
+        # the edges of the part of the layer the budget is tuned on
+        tune_edges = self.tune_fraction * graph.number_of_edges()
+        edges = 0
+        st = time.perf_counter()
+        for input_nodes, output_nodes, blocks in self.profiler.batches(dataloader):
+            memory.reset_peak()
+            rets = self.run_batch(layer, func, rets, input_nodes, output_nodes, blocks)
+            # the time since the last batch, so the sampling of a batch is part of its cost
+            now = time.perf_counter()
+            edges += blocks[0].num_edges()
+            if not tuner.locked and edges >= tune_edges:
+                tuner.lock()
+            with self.profiler.span("tune"):
+                dataloader.modify_max_edge(tuner.observe(blocks[0].num_edges(), now - st, memory.peak_memory()))
+            st = time.perf_counter()
+
+        if self._use_uva and not self.is_hetero:
+            self._data_manager.unpin_data_inplace(layer)
+        self.throughput_stats[layer.id] = tuner.summary()
+        self.throughput_stats[layer.id]["cached"] = cached is not None
+        if tuner.best_edge is not None:
+            self._max_edge = tuner.best_edge
+            if self._tuning_cache is not None and cached is None:
+                self._tuning_cache.put(self._cache_key, layer.id, graph.number_of_nodes(), tuner.best_edge,
+                                       edges_per_second=tuner.best_rate, peak_memory=tuner.best_peak)
+                self._tuning_cache.save()
+        if self._debug:
+            print("layer {}: edge budget {} at {:.0f} edges/s, tried {}.".format(
+                layer.id, tuner.budget, tuner.best_rate, [budget for budget, _ in tuner.history]))
         return rets
@@ -1,38 +1,191 @@
-import torch
+import json
+import os
 import time
 
+import torch
+
+from .utils import get_tensors_bytes
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.profiler.sync()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.sync()
+        self.profiler.record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class _LayerSpan(_Span):
+    def __enter__(self):
+        self.profiler.curr_layer = self.args["layer"]
+        self.profiler.curr_batch = -1
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        self.profiler.curr_layer = None
+        self.profiler.curr_batch = None
+        return False
+
+
 class Profiler:
-    def __init__(self):
-        self.time = []
-        self.curr = []
-        self.m = {}
-
-    def tag(self):
-        torch.cuda.synchronize()
-        self.curr.append(time.time())
-    
-    def record_and_reset(self):
-        self.tag()
-        for i in range(0, len(self.curr) - 1):
-            if len(self.time) <= i:
-                self.time.append(0)
-            self.time[i] += self.curr[i + 1] - self.curr[i]
-        self.curr = []
-        self.tag()
-
-    def record_name(self, name, val):
-        if name not in self.m:
-            self.m[name] = val
-        else:
-            self.m[name] += val
-
-    def last(self):
-        return self.curr[-1] - self.curr[-2]
+    """Span based profiler.
+
+    Phases (sample, gather, compute, write-back, tune, gc, ...) are recorded as named spans of the
+    current layer and batch, counters (input nodes, edges, bytes moved, ...) are accumulated per layer.
+    Results can be exported as a Chrome trace (chrome://tracing, Perfetto) or aggregated by ``summary``.
+    When disabled every call returns immediately.
+    """
+    def __init__(self, device=None, enabled=True):
+        self.enabled = enabled
+        self.device = torch.device(device) if device is not None else torch.device('cpu')
+        self.origin = time.perf_counter()
+        self.curr_layer = None
+        self.curr_batch = None
+        self.events = []
+        self.phases = {}
+        self.layers = {}
+        self.counters = {}
+
+    def sync(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        args["layer"] = self.curr_layer
+        args["batch"] = self.curr_batch
+        return _Span(self, name, args)
+
+    def layer(self, layer_id):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _LayerSpan(self, "layer", {"layer": layer_id, "batch": None})
+
+    def batches(self, dataloader, name="sample"):
+        """Iterate over the dataloader, recording each fetch as a span and advancing the batch id."""
+        if not self.enabled:
+            yield from dataloader
+            return
+        if self.curr_batch is None:
+            self.curr_batch = -1
+        it = iter(dataloader)
+        while True:
+            self.curr_batch += 1
+            with self.span(name):
+                try:
+                    batch = next(it)
+                except StopIteration:
+                    return
+            yield batch
+
+    def record(self, name, start, end, args):
+        dur = end - start
+        phase = self.phases.setdefault(name, [0., 0])
+        phase[0] += dur
+        phase[1] += 1
+        if args["layer"] is not None and name != "layer":
+            layer = self._layer_stat(args["layer"])
+            phase = layer["phases"].setdefault(name, [0., 0])
+            phase[0] += dur
+            phase[1] += 1
+        elif name == "layer":
+            self._layer_stat(args["layer"])["time"] += dur
+        self.events.append({
+            "name": name,
+            "cat": "layer" if args["layer"] is None else "layer{}".format(args["layer"]),
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": dur * 1e6,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": {k: v for k, v in args.items() if v is not None},
+        })
+
+    def count(self, name, val):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + val
+        if self.curr_layer is not None:
+            counters = self._layer_stat(self.curr_layer)["counters"]
+            counters[name] = counters.get(name, 0) + val
+        self.events.append({
+            "name": name,
+            "ph": "C",
+            "ts": (time.perf_counter() - self.origin) * 1e6,
+            "pid": os.getpid(),
+            "args": {name: self.counters[name]},
+        })
+
+    def count_bytes(self, name, vals):
+        if not self.enabled:
+            return
+        self.count(name, get_tensors_bytes(vals))
+
+    def _layer_stat(self, layer_id):
+        if layer_id not in self.layers:
+            self.layers[layer_id] = {"time": 0., "phases": {}, "counters": {}}
+        return self.layers[layer_id]
+
+    def summary(self):
+        def phases_dict(phases):
+            return {name: {"time": t, "count": c} for name, (t, c) in phases.items()}
+        return {
+            "phases": phases_dict(self.phases),
+            "counters": dict(self.counters),
+            "layers": {
+                layer_id: {
+                    "time": stat["time"],
+                    "phases": phases_dict(stat["phases"]),
+                    "counters": dict(stat["counters"]),
+                } for layer_id, stat in sorted(self.layers.items())
+            },
+        }
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def reset(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.phases = {}
+        self.layers = {}
+        self.counters = {}
 
     def show(self):
-        for t in self.time:
-            print(t, end=" ")
-        tot = sum(self.time)
-        print("\ntot time:", tot)
-        for k, v in self.m.items():
-            print(k, v)
+        if not self.enabled:
+            return
+        summary = self.summary()
+        for layer_id, stat in summary["layers"].items():
+            print("layer {}: {:.4f}s".format(layer_id, stat["time"]))
+            for name, phase in stat["phases"].items():
+                print("    {}: {:.4f}s, {} calls".format(name, phase["time"], phase["count"]))
+            for name, val in stat["counters"].items():
+                print("    {}: {}".format(name, val))
+        print("total:")
+        for name, phase in summary["phases"].items():
+            print("    {}: {:.4f}s, {} calls".format(name, phase["time"], phase["count"]))
+        for name, val in summary["counters"].items():
+            print("    {}: {}".format(name, val))
@@ -18,6 +18,11 @@ class Schema():
                 for node in args:
                     self.last_layer_output.append(node.name)
 
+    def reset_layers(self):
+        self.layers = []
+        self.name2arg_map = {}
+        self.blocks_name = None
+
     def create_layer(self, graph):
         self.layers.append(GraphLayer(self))
         if len(self.layers) != 1:
@@ -91,6 +96,10 @@ class ArgNode():
         self.name = name
         self.input_layers = []
         self.output_layer = output_layer
+        # the node type of the rows of a heterograph's tensor, None for a homogeneous graph
+        self.ntype = None
+        # a tensor of the edges, gathered by the dgl.EID of every block
+        self.edge_indexed = False
 
     def add_layer(self, layer: GraphLayer):
         self.input_layers.append(layer)
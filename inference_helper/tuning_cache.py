@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import platform
+
+import torch
+
+# A cached entry is used while the memory budget is within this rate of the one it was tuned under, so the
+# free memory, which moves between runs, is not part of the key.
+BUDGET_TOLERANCE = 0.25
+
+
+def get_default_cache_path():
+    cache_dir = os.environ.get("INFERENCE_HELPER_CACHE_DIR",
+                               os.path.join(os.path.expanduser("~"), ".cache", "inference_helper"))
+    return os.path.join(cache_dir, "tuning.json")
+
+
+def get_device_profile(device):
+    device = torch.device(device)
+    if device.type == 'cuda':
+        props = torch.cuda.get_device_properties(device)
+        return "cuda:{}:{}".format(props.name, props.total_memory)
+    return "{}:{}:{}".format(device.type, platform.processor() or platform.machine(), os.cpu_count())
+
+
+def get_graph_stats(graph, in_degrees=None):
+    if in_degrees is None:
+        in_degrees = graph.in_degrees()
+    return {
+        "num_nodes": graph.number_of_nodes(),
+        "num_edges": graph.number_of_edges(),
+        "max_in_degree": int(in_degrees.max()) if in_degrees.shape[0] > 0 else 0,
+    }
+
+
+class TuningCache:
+    """Small on-disk json cache of the auto-tuner's per-layer results.
+
+    Each entry stores the final (max_node, max_edge) of a layer and the samples of its memory model, or the
+    edges per second of a throughput-tuned budget, keyed by plan fingerprint, graph statistics, input shapes
+    and device profile. The memory budget of the run is stored with the entry and checked on ``get``.
+    """
+    def __init__(self, path=None):
+        self.path = get_default_cache_path() if path is None else path
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def make_key(fingerprint, graph_stats, input_shapes, device_profile):
+        key = {
+            "plan": fingerprint,
+            "graph": graph_stats,
+            "inputs": [list(shape) for shape in input_shapes],
+            "device": device_profile,
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key, layer_id, budget=None):
+        """The entry of a layer, if it was tuned under a memory budget within ``BUDGET_TOLERANCE`` of ``budget``."""
+        entry = self.entries.get(key, {}).get(str(layer_id))
+        if entry is None or budget is None or entry.get("budget") is None:
+            return entry
+        if abs(budget - entry["budget"]) > BUDGET_TOLERANCE * entry["budget"]:
+            return None
+        return entry
+
+    def put(self, key, layer_id, max_node, max_edge, memory_model=None, edges_per_second=None, budget=None,
+            peak_memory=None):
+        entry = {
+            "max_node": int(max_node),
+            "max_edge": int(max_edge),
+            "memory_model": None if memory_model is None else memory_model.state_dict(),
+            "budget": None if budget is None else float(budget),
+        }
+        if edges_per_second is not None:
+            entry["edges_per_second"] = float(edges_per_second)
+        if peak_memory is not None:
+            entry["peak_memory"] = float(peak_memory)
+        self.entries.setdefault(key, {})[str(layer_id)] = entry
+
+    def save(self):
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
@@ -1,9 +1,34 @@
+import math
+
 from torch.fx import Node
 
 import torch
-from dgl import DGLHeteroGraph
+import dgl
+from dgl import DGLHeteroGraph, DGLError
 from dgl.utils import gather_pinned_tensor_rows
 
+# batch shapes are rounded to the steps of this geometric ladder, which bounds the number of shape classes.
+BUCKET_GROWTH = 1.5
+MIN_BUCKET = 64
+
+def get_bucket(n, growth=BUCKET_GROWTH, min_bucket=MIN_BUCKET):
+    # the smallest step of the ladder not less than n
+    if n <= 0:
+        return 0
+    bucket = min_bucket
+    while bucket < n:
+        bucket = int(math.ceil(bucket * growth))
+    return bucket
+
+def get_bucket_floor(n, growth=BUCKET_GROWTH, min_bucket=MIN_BUCKET):
+    # the largest step of the ladder not greater than n, small sizes are kept.
+    if n <= min_bucket:
+        return n
+    bucket = min_bucket
+    while int(math.ceil(bucket * growth)) <= n:
+        bucket = int(math.ceil(bucket * growth))
+    return bucket
+
 def arg_trace(a):
     ret = set()
     if isinstance(a, Node):
@@ -19,11 +44,66 @@ def arg_trace(a):
     return ret
 
 
-def get_new_arg_input(inputs, data_map, input_nodes, inference_graph, device, use_uva=False):
+def get_hetero_arg_input(inputs, data_map, input_nodes, inference_graph, device):
+    # the values of a heterograph are a tensor of one node type (arg_node.ntype) or a dict of them.
     new_args = ()
     for arg_node in inputs:
-        if isinstance(data_map[arg_node], torch.Tensor):
-            if data_map[arg_node].device == device:
+        val = data_map[arg_node]
+        if isinstance(val, torch.Tensor):
+            if arg_node.edge_indexed:
+                raise RuntimeError("Edge features of a heterograph are not supported: {}.".format(arg_node.name))
+            if getattr(arg_node, "ntype", None) is None:
+                raise RuntimeError("Can't batch {} without its node type.".format(arg_node.name))
+            new_args += (val[input_nodes[arg_node.ntype].to(val.device)].to(device),)
+        elif isinstance(val, dict) and all(isinstance(v, torch.Tensor) for v in val.values()):
+            new_args += ({ntype: v[input_nodes[ntype].to(v.device)].to(device) if ntype in input_nodes else v[:0]
+                          for ntype, v in val.items()},)
+        elif isinstance(val, DGLHeteroGraph):
+            new_args += (inference_graph.to(device),)
+        elif hasattr(val, "to"):
+            new_args += (val.to(device),)
+        else:
+            new_args += (val,)
+    return new_args
+
+def is_mmap_tensor(val):
+    storage = val.untyped_storage() if hasattr(val, "untyped_storage") else val.storage()
+    return getattr(storage, "filename", None) is not None
+
+def gather_edge_rows(val, eids, device, use_uva=False, staging=None, arg_node=None):
+    """Rows of an edge-indexed tensor for the edges ``eids`` of a block.
+
+    The rows of a file-backed table are read in the order of the edge IDs, so the pages are read
+    sequentially, and put back in the order of the block.
+    """
+    if is_mmap_tensor(val):
+        order = torch.argsort(eids)
+        rows = val[eids[order].to(val.device)].to(device)
+        ret = torch.empty_like(rows)
+        ret[order.to(device)] = rows
+        return ret
+    if val.device == device and staging is not None:
+        return staging.gather(arg_node, val, eids)
+    if val.device == device:
+        return val[eids.to(device)]
+    if use_uva:
+        return gather_pinned_tensor_rows(val, eids.to(device))
+    return val[eids.to(val.device)].to(device)
+
+def get_new_arg_input(inputs, data_map, input_nodes, inference_graph, device, use_uva=False, staging=None):
+    if isinstance(input_nodes, dict):
+        return get_hetero_arg_input(inputs, data_map, input_nodes, inference_graph, device)
+    new_args = ()
+    for arg_node in inputs:
+        if isinstance(data_map[arg_node], torch.Tensor) and arg_node.edge_indexed:
+            if dgl.EID not in inference_graph.edata:
+                raise RuntimeError("Can't gather {} without the edge IDs of the block.".format(arg_node.name))
+            new_args += (gather_edge_rows(data_map[arg_node], inference_graph.edata[dgl.EID], device, use_uva,
+                                          staging, arg_node),)
+        elif isinstance(data_map[arg_node], torch.Tensor):
+            if data_map[arg_node].device == device and staging is not None:
+                new_args += (staging.gather(arg_node, data_map[arg_node], input_nodes),)
+            elif data_map[arg_node].device == device:
                 new_args += (data_map[arg_node][input_nodes],)
             elif use_uva:
                 new_args += (gather_pinned_tensor_rows(data_map[arg_node], input_nodes),)
@@ -37,9 +117,94 @@ def get_new_arg_input(inputs, data_map, input_nodes, inference_graph, device, us
             new_args += (data_map[arg_node],)
     return new_args
 
-def update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks):
+def get_chain_edges(graph, seeds, num_layers, in_degrees, limit=None):
+    # edges of the blocks of MultiLayerFullNeighborSampler(num_layers) for seeds, counted up to limit
+    frontier = seeds
+    total = 0
+    for i in range(num_layers):
+        total += int(in_degrees[frontier].sum())
+        if (limit is not None and total > limit) or i == num_layers - 1:
+            break
+        u, _ = graph.in_edges(frontier)
+        frontier = torch.unique(torch.cat([frontier, u.to(frontier.dtype)]))
+    return total
+
+def get_in_frontier(graph, nids):
+    # nids and their in-neighbors
+    u, _ = graph.in_edges(nids)
+    return torch.unique(torch.cat([nids, u.to(nids.dtype)]))
+
+def is_oom_error(e):
+    if isinstance(e, MemoryError):
+        return True
+    oom_error = getattr(torch.cuda, "OutOfMemoryError", None)
+    if oom_error is not None and isinstance(e, oom_error):
+        return True
+    if isinstance(e, (RuntimeError, DGLError)):
+        msg = str(e)
+        return "out of memory" in msg or "can't allocate memory" in msg
+    return False
+
+def split_block(block, input_nodes, output_nodes, start, end):
+    """Slice the dst nodes [start, end) out of a sampled block without sampling again.
+
+    The dst nodes stay the prefix of the src nodes, as in the blocks made by the sampler.
+    """
+    device = block.device
+    dst = torch.arange(start, end, dtype=block.idtype, device=device)
+    eids = block.in_edges(dst, form='eid')
+    u, v = block.find_edges(eids)
+    extra = torch.unique(u[(u < start) | (u >= end)])
+    src = torch.cat([dst, extra])
+    mapping = torch.empty(block.num_src_nodes(), dtype=block.idtype, device=device)
+    mapping[src.long()] = torch.arange(src.shape[0], dtype=block.idtype, device=device)
+    sub_block = dgl.create_block((mapping[u.long()], v - start), num_src_nodes=src.shape[0],
+        num_dst_nodes=end - start, idtype=block.idtype, device=device)
+    if dgl.EID in block.edata:
+        sub_block.edata[dgl.EID] = block.edata[dgl.EID][eids.long()]
+    src = src.long().to(input_nodes.device)
+    return input_nodes[src], output_nodes[start:end], sub_block
+
+def get_edge_balanced_split(block, start, end):
+    # the dst index in (start, end) which splits the in-edges of [start, end) in half.
+    in_degrees = block.in_degrees(torch.arange(start, end, dtype=block.idtype, device=block.device))
+    prefix_sum = torch.cumsum(in_degrees, 0)
+    mid = int(torch.searchsorted(prefix_sum, prefix_sum[-1] // 2)) + 1
+    return min(max(start + mid, start + 1), end - 1)
+
+def get_tensors_bytes(vals):
+    if isinstance(vals, torch.Tensor):
+        vals = (vals,)
+    tot = 0
+    for val in vals:
+        if isinstance(val, torch.Tensor):
+            tot += val.element_size() * val.nelement()
+    return tot
+
+def update_hetero_ret_output(output_vals, rets, input_nodes, output_nodes, block, ntypes):
+    for j, (output_val, ret) in enumerate(zip(output_vals, rets)):
+        if isinstance(output_val, torch.Tensor):
+            if ntypes is None or ntypes[j] is None:
+                raise RuntimeError("Can't determine return's node type.")
+            output_val, ret = {ntypes[j]: output_val}, {ntypes[j]: ret}
+        elif not isinstance(output_val, dict):
+            continue
+        for ntype, val in output_val.items():
+            if not isinstance(val, torch.Tensor) or val.shape[0] == 0:
+                continue
+            if val.shape[0] == block.num_dst_nodes(ntype):
+                update_out_in_chunks(ret[ntype], output_nodes[ntype], val)
+            elif val.shape[0] == block.num_src_nodes(ntype):
+                update_out_in_chunks(ret[ntype], input_nodes[ntype], val)
+            else:
+                raise RuntimeError("Can't determine return's type.")
+    return rets
+
+def update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks, ntypes=None):
     if not isinstance(output_vals, tuple):
         output_vals = (output_vals,)
+    if isinstance(output_nodes, dict):
+        return update_hetero_ret_output(output_vals, rets, input_nodes, output_nodes, blocks[0], ntypes)
     for output_val, ret in zip(output_vals, rets):
         if isinstance(output_val, torch.Tensor):
             if ret is None:
@@ -54,6 +219,31 @@ def update_ret_output(output_vals, rets, input_nodes, output_nodes, blocks):
             ret = output_val
     return rets
 
+def _read_proc_bytes(path, key):
+    with open(path) as f:
+        for line in f:
+            if line.startswith(key):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("Can't find {} in {}.".format(key, path))
+
+def get_rss():
+    return _read_proc_bytes("/proc/self/status", "VmRSS:")
+
+def get_peak_rss():
+    return _read_proc_bytes("/proc/self/status", "VmHWM:")
+
+def reset_peak_rss():
+    # Writing "5" to clear_refs resets VmHWM to the current RSS (Linux >= 4.0).
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def get_available_memory():
+    return _read_proc_bytes("/proc/meminfo", "MemAvailable:")
+
 def update_out_in_chunks(ret, idx, val):
     memory_comsuption = 4 # float, TODO
     for dim in range(1, len(val.shape)):
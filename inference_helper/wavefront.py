@@ -0,0 +1,57 @@
+import dgl
+import torch
+
+
+def reorder_banded(graph):
+    """Reorder the nodes of a graph by reverse Cuthill-McKee, which bounds the id distance of its edges.
+
+    Return ``(new_graph, perm)``: node ``i`` of ``new_graph`` is node ``perm[i]`` of ``graph``, so its
+    features are ``feat[perm]``, and the outputs are put back by ``out[perm] = new_out``.
+    """
+    new_graph = dgl.reorder_graph(graph, node_permute_algo='rcmk', edge_permute_algo='dst', store_ids=True)
+    perm = new_graph.ndata.pop(dgl.NID)
+    new_graph.edata.pop(dgl.EID)
+    return new_graph, perm
+
+
+def get_band_windows(graph, range_size):
+    """The in-neighbor window of every range of ``range_size`` dst nodes.
+
+    Return ``(lo, hi, bandwidth)``: the in-edges into range ``r`` come from the ranges ``lo[r]`` to ``hi[r]``,
+    ``bandwidth`` is the largest id distance of an edge. A range without in-edges depends on itself only.
+    """
+    num_nodes = graph.num_nodes()
+    num_ranges = (num_nodes + range_size - 1) // range_size
+    u, v = graph.edges()
+    u, v = u.long(), v.long()
+    dst_range = v // range_size
+    ranges = torch.arange(num_ranges)
+    lo = ranges.scatter_reduce(0, dst_range, u // range_size, "amin", include_self=True)
+    hi = ranges.scatter_reduce(0, dst_range, u // range_size, "amax", include_self=True)
+    bandwidth = int((u - v).abs().max()) if u.shape[0] > 0 else 0
+    return lo, hi, bandwidth
+
+
+class ResidencyWindow():
+    """The rows of an intermediate output that later ranges still read, kept as one tensor per range.
+
+    A range is added when its layer finishes it and dropped once no pending range of the next layer has it
+    in its window, so at most the band of the graph is resident instead of a row per node.
+    """
+    def __init__(self, range_size):
+        self.range_size = range_size
+        self.ranges = {}
+        self.peak_rows = 0
+
+    def add(self, index, val):
+        self.ranges[index] = val
+        self.peak_rows = max(self.peak_rows, sum(val.shape[0] for val in self.ranges.values()))
+
+    def release_before(self, index):
+        for key in [key for key in self.ranges if key < index]:
+            del self.ranges[key]
+
+    def gather(self, nids, lo, hi):
+        # the rows of nids, which lie in the ranges lo to hi
+        window = torch.cat([self.ranges[index] for index in range(lo, hi + 1)])
+        return window[nids.long() - lo * self.range_size]
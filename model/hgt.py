@@ -65,7 +65,7 @@ class HGTLayer(nn.Module):
 
                 k = k_linear(h[srctype]).view(-1, self.n_heads, self.d_k)
                 v = v_linear(h[srctype]).view(-1, self.n_heads, self.d_k)
-                q = q_linear(h[dsttype]).view(-1, self.n_heads, self.d_k)
+                q = q_linear(h[dsttype][:G.num_dst_nodes(dsttype)]).view(-1, self.n_heads, self.d_k)
 
                 e_id = self.edge_dict[etype]
 
@@ -90,16 +90,16 @@ class HGTLayer(nn.Module):
                                 for etype, e_id in edge_dict.items()}, cross_reducer = 'mean')
 
             new_h = {}
-            for ntype in G.ntypes:
+            for ntype in G.dsttypes:
                 '''
                     Step 3: Target-specific Aggregation
                     x = norm( W[node_type] * gelu( Agg(x) ) + x )
                 '''
                 n_id = node_dict[ntype]
                 alpha = torch.sigmoid(self.skip[n_id])
-                t = G.nodes[ntype].data['t'].view(-1, self.out_dim)
+                t = G.dstnodes[ntype].data['t'].view(-1, self.out_dim)
                 trans_out = self.drop(self.a_linears[n_id](t))
-                trans_out = trans_out * alpha + h[ntype] * (1-alpha)
+                trans_out = trans_out * alpha + h[ntype][:G.num_dst_nodes(ntype)] * (1-alpha)
                 if self.use_norm:
                     new_h[ntype] = self.norms[n_id](trans_out)
                 else:
@@ -21,7 +21,7 @@ class HeteroRGCNLayer(nn.Module):
             # Compute W_r * h
             Wh = self.weight[etype](feat_dict[srctype])
             # Save it in graph for message passing
-            G.nodes[srctype].data['Wh_%s' % etype] = Wh
+            G.srcnodes[srctype].data['Wh_%s' % etype] = Wh
             # Specify per-relation message passing functions: (message_func, reduce_func).
             # Note that the results are saved to the same destination feature 'h', which
             # hints the type wise reducer for aggregation.
@@ -31,8 +31,8 @@ class HeteroRGCNLayer(nn.Module):
         # The second one is the type wise reducer, could be "sum", "max",
         # "min", "mean", "stack"
         G.multi_update_all(funcs, 'sum')
-        # return the updated node feature dictionary
-        return {ntype : G.nodes[ntype].data['h'] for ntype in G.ntypes}
+        # return the updated node feature dictionary, of the dst nodes if G is a block
+        return {ntype : G.dstnodes[ntype].data['h'] for ntype in G.dsttypes}
 
 
 class HeteroRGCN(nn.Module):
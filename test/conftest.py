@@ -0,0 +1,55 @@
+import dgl
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class TwoLayerGCN(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.GraphConv(in_feats, hidden)
+        self.conv2 = dgl.nn.GraphConv(hidden, out_feats)
+
+    def forward(self, blocks, x):
+        x = F.relu(self.conv1(blocks[0], x))
+        return self.conv2(blocks[1], x)
+
+
+class TwoLayerSAGE(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.SAGEConv(in_feats, hidden, 'mean')
+        self.conv2 = dgl.nn.SAGEConv(hidden, out_feats, 'mean')
+
+    def forward(self, blocks, x):
+        x = F.relu(self.conv1(blocks[0], x))
+        return self.conv2(blocks[1], x)
+
+
+@pytest.fixture
+def make_gcn():
+    return TwoLayerGCN
+
+
+@pytest.fixture
+def make_sage():
+    return TwoLayerSAGE
+
+
+@pytest.fixture
+def random_graph():
+    # a seeded graph with self loops, and 16 features per node
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(3000, 30000))
+    return g, torch.rand(3000, 16)
+
+
+@pytest.fixture
+def gcn(random_graph):
+    # a TwoLayerGCN and its outputs on random_graph
+    g, feat = random_graph
+    model = TwoLayerGCN(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g], feat)
+    return model, expected
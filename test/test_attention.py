@@ -0,0 +1,42 @@
+import dgl
+import torch
+import torch.nn as nn
+
+from inference_helper import AutoInferenceHelper
+from inference_helper.attention import StreamingGATConv
+
+
+def test_streaming_gat_conv_matches():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 20000))
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    input_nodes, output_nodes, blocks = sampler.sample_blocks(g, torch.arange(0, 300))
+    feat = torch.randn(input_nodes.shape[0], 16)
+    conv = dgl.nn.GATConv(16, 8, 4, residual=True, activation=torch.relu).eval()
+    with torch.no_grad():
+        expected = conv(blocks[0], feat)
+        pred = StreamingGATConv(conv, chunk_edges=500)(blocks[0], feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class TwoLayerGAT(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats, heads):
+        super().__init__()
+        self.conv1 = dgl.nn.GATConv(in_feats, hidden, heads, allow_zero_in_degree=True)
+        self.conv2 = dgl.nn.GATConv(hidden * heads, out_feats, 1, allow_zero_in_degree=True)
+
+    def forward(self, blocks, x):
+        x = self.conv1(blocks[0], x).flatten(1)
+        return self.conv2(blocks[1], x).mean(1)
+
+
+def test_auto_helper_streaming_attention(random_graph):
+    g, feat = random_graph
+    model = TwoLayerGAT(16, 8, 4, 2).eval()
+    with torch.no_grad():
+        expected = model([g, g], feat)
+        helper = AutoInferenceHelper(model, torch.device('cpu'), use_uva=False, free_rate=0.9, use_random=False)
+        assert len(helper._function_generator.streaming) == 2
+        helper.attention_chunk_edges = 1000
+        pred = helper.inference(g, feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
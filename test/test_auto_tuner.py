@@ -0,0 +1,122 @@
+import numpy as np
+import torch
+
+from inference_helper import AutoInferenceHelper
+from inference_helper.auto_tuner import MemoryModel, CPUAutoTuner, ThroughputTuner
+
+
+class FakeBlock:
+    def __init__(self, src, dst, edges):
+        self.src, self.dst, self.edges = src, dst, edges
+
+    def number_of_src_nodes(self):
+        return self.src
+
+    def number_of_dst_nodes(self):
+        return self.dst
+
+    def num_edges(self):
+        return self.edges
+
+
+class FakePlanner:
+    def __init__(self, total, degree):
+        self.total, self.degree = total, degree
+
+    def total_nodes(self):
+        return self.total
+
+    def remaining_nodes(self):
+        return self.total
+
+    def next_batch_edges(self, node_count):
+        return node_count * self.degree
+
+
+def memory_of(src, dst, edges):
+    return 400 * src + 100 * dst + 50 * edges + 10000
+
+
+def test_memory_model_fit():
+    model = MemoryModel()
+    for src, dst, edges in [(900, 100, 1000), (1500, 200, 3000), (1800, 400, 5000), (6000, 800, 12000),
+                            (7000, 1600, 20000)]:
+        model.update(src, dst, edges, memory_of(src, dst, edges))
+    assert model.fit()
+    assert abs(model.predict(5000, 3000, 60000) - memory_of(5000, 3000, 60000)) < 1e-3 * memory_of(5000, 3000, 60000)
+
+
+def test_tuner_plan_fits_budget():
+    tuner = CPUAutoTuner(calibration_batches=4)
+    tuner.free_memory = 50 * 1024 ** 2
+    planner = FakePlanner(10 ** 7, 10)
+    for dst in (100, 300, 700, 1500):
+        edges = dst * 10
+        src = dst + edges // 2
+        tuner.maxs = [memory_of(src, dst, edges)]
+        nxt_node, nxt_edge = tuner.search(FakeBlock(src, dst, edges), planner)
+    assert tuner.memory_model.fitted
+    nxt_src = nxt_node + nxt_node * 10 // 2
+    assert memory_of(nxt_src, nxt_node, nxt_node * 10) <= tuner.free_memory * 1.01
+    bigger = nxt_node * 11 // 10
+    assert memory_of(bigger + bigger * 5, bigger, bigger * 10) > tuner.free_memory
+
+
+def test_tuner_carry_over():
+    tuner = CPUAutoTuner(calibration_batches=4)
+    tuner.free_memory = 50 * 1024 ** 2
+    planner = FakePlanner(10 ** 7, 10)
+    for dst in (100, 300, 700, 1500):
+        edges = dst * 10
+        src = dst + edges // 2
+        tuner.maxs = [memory_of(src, dst, edges)]
+        tuner.search(FakeBlock(src, dst, edges), planner)
+    curr_node, curr_edge = tuner.budget
+    # the next layer takes half the memory of every batch
+    nxt_node, nxt_edge = tuner.carry_over(lambda src, dst, edges: 0.5)
+    assert nxt_node == curr_node * 2 and nxt_edge == curr_edge * 2
+    assert abs(tuner.memory_model.predict(6000, 1000, 10000) - memory_of(6000, 1000, 10000) / 2) < 1e-3 * memory_of(6000, 1000, 10000)
+
+
+def test_auto_helper_cpu(random_graph, gcn):
+    g, feat = random_graph
+    model, expected = gcn
+    with torch.no_grad():
+        helper = AutoInferenceHelper(model, torch.device('cpu'), use_uva=False, free_rate=0.9, use_random=False)
+        helper.ret_shapes = helper._trace_output_shape((feat,))
+        pred = helper.inference(g, feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+def test_throughput_tuner_climbs_to_peak():
+    # edges per second peak at a budget of 40000 edges
+    rate = lambda edges: 1e6 / (1 + abs(np.log2(edges / 40000)))
+    tuner = ThroughputTuner(5000, memory_ceiling=float("inf"))
+    budget = tuner.budget
+    for _ in range(200):
+        if tuner.locked:
+            break
+        budget = tuner.observe(budget, budget / rate(budget), 0)
+    assert tuner.locked
+    assert 40000 / 1.5 <= tuner.best_edge <= 40000 * 1.5
+
+
+def test_throughput_tuner_memory_ceiling():
+    tuner = ThroughputTuner(5000, memory_ceiling=100)
+    budget = tuner.budget
+    for _ in range(200):
+        if tuner.locked:
+            break
+        # faster with larger batches, and over the ceiling above 20000 edges
+        budget = tuner.observe(budget, 1e-3, budget // 200)
+    assert tuner.locked and tuner.best_edge == 20000 and tuner.edge_ceiling == 20000
+
+
+def test_tuner_warm_start():
+    model = MemoryModel(min_samples=4)
+    for dst, edges in ((10, 100), (20, 250), (40, 380), (80, 900), (160, 1700)):
+        model.update(dst * 3, dst, edges, memory_of(dst * 3, dst, edges))
+    tuner = CPUAutoTuner()
+    tuner.warm_start({"max_node": 160, "max_edge": 1700, "memory_model": model.state_dict()})
+    # the calibration batches are skipped
+    assert tuner.budget == (160, 1700) and tuner.memory_model.fitted
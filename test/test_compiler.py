@@ -0,0 +1,43 @@
+import dgl
+import torch
+
+from inference_helper.compiler import CompiledConvBlock, pad_block, pad_rows, unpad_rows
+from inference_helper.utils import get_bucket
+
+
+def test_bucket_ladder():
+    buckets = set(get_bucket(n) for n in range(1, 100000))
+    assert len(buckets) <= 20
+    for n in (1, 64, 65, 1000, 99999):
+        assert n <= get_bucket(n) < 1.5 * max(n, 64) + 1
+
+
+def test_padded_block_keeps_outputs():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    input_nodes, output_nodes, blocks = sampler.sample_blocks(g, torch.arange(100, 200))
+    block = blocks[0]
+    feat = torch.rand(input_nodes.shape[0], 8)
+    conv = dgl.nn.GraphConv(8, 4).eval()
+    dst, src = block.num_dst_nodes(), block.num_src_nodes()
+    num_dst, num_src = get_bucket(dst + 1), get_bucket(dst + 1) + get_bucket(src - dst)
+    padded = pad_block(block, num_dst, num_src, get_bucket(block.num_edges() + num_dst - dst))
+    with torch.no_grad():
+        expected = conv(block, feat)
+        padded_feat = pad_rows(feat, dst, src, num_dst, num_src)
+        pred = unpad_rows(conv(padded, padded_feat), dst, src, num_dst, num_src)
+    assert torch.equal(unpad_rows(padded_feat, dst, src, num_dst, num_src), feat)
+    assert torch.allclose(pred, expected, atol=1e-6)
+
+
+def test_pad_args_by_edge_flags():
+    # as many src nodes as edges, the flags tell the edge features from the node features
+    block = dgl.create_block((torch.tensor([0, 1, 2, 3, 4]), torch.tensor([0, 1, 2, 0, 1])),
+                             num_src_nodes=5, num_dst_nodes=3)
+    feat, edge_weight = torch.rand(5, 8), torch.rand(5)
+    compiled = CompiledConvBlock(lambda *args: args, 0, edge_indexed=(False, False, True))
+    (padded, padded_feat, padded_weight), padding = compiled.pad_args((block, feat, edge_weight))
+    assert padded_feat.shape[0] == padded.num_src_nodes() and padded_weight.shape[0] == padded.num_edges()
+    assert torch.equal(unpad_rows(padded_feat, *padding), feat)
+    assert torch.equal(padded_weight[:5], edge_weight) and padded.num_src_nodes() != padded.num_edges()
@@ -0,0 +1,25 @@
+import dgl
+import torch
+
+from inference_helper import InferenceHelper
+
+
+def test_output_shapes_and_plan(make_gcn):
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 10000))
+    feat = torch.rand(1000, 16)
+    model = make_gcn(16, 8, 4).eval()
+    helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+    shapes = helper._trace_output_shape((feat,))
+    assert [tuple(shape) for _, shape in shapes[0]] == [(8,)]
+    assert [tuple(shape) for _, shape in shapes[1]] == [(4,)]
+
+    free_memory = 1024 ** 2
+    plan = helper.plan(g, feat, free_memory=free_memory)
+    assert len(plan) == 2
+    for layer in plan:
+        assert layer["bytes_per_src"] > 0
+        assert layer["peak_memory"] <= free_memory
+        assert layer["flops_per_dst"] > 0 and layer["time"] > 0
+    small = helper.plan(g, feat, free_memory=free_memory // 4)
+    assert small[0]["max_node"] < plan[0]["max_node"]
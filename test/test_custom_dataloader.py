@@ -0,0 +1,29 @@
+import dgl
+import torch
+
+from inference_helper import AutoInferenceHelper
+from inference_helper.custom_dataloader import get_degree_order
+
+
+def test_degree_order():
+    in_degrees = torch.tensor([1, 9, 2, 3, 40, 8, 1])
+    assert get_degree_order(in_degrees, "degree").tolist() == [4, 1, 5, 3, 2, 0, 6]
+    # 8 and 9, then 2 and 3 share a bucket and keep their order
+    assert get_degree_order(in_degrees, "degree-buckets").tolist() == [4, 1, 5, 2, 3, 0, 6]
+
+
+def test_auto_helper_degree_order(make_gcn):
+    torch.manual_seed(0)
+    src = torch.cat([torch.randint(0, 3000, (20000,)), torch.randint(0, 3000, (10000,))])
+    dst = torch.cat([torch.randint(0, 3000, (20000,)), torch.randint(0, 30, (10000,))])
+    g = dgl.add_self_loop(dgl.graph((src, dst), num_nodes=3000))
+    feat = torch.rand(3000, 16)
+    model = make_gcn(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g], feat)
+        for batch_order in ("degree", "degree-buckets"):
+            helper = AutoInferenceHelper(model, torch.device('cpu'), use_uva=False, free_rate=0.9, use_random=False)
+            helper.batch_order = batch_order
+            pred = helper.inference(g, feat)
+            assert torch.allclose(pred, expected, atol=1e-5)
+            assert helper.tuner_stats[0]["batches"] > 0
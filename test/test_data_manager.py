@@ -0,0 +1,13 @@
+import torch
+
+from inference_helper.data_manager import StagingBuffers
+
+
+def test_staging_buffers_reuse():
+    staging = StagingBuffers(max_classes=2)
+    feat = torch.rand(1000, 16)
+    for num_rows in (100, 110, 400, 120):
+        index = torch.randperm(1000)[:num_rows]
+        assert torch.equal(staging.gather("feat", feat, index), feat[index])
+    # 100, 110 and 120 rows share a class
+    assert staging.allocations == 2 and staging.reuses == 2
@@ -0,0 +1,36 @@
+import dgl
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from inference_helper import DistributedInferenceHelper
+
+WORLD_SIZE = 2
+
+
+def run_rank(rank, init_method, g, feat, model, results):
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=WORLD_SIZE)
+    with torch.no_grad():
+        helper = DistributedInferenceHelper(model, 500, torch.device('cpu'), halo_chunk_rows=300)
+        start, end = helper.partition(g)
+        pred = helper.inference(g, feat[start:end])
+    results[rank] = (start, end, pred, helper.dist_stats)
+    dist.destroy_process_group()
+
+
+def test_distributed_inference(tmp_path, make_sage):
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(3000, 20000))
+    feat = torch.rand(g.num_nodes(), 16)
+    model = make_sage(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g], feat)
+    results = mp.Manager().dict()
+    # every rank gets a copy of the graph, the features and the model
+    mp.spawn(run_rank, args=("file://{}".format(tmp_path / "store"), g, feat, model, results), nprocs=WORLD_SIZE)
+    assert sum(results[rank][1] - results[rank][0] for rank in range(WORLD_SIZE)) == g.num_nodes()
+    for rank in range(WORLD_SIZE):
+        start, end, pred, stats = results[rank]
+        assert torch.allclose(pred, expected[start:end], atol=1e-5)
+        assert stats["halo_rows"] > 0 and len(stats["layers"]) == 2
+        assert all(layer["bytes_received"] > 0 for layer in stats["layers"])
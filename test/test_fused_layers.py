@@ -0,0 +1,65 @@
+import dgl
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from inference_helper import InferenceHelper, WavefrontInferenceHelper
+
+
+class ThreeLayerSAGE(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.SAGEConv(in_feats, hidden, 'mean')
+        self.conv2 = dgl.nn.SAGEConv(hidden, hidden, 'mean')
+        self.conv3 = dgl.nn.SAGEConv(hidden, out_feats, 'mean')
+
+    def forward(self, blocks, x):
+        x = F.relu(self.conv1(blocks[0], x))
+        x = F.relu(self.conv2(blocks[1], x))
+        return self.conv3(blocks[2], x)
+
+
+def chain_and_random_graph(num_chain, num_random, num_random_edges):
+    # the chain nodes have a small 2-hop neighborhood, the random part a large one
+    chain_src = torch.arange(0, num_chain - 1)
+    random_src = num_chain + torch.randint(0, num_random, (num_random_edges,))
+    random_dst = num_chain + torch.randint(0, num_random, (num_random_edges,))
+    src = torch.cat([chain_src, random_src])
+    dst = torch.cat([chain_src + 1, random_dst])
+    return dgl.add_self_loop(dgl.graph((src, dst), num_nodes=num_chain + num_random))
+
+
+def test_fused_layers():
+    torch.manual_seed(0)
+    g = chain_and_random_graph(3000, 3000, 30000)
+    feat = torch.rand(g.num_nodes(), 16)
+    model = ThreeLayerSAGE(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g, g], feat)
+        helper = InferenceHelper(model, 500, torch.device('cpu'), num_workers=0)
+        helper.fuse_layers = 2
+        helper.fuse_batch_size = 500
+        pred = helper.inference(g, feat)
+    stats = helper.fusion_stats[0]
+    assert stats["layers"] == [0, 1]
+    assert stats["fused_batches"] > 0 and stats["fallback_nodes"] > 0
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+def test_wavefront_on_banded_graph():
+    torch.manual_seed(0)
+    num_nodes = 5000
+    dst = torch.arange(num_nodes).repeat_interleave(8)
+    src = (dst + torch.randint(-30, 31, dst.shape)).clamp(0, num_nodes - 1)
+    g = dgl.add_self_loop(dgl.graph((src, dst), num_nodes=num_nodes))
+    feat = torch.rand(num_nodes, 16)
+    model = ThreeLayerSAGE(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g, g], feat)
+        helper = WavefrontInferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        pred = helper.inference(g, feat)
+    stats = helper.wavefront_stats[0]
+    assert stats["layers"] == [0, 1, 2]
+    assert stats["bandwidth"] <= 30 and stats["switches"] > 0
+    assert all(rows < num_nodes // 4 for rows in stats["peak_rows"].values())
+    assert torch.allclose(pred, expected, atol=1e-5)
@@ -0,0 +1,321 @@
+import dgl
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from inference_helper import InferenceHelper, get_graph_meta, save_mmap_tensor
+
+
+class DegreeNormSAGE(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.SAGEConv(in_feats, hidden, 'mean')
+        self.conv2 = dgl.nn.SAGEConv(hidden, out_feats, 'mean')
+
+    def forward(self, blocks, x):
+        norm = blocks[0].in_degrees().float().clamp(min=1).pow(-0.5).unsqueeze(1)
+        x = F.relu(self.conv1(blocks[0], x)) * norm
+        norm = blocks[1].in_degrees().float().clamp(min=1).pow(-0.5).unsqueeze(1)
+        return self.conv2(blocks[1], x) * norm
+
+
+def test_hoist_graph_data():
+    torch.manual_seed(0)
+    g = dgl.rand_graph(1000, 8000)
+    feat = torch.rand(1000, 16)
+    model = DegreeNormSAGE(16, 8, 4).eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        assert helper._function_generator.hoisted is not None
+        assert len(helper._function_generator.hoisted_inputs) == 2
+        for func_src in helper._function_generator.func_srcs:
+            assert "in_degrees" not in func_src
+        pred = helper.inference(g, feat)
+        expected = model([g, g], feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class ReshapedDegreeNormSAGE(DegreeNormSAGE):
+    def forward(self, blocks, x):
+        # unsqueeze(0) moves the nodes to dim 1, reshape(-1, 1) keeps them in dim 0
+        norm = blocks[0].in_degrees().float().clamp(min=1).pow(-0.5).unsqueeze(0).t()
+        x = F.relu(self.conv1(blocks[0], x)) * norm
+        norm = blocks[1].in_degrees().float().clamp(min=1).pow(-0.5).reshape(-1, 1)
+        return self.conv2(blocks[1], x) * norm
+
+
+def test_hoist_keeps_rows():
+    torch.manual_seed(0)
+    g = dgl.rand_graph(1000, 8000)
+    feat = torch.rand(1000, 16)
+    model = ReshapedDegreeNormSAGE(16, 8, 4).eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        func_srcs = "".join(helper._function_generator.func_srcs)
+        assert "in_degrees" not in func_srcs
+        assert "unsqueeze" in func_srcs and "reshape" not in func_srcs
+        pred = helper.inference(g, feat)
+        expected = model([g, g], feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class RepeatedExpressions(nn.Module):
+    def __init__(self, in_feats, out_feats):
+        super().__init__()
+        self.weight = nn.Parameter(torch.rand(out_feats, in_feats))
+        self.conv = dgl.nn.GraphConv(out_feats, out_feats)
+
+    def forward(self, blocks, x):
+        h = torch.matmul(x, self.weight.t() * 2)
+        h = torch.sigmoid(h) + torch.sigmoid(h)
+        return self.conv(blocks[0], h)
+
+
+def test_fold_constants_and_cse():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    feat = torch.rand(1000, 16)
+    model = RepeatedExpressions(16, 8).eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        assert helper._function_generator.eliminated["folded"] == 2
+        assert helper._function_generator.eliminated["cse"] == 1
+        # the folded values are non-persistent buffers of the generator
+        folded = [name for name, _ in helper._function_generator.named_buffers() if name.startswith("_folded_")]
+        assert len(folded) > 0 and not any(name in helper._function_generator.state_dict() for name in folded)
+        pred = helper.inference(g, feat)
+        expected = model([g], feat)
+        assert torch.allclose(pred, expected, atol=1e-5)
+        # a second run reads the same folded values
+        assert torch.equal(helper.inference(g, feat), pred)
+
+
+class WideHidden(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.GraphConv(in_feats, hidden)
+        self.proj1 = nn.Linear(hidden, out_feats)
+        self.proj2 = nn.Linear(hidden, out_feats)
+        self.conv2 = dgl.nn.GraphConv(out_feats, out_feats)
+
+    def forward(self, blocks, x):
+        h = F.relu(self.conv1(blocks[0], x))
+        return self.conv2(blocks[1], self.proj1(h) + self.proj2(h))
+
+
+def test_min_cut_boundary():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    feat = torch.rand(1000, 16)
+    model = WideHidden(16, 64, 4).eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        # the projected sum is stored between the layers instead of the 64 wide hidden features
+        shapes = helper._trace_output_shape((feat,))
+        assert [tuple(shape) for _, shape in shapes[0]] == [(4,)]
+        pred = helper.inference(g, feat)
+        expected = model([g, g], feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class SkipConnection(nn.Module):
+    def __init__(self, in_feats, hidden):
+        super().__init__()
+        self.conv1 = dgl.nn.GraphConv(in_feats, hidden)
+        self.conv2 = dgl.nn.GraphConv(hidden, hidden)
+        self.conv3 = dgl.nn.GraphConv(hidden, hidden)
+
+    def forward(self, blocks, x):
+        h1 = self.conv1(blocks[0], x)
+        gate = torch.sigmoid(h1)
+        h2 = self.conv2(blocks[1], h1)
+        h3 = self.conv3(blocks[2], h2 + h1)
+        return h3 + gate[:blocks[2].number_of_dst_nodes()]
+
+
+def test_rematerialization():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    feat = torch.rand(1000, 16)
+    model = SkipConnection(16, 8).eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        shapes = helper._trace_output_shape((feat,))
+        # the gate is recomputed from h1 in the last layer, only h2 and h1 are stored
+        assert len(shapes[0]) == 1 and len(shapes[1]) == 1
+        pred = helper.inference(g, feat)
+        expected = model([g, g, g], feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class NormalizedMLPHead(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv = dgl.nn.GraphConv(in_feats, hidden)
+        self.dropout = nn.Dropout(0.5)
+        self.lin1 = nn.Linear(hidden, hidden)
+        self.bn = nn.BatchNorm1d(hidden)
+        self.act = nn.ReLU()
+        self.norm = nn.LayerNorm(hidden)
+        self.lin2 = nn.Linear(hidden, out_feats)
+
+    def forward(self, blocks, x):
+        h = self.dropout(self.conv(blocks[0], x))
+        h = F.relu(self.act(self.bn(self.lin1(h))))
+        return self.lin2(self.norm(h))
+
+
+def test_simplify_for_inference():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    feat = torch.rand(1000, 16)
+    model = NormalizedMLPHead(16, 8, 4)
+    model.bn.running_mean.uniform_(-1, 1)
+    model.bn.running_var.uniform_(0.5, 2)
+    model.eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        simplified = helper._function_generator.simplified
+        assert simplified == {"dropout": 1, "norms": 2, "activations": 2}
+        pred = helper.inference(g, feat)
+        expected = model([g], feat)
+        # the simplified forward matched the original one on the probe graph
+        assert helper._function_generator.unsimplified is not None
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class GatedHead(nn.Module):
+    def __init__(self, in_feats, out_feats):
+        super().__init__()
+        self.conv = dgl.nn.GraphConv(in_feats, out_feats)
+        self.lin = nn.Linear(out_feats, out_feats)
+
+    def forward(self, blocks, x):
+        h = self.conv(blocks[0], x)
+        return torch.sigmoid(self.lin(h)) * torch.tanh(self.lin(h))
+
+
+def test_activations_of_merged_producers():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    feat = torch.rand(1000, 16)
+    model = GatedHead(16, 8).eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        # the two lin calls are merged, so neither activation may write their shared output
+        assert helper._function_generator.eliminated["cse"] >= 1
+        assert helper._function_generator.simplified["activations"] == 0
+        assert not any("sigmoid_" in src or "tanh_" in src for src in helper._function_generator.func_srcs)
+        pred = helper.inference(g, feat)
+        expected = model([g], feat)
+        # the simplification was kept
+        assert helper._function_generator.unsimplified is not None
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class TwoLayerSAGEWithHead(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.SAGEConv(in_feats, hidden, 'mean')
+        self.conv2 = dgl.nn.SAGEConv(hidden, hidden, 'mean')
+        self.head = nn.Linear(hidden, out_feats)
+
+    def forward(self, blocks, x):
+        x = F.relu(self.conv1(blocks[0], x))
+        x = F.relu(self.conv2(blocks[1], x))
+        return self.head(x)
+
+
+def test_trailing_head_in_last_layer():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    feat = torch.rand(1000, 16)
+    model = TwoLayerSAGEWithHead(16, 8, 4).eval()
+    with torch.no_grad():
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        # the node-wise head runs in the batches of the last conv, no graph-free layer is left at the end
+        assert helper._schema.layers_count == 2
+        pred = helper.inference(g, feat)
+        expected = model([g, g], feat)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+class TwoLayerRGCN(nn.Module):
+    def __init__(self, rels, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.HeteroGraphConv({rel: dgl.nn.GraphConv(in_feats, hidden, allow_zero_in_degree=True) for rel in rels})
+        self.conv2 = dgl.nn.HeteroGraphConv({rel: dgl.nn.GraphConv(hidden, out_feats, allow_zero_in_degree=True)
+                                                  for rel in rels})
+
+    def forward(self, blocks):
+        x = {ntype: blocks[0].srcnodes[ntype].data['feat'] for ntype in blocks[0].srctypes}
+        h = self.conv1(blocks[0], x)
+        h = {ntype: F.relu(h[ntype]) for ntype in blocks[0].dsttypes}
+        return self.conv2(blocks[1], h)
+
+
+def test_hetero_graph_data():
+    torch.manual_seed(0)
+    g = dgl.heterograph({
+        ('user', 'follows', 'user'): (torch.randint(0, 300, (2000,)), torch.randint(0, 300, (2000,))),
+        ('user', 'clicks', 'item'): (torch.randint(0, 300, (3000,)), torch.randint(0, 200, (3000,))),
+        ('item', 'clicked-by', 'user'): (torch.randint(0, 200, (3000,)), torch.randint(0, 300, (3000,))),
+    })
+    g = dgl.add_self_loop(g, etype='follows')
+    g.nodes['user'].data['feat'] = torch.rand(300, 16)
+    g.nodes['item'].data['feat'] = torch.rand(200, 16)
+    model = TwoLayerRGCN(g.etypes, 16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g])
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0, graph_meta=get_graph_meta(g))
+        # the features are read from the graph by new inputs
+        assert sorted(helper._function_generator.graph_inputs.values()) == [('item', 'feat'), ('user', 'feat')]
+        pred = helper.inference(g)
+    for ntype in expected:
+        assert torch.allclose(pred[ntype], expected[ntype], atol=1e-5)
+
+
+class WeightedGCN(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.GraphConv(in_feats, hidden, norm='none')
+        self.conv2 = dgl.nn.GraphConv(hidden, out_feats, norm='none')
+
+    def forward(self, blocks, x, edge_weight):
+        x = F.relu(self.conv1(blocks[0], x, edge_weight=blocks[0].edata['w']))
+        return self.conv2(blocks[1], x, edge_weight=edge_weight)
+
+
+def test_edge_features(tmp_path):
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    g.edata['w'] = torch.rand(g.num_edges())
+    feat = torch.rand(1000, 16)
+    edge_weight = save_mmap_tensor(torch.rand(g.num_edges()), str(tmp_path / "edge_weight.bin"))
+    model = WeightedGCN(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g], feat, edge_weight)
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        assert list(helper._function_generator.edge_inputs.values()) == ['w']
+        pred = helper.inference(g, feat, edge_weight)
+    assert torch.allclose(pred, expected, atol=1e-5)
+
+
+def test_ambiguous_edge_arguments():
+    # a ring has as many edges as nodes
+    torch.manual_seed(0)
+    g = dgl.graph((torch.arange(1000), (torch.arange(1000) + 1) % 1000))
+    g.edata['w'] = torch.rand(g.num_edges())
+    feat = torch.rand(1000, 16)
+    edge_weight = torch.rand(g.num_edges())
+    model = WeightedGCN(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g], feat, edge_weight)
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        with pytest.raises(Exception, match="edge_args"):
+            helper.inference(g, feat, edge_weight)
+        helper = InferenceHelper(model, 100, torch.device('cpu'), num_workers=0)
+        helper.edge_args = ("edge_weight",)
+        pred = helper.inference(g, feat, edge_weight)
+    assert torch.allclose(pred, expected, atol=1e-5)
@@ -0,0 +1,54 @@
+import dgl
+import dgl.function as fn
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from inference_helper import AutoInferenceHelper
+from inference_helper.hub_block import HubBlock
+
+
+def star_graph(num_leaves, num_other_edges):
+    # node 0 has an in-edge from every other node
+    src = torch.cat([torch.arange(1, num_leaves + 1), torch.randint(0, num_leaves + 1, (num_other_edges,))])
+    dst = torch.cat([torch.zeros(num_leaves, dtype=torch.int64), torch.randint(1, num_leaves + 1, (num_other_edges,))])
+    return dgl.add_self_loop(dgl.graph((src, dst), num_nodes=num_leaves + 1))
+
+
+def test_partial_reducers_merge_exactly():
+    torch.manual_seed(0)
+    g = star_graph(5000, 2000)
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    input_nodes, output_nodes, blocks = sampler.sample_blocks(g, torch.arange(0, 20))
+    feat = torch.randn(input_nodes.shape[0], 8)
+    for reduce_func in (fn.sum, fn.mean, fn.max):
+        expected_block, hub_block = blocks[0], HubBlock.wrap(blocks[0], 300)
+        for block in (expected_block, hub_block):
+            block.srcdata['h'] = feat
+            block.update_all(fn.copy_u('h', 'm'), reduce_func('m', 'out'))
+        assert torch.allclose(hub_block.dstdata['out'], expected_block.dstdata['out'], atol=1e-4)
+
+
+class MeanPoolSAGE(nn.Module):
+    def __init__(self, in_feats, hidden, out_feats):
+        super().__init__()
+        self.conv1 = dgl.nn.SAGEConv(in_feats, hidden, 'mean')
+        self.conv2 = dgl.nn.SAGEConv(hidden, out_feats, 'pool')
+
+    def forward(self, blocks, x):
+        x = F.relu(self.conv1(blocks[0], x))
+        return self.conv2(blocks[1], x)
+
+
+def test_auto_helper_hub_nodes():
+    torch.manual_seed(0)
+    g = star_graph(20000, 40000)
+    feat = torch.rand(g.num_nodes(), 16)
+    model = MeanPoolSAGE(16, 8, 4).eval()
+    with torch.no_grad():
+        expected = model([g, g], feat)
+        helper = AutoInferenceHelper(model, torch.device('cpu'), use_uva=False, free_rate=0.9, use_random=False)
+        helper.hub_threshold = 1000
+        pred = helper.inference(g, feat)
+    assert helper.hub_stats["hubs"] == 1
+    assert torch.allclose(pred, expected, atol=1e-5)
@@ -0,0 +1,82 @@
+import dgl
+import pytest
+import torch
+import torch.nn as nn
+from dgl import DGLError, DGLHeteroGraph
+
+from inference_helper import AutoInferenceHelper
+from inference_helper.utils import split_block, get_edge_balanced_split, is_oom_error
+
+
+def test_is_oom_error():
+    assert is_oom_error(MemoryError())
+    assert is_oom_error(RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"))
+    assert is_oom_error(RuntimeError("[enforce fail at alloc_cpu.cpp] DefaultCPUAllocator: can't allocate memory"))
+    assert is_oom_error(DGLError("out of memory"))
+    assert not is_oom_error(RuntimeError("shape mismatch"))
+    assert not is_oom_error(ValueError("out of memory"))
+
+
+def test_split_block():
+    torch.manual_seed(0)
+    g = dgl.add_self_loop(dgl.rand_graph(1000, 8000))
+    sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
+    input_nodes, output_nodes, blocks = sampler.sample_blocks(g, torch.arange(100, 300))
+    block = blocks[0]
+    conv = dgl.nn.SAGEConv(8, 4, 'mean').eval()
+    feat = torch.rand(g.num_nodes(), 8)
+    mid = get_edge_balanced_split(block, 0, block.num_dst_nodes())
+    with torch.no_grad():
+        expected = conv(block, feat[input_nodes])
+        halves = []
+        for start, end in ((0, mid), (mid, block.num_dst_nodes())):
+            sub_input_nodes, sub_output_nodes, sub_block = split_block(block, input_nodes, output_nodes, start, end)
+            # the dst nodes are the prefix of the src nodes
+            assert torch.equal(sub_input_nodes[:end - start], sub_output_nodes)
+            assert sub_block.num_edges() == int(block.in_degrees()[start:end].sum())
+            halves.append(conv(sub_block, feat[sub_input_nodes]))
+    assert torch.allclose(torch.cat(halves), expected, atol=1e-6)
+
+
+def test_edge_balanced_split():
+    # in-degrees 1, 1, 1, 1, 8: the half of the edges is reached on the last node, at least one node is left
+    block = dgl.create_block((torch.arange(12), torch.tensor([0, 1, 2, 3] + [4] * 8)), num_src_nodes=12,
+                             num_dst_nodes=5)
+    assert get_edge_balanced_split(block, 0, 5) == 4
+    # even in-degrees are split in the middle
+    block = dgl.create_block((torch.arange(8), torch.arange(8) // 2), num_src_nodes=8, num_dst_nodes=4)
+    assert get_edge_balanced_split(block, 0, 4) == 2
+    assert get_edge_balanced_split(block, 1, 3) == 2
+
+
+class OneLayerSAGE(nn.Module):
+    def __init__(self, in_feats, out_feats):
+        super().__init__()
+        self.conv = dgl.nn.SAGEConv(in_feats, out_feats, 'mean')
+
+    def forward(self, blocks, x):
+        return self.conv(blocks[0], x)
+
+
+@pytest.mark.parametrize("debug", [False, True])
+def test_run_batch_bisect(debug, random_graph):
+    g, feat = random_graph
+    model = OneLayerSAGE(16, 4).eval()
+    with torch.no_grad():
+        expected = model([g], feat)
+        helper = AutoInferenceHelper(model, torch.device('cpu'), use_uva=False, free_rate=0.9, use_random=False,
+                                     debug=debug)
+        # the layer boundaries are planned here, so the function wrapped below is the one that runs
+        helper.ret_shapes = helper._trace_output_shape((feat,))
+        func = helper._funcs[0]
+
+        def oom_on_large_blocks(*args):
+            block = next(arg for arg in args if isinstance(arg, DGLHeteroGraph))
+            if block.num_edges() > 2000:
+                raise RuntimeError("CUDA out of memory. Tried to allocate 1.00 GiB")
+            return func(*args)
+
+        helper._funcs[0] = oom_on_large_blocks
+        pred = helper.inference(g, feat)
+    assert helper.oom_stats["retries"] > 0
+    assert torch.allclose(pred, expected, atol=1e-5)
@@ -0,0 +1,67 @@
+import json
+
+import torch
+
+from inference_helper.profiler import Profiler
+
+
+def run_layers(profiler):
+    for layer_id in range(2):
+        with profiler.layer(layer_id):
+            for batch in profiler.batches([1, 2, 3]):
+                with profiler.span("compute"):
+                    profiler.count("edges", 10 * batch)
+                profiler.count_bytes("bytes gathered", [torch.zeros(4, 2)])
+
+
+def test_profiler_aggregation():
+    profiler = Profiler()
+    run_layers(profiler)
+    summary = profiler.summary()
+    assert list(summary["layers"]) == [0, 1]
+    for stat in summary["layers"].values():
+        assert stat["phases"]["compute"]["count"] == 3
+        # the last fetch ends the iteration
+        assert stat["phases"]["sample"]["count"] == 4
+        assert stat["counters"] == {"edges": 60, "bytes gathered": 3 * 32}
+        assert stat["time"] >= stat["phases"]["compute"]["time"] + stat["phases"]["sample"]["time"]
+    assert summary["phases"]["layer"]["count"] == 2 and summary["phases"]["compute"]["count"] == 6
+    assert summary["counters"] == {"edges": 120, "bytes gathered": 6 * 32}
+    assert profiler.curr_layer is None and profiler.curr_batch is None
+    profiler.reset()
+    assert profiler.summary() == {"phases": {}, "counters": {}, "layers": {}}
+
+
+def test_profiler_chrome_trace(tmp_path):
+    profiler = Profiler()
+    run_layers(profiler)
+    path = str(tmp_path / "trace.json")
+    profiler.export_chrome_trace(path)
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+    counters = [event for event in events if event["ph"] == "C"]
+    assert len(spans) + len(counters) == len(events)
+    compute = [event for event in spans if event["name"] == "compute"]
+    assert [(event["cat"], event["args"]["batch"]) for event in compute] == \
+        [("layer0", 0), ("layer0", 1), ("layer0", 2), ("layer1", 0), ("layer1", 1), ("layer1", 2)]
+    assert all(event["dur"] >= 0 and event["ts"] >= 0 for event in spans)
+    # counters are cumulative
+    edges = [event["args"]["edges"] for event in counters if event["name"] == "edges"]
+    assert edges == [10, 30, 60, 70, 90, 120]
+
+
+def test_profiler_disabled(capsys):
+    profiler = Profiler(enabled=False)
+    batches = []
+    with profiler.layer(0):
+        for batch in profiler.batches([1, 2, 3]):
+            with profiler.span("compute"):
+                profiler.count("edges", batch)
+            profiler.count_bytes("bytes gathered", [torch.zeros(4, 2)])
+            batches.append(batch)
+    assert batches == [1, 2, 3]
+    assert profiler.events == [] and profiler.curr_layer is None and profiler.curr_batch is None
+    assert profiler.summary() == {"phases": {}, "counters": {}, "layers": {}}
+    profiler.show()
+    assert capsys.readouterr().out == ""
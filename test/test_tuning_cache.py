@@ -0,0 +1,74 @@
+import torch
+
+from inference_helper import AutoInferenceHelper, ThroughputInferenceHelper
+from inference_helper.tuning_cache import TuningCache
+
+
+class RecordingCache(TuningCache):
+    def __init__(self, path):
+        super().__init__(path)
+        self.hits = []
+
+    def get(self, key, layer_id, budget=None):
+        entry = super().get(key, layer_id, budget)
+        self.hits.append(entry)
+        return entry
+
+
+def test_tuning_cache_budget_tolerance(tmp_path):
+    cache = TuningCache(str(tmp_path / "tuning.json"))
+    key = TuningCache.make_key("plan", {"num_nodes": 10}, [(16,)], "cpu")
+    assert key == TuningCache.make_key("plan", {"num_nodes": 10}, [(16,)], "cpu")
+    cache.put(key, 0, 100, 1000, budget=8e9)
+    cache.save()
+    cache = TuningCache(str(tmp_path / "tuning.json"))
+    # the free memory moved a little between the runs
+    assert cache.get(key, 0, 8.5e9)["max_edge"] == 1000
+    assert cache.get(key, 0, 7.5e9)["max_edge"] == 1000
+    assert cache.get(key, 0, 4e9) is None
+    assert cache.get(key, 1, 8e9) is None
+
+
+def test_auto_helper_tuning_cache_round_trip(tmp_path, random_graph, gcn):
+    g, feat = random_graph
+    model, expected = gcn
+    cache_path = str(tmp_path / "tuning.json")
+    with torch.no_grad():
+        helper = AutoInferenceHelper(model, torch.device('cpu'), use_uva=False, free_rate=0.9, use_random=False,
+                                     tuning_cache=cache_path)
+        assert torch.allclose(helper.inference(g, feat), expected, atol=1e-5)
+        first_key = helper._cache_key
+        stored = TuningCache(cache_path).get(first_key, 0)
+        assert stored is not None
+
+        cache = RecordingCache(cache_path)
+        helper = AutoInferenceHelper(model, torch.device('cpu'), use_uva=False, free_rate=0.9, use_random=False,
+                                     tuning_cache=cache)
+        assert torch.allclose(helper.inference(g, feat), expected, atol=1e-5)
+    assert helper._cache_key == first_key
+    # the first layer started from the budget stored by the first run
+    assert cache.hits[0] is not None and cache.hits[0]["max_edge"] == stored["max_edge"]
+
+
+def test_throughput_helper_cache(tmp_path, random_graph, gcn):
+    g, feat = random_graph
+    model, expected = gcn
+    cache_path = str(tmp_path / "tuning.json")
+    with torch.no_grad():
+        helper = ThroughputInferenceHelper(model, torch.device('cpu'), start_max_edge=1000, tune_fraction=0.5,
+                                           tuning_cache=cache_path)
+        assert torch.allclose(helper.inference(g, feat), expected, atol=1e-5)
+        # less free memory is still the same key
+        helper = ThroughputInferenceHelper(model, torch.device('cpu'), start_max_edge=1000, memory_rate=0.5,
+                                           tuning_cache=cache_path)
+        assert torch.allclose(helper.inference(g, feat), expected, atol=1e-5)
+        assert all(stats["cached"] and len(stats["history"]) == 0 for stats in helper.throughput_stats.values())
+        # a budget measured at a peak over the memory ceiling is tuned again
+        cache = TuningCache(cache_path)
+        for entry in cache.entries[helper._cache_key].values():
+            assert "peak_memory" in entry
+            entry["peak_memory"] = float("inf")
+        helper = ThroughputInferenceHelper(model, torch.device('cpu'), start_max_edge=1000, tune_fraction=0.5,
+                                           tuning_cache=cache)
+        assert torch.allclose(helper.inference(g, feat), expected, atol=1e-5)
+        assert not any(stats["cached"] for stats in helper.throughput_stats.values())